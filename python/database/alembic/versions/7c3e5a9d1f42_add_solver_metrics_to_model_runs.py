@@ -0,0 +1,39 @@
+"""add solver metrics to model_runs
+
+Revision ID: 7c3e5a9d1f42
+Revises: 25c563b5a292
+Create Date: 2026-10-18 09:12:44.318207
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c3e5a9d1f42'
+down_revision: Union[str, None] = '25c563b5a292'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('model_runs', sa.Column('solver_status', sa.String(length=256), nullable=True))
+    op.add_column('model_runs', sa.Column('solver_time', sa.Float(), nullable=True))
+    op.add_column('model_runs', sa.Column('solver_nodes', sa.Integer(), nullable=True))
+    op.add_column('model_runs', sa.Column('solver_gap', sa.Float(), nullable=True))
+    op.add_column('model_runs', sa.Column('solver_hit_time_limit', sa.Boolean(), nullable=True))
+    op.add_column('model_runs', sa.Column('solver_first_incumbent_time', sa.Float(), nullable=True))
+    op.add_column('model_runs', sa.Column('presolve_deleted_vars', sa.Integer(), nullable=True))
+    op.add_column('model_runs', sa.Column('presolve_deleted_conss', sa.Integer(), nullable=True))
+
+def downgrade() -> None:
+    op.drop_column('model_runs', 'presolve_deleted_conss')
+    op.drop_column('model_runs', 'presolve_deleted_vars')
+    op.drop_column('model_runs', 'solver_first_incumbent_time')
+    op.drop_column('model_runs', 'solver_hit_time_limit')
+    op.drop_column('model_runs', 'solver_gap')
+    op.drop_column('model_runs', 'solver_nodes')
+    op.drop_column('model_runs', 'solver_time')
+    op.drop_column('model_runs', 'solver_status')
@@ -153,6 +153,30 @@ class ModelRun(ModelBase):
     success: bool = Column(Boolean, nullable=False, default=False)
     ''' True if this run completed successfully. '''
 
+    solver_status: str = Column(String(256), nullable=True)
+    ''' Why the solver stopped solving Model 1, read from its scip log, e.g. optimal solution found. '''
+
+    solver_time: float = Column(Float, nullable=True)
+    ''' The total time in seconds the solver took over all the models of this run. '''
+
+    solver_nodes: int = Column(Integer, nullable=True)
+    ''' The total number of branch and bound nodes solved over all the models of this run. '''
+
+    solver_gap: float = Column(Float, nullable=True)
+    ''' The largest final optimality gap of the models of this run, 0.02 for 2%. '''
+
+    solver_hit_time_limit: bool = Column(Boolean, nullable=True)
+    ''' True if the solver stopped at the time limit for any of the models of this run. '''
+
+    solver_first_incumbent_time: float = Column(Float, nullable=True)
+    ''' The time in seconds at which the solver found the first solution of Model 1. '''
+
+    presolve_deleted_vars: int = Column(Integer, nullable=True)
+    ''' The number of variables scip's presolve removed from Model 1. '''
+
+    presolve_deleted_conss: int = Column(Integer, nullable=True)
+    ''' The number of constraints scip's presolve removed from Model 1. '''
+
     # Relations
     model_config_id = mapped_column(ForeignKey('model_configs.id'), nullable=False)
     ''' The ModelConfig id that this run is the result of '''
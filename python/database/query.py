@@ -223,10 +223,11 @@ class Query:
         username: str,
         commit_hash: str,
         created_at: datetime=None,
+        solver_metrics: dict=None,
     ) -> models.ModelRun:
         '''
-        Creates a ModelRun instance in the database. Note: query.commit() must be
-        called for the object to be commited to the database.
+        Creates a ModelRun instance in the database, with the solver metrics columns in solver_metrics
+        if given. Note: query.commit() must be called for the object to be commited to the database.
         '''
 
         model_run = models.ModelRun(
@@ -236,6 +237,7 @@ class Query:
             username=username,
             commit_hash=commit_hash,
             created_at=created_at,
+            **(solver_metrics or {}),
         )
 
         session = self.get_session()
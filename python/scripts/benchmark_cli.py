@@ -0,0 +1,440 @@
+'''
+Command line util to benchmark parts of the model pipeline against a synthetic county.
+
+The synthetic county is a randomly generated distance data set with the same columns as the files
+written by build_distance_data. A scale of 1 is roughly the size of a small county, larger scales
+multiply the number of census blocks.
+'''
+
+import argparse
+import functools
+import os
+import tempfile
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+import pyomo.environ as pyo
+from haversine import haversine
+
+from python.solver.array_model import ArrayModel, array_model_factory, get_model_factory
+from python.solver.model_config import PollingModelConfig
+from python.solver.model_data import (
+    FULL_DISTANCE_DATA_DF_COLS, alpha_min, filter_distance_data, haversine_distances,
+)
+from python.solver.model_run import ModelRun
+from python.solver.model_solver import solve_model
+from python.solver.solver_backends import SOLVER_BACKENDS
+from python.solver.model_factory import (
+    build_capacity_rule, build_objective_rule, build_open_rule, build_pair_adjacency, build_res_assigned_rule,
+    polling_model_factory,
+)
+from python.solver.constants import (
+    DISTANCE_ID_ORIG, DISTANCE_ID_DEST, DISTANCE_ADDRESS, DISTANCE_DEST_LAT, DISTANCE_DEST_LON,
+    DISTANCE_ORIG_LAT, DISTANCE_ORIG_LON, DISTANCE_LOCATION_TYPE, DISTANCE_DEST_TYPE,
+    DISTANCE_TOTAL_POPULATION, DISTANCE_HISPANIC, DISTANCE_NON_HISPANIC, DISTANCE_WHITE, DISTANCE_BLACK,
+    DISTANCE_NATIVE, DISTANCE_ASIAN, DISTANCE_PACIFIC_ISLANDER, DISTANCE_OTHER, DISTANCE_MULTIPLE_RACES,
+    DISTANCE_DISTANCE_M, DISTANCE_SOURCE, DISTANCE_SOURCE_HAVERSINE_DISTANCE, DISTANCE_DEST_TYPE_POLLING,
+    DISTANCE_DEST_TYPE_POTENTIAL, TIGER20_BG_CENTROID, PD_CROSS,
+)
+
+BENCHMARK_HAVERSINE = 'haversine'
+BENCHMARK_MODEL_BUILD = 'model_build'
+BENCHMARK_MODEL_WRITE = 'model_write'
+BENCHMARK_ARRAY_MODEL = 'array_model'
+BENCHMARK_SOLVERS = 'solvers'
+BENCHMARKS = [
+    BENCHMARK_HAVERSINE, BENCHMARK_MODEL_BUILD, BENCHMARK_MODEL_WRITE, BENCHMARK_ARRAY_MODEL, BENCHMARK_SOLVERS,
+]
+
+SYNTHETIC_NUM_ORIGINS = 200
+''' Number of census blocks in the synthetic county at scale 1 '''
+SYNTHETIC_NUM_POLLING = 10
+SYNTHETIC_NUM_POTENTIAL = 10
+SYNTHETIC_NUM_CENTROIDS = 10
+SYNTHETIC_LOCATION_TYPE_POLLING = 'EV_2020_2022'
+SYNTHETIC_LOCATION_TYPE_POTENTIAL = 'Library - Potential'
+SYNTHETIC_CENTER = (33.95, -84.05)
+''' Roughly the center of Gwinnett County, GA '''
+SYNTHETIC_SPREAD_DEGREES = 0.2
+
+SYNTHETIC_YEAR = '2020'
+SYNTHETIC_LOCATION = 'Synthetic_County'
+
+DEFAULT_SEED = 157934
+DEFAULT_REPEAT = 3
+
+
+def make_synthetic_distance_df(scale: int=1, seed: int=DEFAULT_SEED, distances: bool=True) -> pd.DataFrame:
+    '''
+    Builds a random distance data set with the columns of the files written by build_distance_data.
+    The number of census blocks is SYNTHETIC_NUM_ORIGINS * scale. If distances is False the
+    distance_m and source columns are left out.
+    '''
+    rng = np.random.default_rng(seed)
+
+    num_origins = SYNTHETIC_NUM_ORIGINS * scale
+    num_dests = SYNTHETIC_NUM_POLLING + SYNTHETIC_NUM_POTENTIAL + SYNTHETIC_NUM_CENTROIDS
+
+    lat, lon = SYNTHETIC_CENTER
+    white = rng.integers(0, 80, num_origins)
+    black = rng.integers(0, 80, num_origins)
+    native = rng.integers(0, 5, num_origins)
+    asian = rng.integers(0, 30, num_origins)
+    pacific_islander = rng.integers(0, 3, num_origins)
+    other = rng.integers(0, 10, num_origins)
+    multiple_races = rng.integers(0, 10, num_origins)
+    population = white + black + native + asian + pacific_islander + other + multiple_races + 1
+    hispanic = rng.binomial(population, 0.1)
+
+    origins_df = pd.DataFrame({
+        DISTANCE_ID_ORIG: [f'13135{i:010d}' for i in range(num_origins)],
+        DISTANCE_ORIG_LAT: lat + rng.uniform(-SYNTHETIC_SPREAD_DEGREES, SYNTHETIC_SPREAD_DEGREES, num_origins),
+        DISTANCE_ORIG_LON: lon + rng.uniform(-SYNTHETIC_SPREAD_DEGREES, SYNTHETIC_SPREAD_DEGREES, num_origins),
+        DISTANCE_TOTAL_POPULATION: population,
+        DISTANCE_HISPANIC: hispanic,
+        DISTANCE_NON_HISPANIC: population - hispanic,
+        DISTANCE_WHITE: white,
+        DISTANCE_BLACK: black,
+        DISTANCE_NATIVE: native,
+        DISTANCE_ASIAN: asian,
+        DISTANCE_PACIFIC_ISLANDER: pacific_islander,
+        DISTANCE_OTHER: other,
+        DISTANCE_MULTIPLE_RACES: multiple_races,
+    })
+
+    location_types = (
+        [SYNTHETIC_LOCATION_TYPE_POLLING] * SYNTHETIC_NUM_POLLING
+        + [SYNTHETIC_LOCATION_TYPE_POTENTIAL] * SYNTHETIC_NUM_POTENTIAL
+        + [TIGER20_BG_CENTROID] * SYNTHETIC_NUM_CENTROIDS
+    )
+    dest_types = (
+        [DISTANCE_DEST_TYPE_POLLING] * SYNTHETIC_NUM_POLLING
+        + [DISTANCE_DEST_TYPE_POTENTIAL] * SYNTHETIC_NUM_POTENTIAL
+        + [TIGER20_BG_CENTROID] * SYNTHETIC_NUM_CENTROIDS
+    )
+    destinations_df = pd.DataFrame({
+        DISTANCE_ID_DEST: [f'Synthetic site {i}' for i in range(num_dests)],
+        DISTANCE_ADDRESS: [f'{i} Main St' for i in range(num_dests)],
+        DISTANCE_DEST_LAT: lat + rng.uniform(-SYNTHETIC_SPREAD_DEGREES, SYNTHETIC_SPREAD_DEGREES, num_dests),
+        DISTANCE_DEST_LON: lon + rng.uniform(-SYNTHETIC_SPREAD_DEGREES, SYNTHETIC_SPREAD_DEGREES, num_dests),
+        DISTANCE_LOCATION_TYPE: location_types,
+        DISTANCE_DEST_TYPE: dest_types,
+    })
+
+    distance_df = origins_df.merge(destinations_df, how=PD_CROSS)[FULL_DISTANCE_DATA_DF_COLS]
+
+    if distances:
+        distance_df[DISTANCE_DISTANCE_M] = haversine_distances(
+            distance_df[DISTANCE_ORIG_LAT], distance_df[DISTANCE_ORIG_LON],
+            distance_df[DISTANCE_DEST_LAT], distance_df[DISTANCE_DEST_LON],
+        )
+        distance_df[DISTANCE_SOURCE] = DISTANCE_SOURCE_HAVERSINE_DISTANCE
+
+    return distance_df
+
+
+def make_synthetic_config(**kwargs) -> PollingModelConfig:
+    '''
+    A config for the synthetic county similar to the testing configs. Any field can be overridden
+    with kwargs.
+    '''
+    config = {
+        'config_name': 'synthetic',
+        'config_set': 'synthetic',
+        'location': SYNTHETIC_LOCATION,
+        'year': [SYNTHETIC_YEAR],
+        'bad_types': [TIGER20_BG_CENTROID],
+        'beta': -1,
+        'time_limit': 360000,
+        'limits_gap': 0.02,
+        'census_year': SYNTHETIC_YEAR,
+        'precincts_open': None,
+        'maxpctnew': 1,
+        'minpctold': 0,
+        'max_min_mult': 1,
+        'capacity': 1.5,
+        'fixed_capacity_site_number': None,
+        'driving': False,
+    }
+    config.update(kwargs)
+
+    return PollingModelConfig(**config)
+
+
+def best_time(func, repeat: int) -> float:
+    ''' Returns the fastest wall time in seconds of repeat calls to func. '''
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        func()
+        times.append(perf_counter() - start)
+
+    return min(times)
+
+
+def benchmark_haversine(scale: int, repeat: int, chunk_size: int=None):
+    ''' Compares the row by row haversine calculation to the vectorized haversine_distances '''
+    distance_df = make_synthetic_distance_df(scale, distances=False)
+
+    def row_haversine():
+        return distance_df.apply(
+            lambda row: haversine((row.orig_lat, row.orig_lon), (row.dest_lat, row.dest_lon)),
+            axis=1,
+        ) * 1000
+
+    def vectorized_haversine():
+        return haversine_distances(
+            distance_df[DISTANCE_ORIG_LAT].to_numpy(),
+            distance_df[DISTANCE_ORIG_LON].to_numpy(),
+            distance_df[DISTANCE_DEST_LAT].to_numpy(),
+            distance_df[DISTANCE_DEST_LON].to_numpy(),
+            chunk_size=chunk_size,
+        )
+
+    max_difference = np.max(np.abs(row_haversine().to_numpy() - vectorized_haversine()))
+
+    row_time = best_time(row_haversine, repeat)
+    vectorized_time = best_time(vectorized_haversine, repeat)
+
+    print(f'haversine distances for {len(distance_df)} pairs (scale {scale}, chunk_size {chunk_size}):')
+    print(f'  row by row apply:  {row_time:.4f}s')
+    print(f'  vectorized:        {vectorized_time:.4f}s')
+    print(f'  speedup:           {row_time / vectorized_time:.1f}x')
+    print(f'  max difference:    {max_difference:.3e} m')
+
+
+def benchmark_model_build(scale: int, repeat: int):
+    ''' Times polling_model_factory on the synthetic county, with and without sparse pairs '''
+    distance_df = make_synthetic_distance_df(scale)
+
+    print(f'model build for {len(distance_df)} pairs (scale {scale}):')
+
+    for sparse_pairs in [False, True]:
+        config = make_synthetic_config(sparse_pairs=sparse_pairs)
+        dist_df = filter_distance_data(config, distance_df, False, False)
+        alpha = alpha_min(filter_distance_data(config, distance_df, True, False))
+        adjacency = build_pair_adjacency(config, dist_df)
+
+        build_model = functools.partial(polling_model_factory, dist_df, alpha, config, adjacency=adjacency)
+
+        build_time = best_time(build_model, repeat)
+        num_matching = len(build_model().matching)
+
+        print(f'  sparse_pairs={sparse_pairs!s:5}  {build_time:.4f}s  {num_matching} matching variables')
+
+
+def generate_model_expressions(model: pyo.ConcreteModel, obj_rule, open_rule, res_assigned_rule, capacity_rule):
+    ''' Generates the objective, open, residence assignment and capacity expressions of model '''
+    obj_rule(model)
+    open_rule(model)
+    for residence in model.residences:
+        res_assigned_rule(model, residence)
+    for precinct in model.precincts:
+        capacity_rule(model, precinct)
+
+
+def benchmark_model_write(scale: int, repeat: int):
+    '''
+    Times generating the objective, open, residence assignment and capacity expressions of the model
+    for the synthetic county, and writing the whole model to an NL file as the solver interface does.
+    '''
+    distance_df = make_synthetic_distance_df(scale)
+
+    print(f'model expressions and NL write for {len(distance_df)} pairs (scale {scale}):')
+
+    for sparse_pairs in [False, True]:
+        config = make_synthetic_config(sparse_pairs=sparse_pairs)
+        dist_df = filter_distance_data(config, distance_df, False, False)
+        alpha = alpha_min(filter_distance_data(config, distance_df, True, False))
+        model = polling_model_factory(dist_df, alpha, config)
+
+        total_pop = sum(pyo.value(model.population[residence]) for residence in model.residences)
+        precincts_open = SYNTHETIC_NUM_POLLING
+        obj_rule = build_objective_rule(config, total_pop, alpha)
+        open_rule = build_open_rule(precincts_open)
+        res_assigned_rule = build_res_assigned_rule()
+        capacity_rule = build_capacity_rule(config, total_pop, precincts_open)
+
+        generate_expressions = functools.partial(
+            generate_model_expressions, model, obj_rule, open_rule, res_assigned_rule, capacity_rule,
+        )
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            nl_path = os.path.join(tmp_dir, 'model.nl')
+            write_nl = functools.partial(model.write, nl_path, format='nl')
+
+            expression_time = best_time(generate_expressions, repeat)
+            write_time = best_time(write_nl, repeat)
+            nl_size = os.path.getsize(nl_path)
+
+        print(
+            f'  sparse_pairs={sparse_pairs!s:5}  expressions {expression_time:.4f}s'
+            f'  NL write {write_time:.4f}s  ({nl_size / 2**20:.1f} MiB)'
+        )
+
+
+def benchmark_array_model(scale: int, repeat: int):
+    '''
+    Compares building the sparse pyomo model and writing it to an NL file with building the same model
+    with array_model_factory and writing it to an MPS file.
+    '''
+    distance_df = make_synthetic_distance_df(scale)
+
+    config = make_synthetic_config(sparse_pairs=True)
+    dist_df = filter_distance_data(config, distance_df, False, False)
+    alpha = alpha_min(filter_distance_data(config, distance_df, True, False))
+    adjacency = build_pair_adjacency(config, dist_df)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        nl_path = os.path.join(tmp_dir, 'model.nl')
+        mps_path = os.path.join(tmp_dir, 'model.mps')
+
+        def pyomo_model():
+            polling_model_factory(dist_df, alpha, config, adjacency=adjacency).write(nl_path, format='nl')
+
+        def array_model():
+            array_model_factory(dist_df, alpha, config, adjacency=adjacency).write_mps(mps_path)
+
+        pyomo_time = best_time(pyomo_model, repeat)
+        array_time = best_time(array_model, repeat)
+        nl_size = os.path.getsize(nl_path)
+        mps_size = os.path.getsize(mps_path)
+
+    print(f'model build and write for {len(distance_df)} pairs (scale {scale}):')
+    print(f'  pyomo model to NL:  {pyomo_time:.4f}s  ({nl_size / 2**20:.1f} MiB)')
+    print(f'  array model to MPS: {array_time:.4f}s  ({mps_size / 2**20:.1f} MiB)')
+    print(f'  speedup:            {pyomo_time / array_time:.1f}x')
+
+
+def benchmark_solvers(
+    scale: int, repeat: int, config_paths: list[str]=None, array_model: bool=False, threads: int=None,
+):
+    '''
+    Times solving the model with each installed solver backend, on the synthetic county or, if
+    config_paths are given, on the model of each config (e.g. the test configs).
+    '''
+    if config_paths:
+        runs = []
+        for config_path in config_paths:
+            config = PollingModelConfig.load_config(config_path)
+            config.array_model = array_model
+            run_setup = ModelRun(config).run_setup
+            runs.append((config_path, config, run_setup.dist_df, run_setup.alpha, run_setup.adjacency))
+    else:
+        distance_df = make_synthetic_distance_df(scale)
+        config = make_synthetic_config(sparse_pairs=True, array_model=array_model, limits_gap=0)
+        dist_df = filter_distance_data(config, distance_df, False, False)
+        alpha = alpha_min(filter_distance_data(config, distance_df, True, False))
+        runs = [(f'synthetic county (scale {scale})', config, dist_df, alpha, build_pair_adjacency(config, dist_df))]
+
+    for name, config, dist_df, alpha, adjacency in runs:
+        model = get_model_factory(config)(dist_df, alpha, config, adjacency=adjacency)
+        model_type = 'array model' if isinstance(model, ArrayModel) else 'pyomo model'
+
+        print(f'solvers for {name}, {model_type}:')
+
+        for backend in SOLVER_BACKENDS.values():
+            if not isinstance(model, ArrayModel) and not backend.available():
+                print(f'  {backend.name:6} not installed')
+                continue
+
+            def solve():
+                # pylint: disable-next=cell-var-from-loop
+                solve_model(model, config.time_limit, config.limits_gap, solver=backend.name, threads=threads)
+
+            try:
+                solve_time = best_time(solve, repeat)
+            except ValueError as error:
+                print(f'  {backend.name:6} {error}')
+                continue
+
+            print(f'  {backend.name:6} {solve_time:.4f}s  objective {pyo.value(model.obj):.10g}')
+
+
+def main(args: argparse.Namespace):
+    ''' Main entrypoint '''
+
+    scales = args.scale or [1]
+
+    for scale in scales:
+        if args.benchmark == BENCHMARK_HAVERSINE:
+            benchmark_haversine(scale, args.repeat, args.chunk_size)
+        elif args.benchmark == BENCHMARK_MODEL_BUILD:
+            benchmark_model_build(scale, args.repeat)
+        elif args.benchmark == BENCHMARK_MODEL_WRITE:
+            benchmark_model_write(scale, args.repeat)
+        elif args.benchmark == BENCHMARK_ARRAY_MODEL:
+            benchmark_array_model(scale, args.repeat)
+        elif args.benchmark == BENCHMARK_SOLVERS:
+            benchmark_solvers(scale, args.repeat, args.config, args.array_model, args.threads)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description='A commandline tool to benchmark parts of the model pipeline against a synthetic county.',
+        epilog='''
+Examples:
+    To compare the row by row and vectorized haversine distance calculations on a synthetic county
+    ten times the base size:
+
+        python run.py benchmark_cli haversine -s 10
+
+    To time building the pyomo model for the synthetic county at 1, 10 and 50 times the base size:
+
+        python run.py benchmark_cli model_build -s 1 -s 10 -s 50
+
+    To time generating the model expressions and writing the model to an NL file:
+
+        python run.py benchmark_cli model_write -s 10
+
+    To compare building and writing the pyomo model with the array model:
+
+        python run.py benchmark_cli array_model -s 10 -s 50
+
+    To compare the solve time and objective of each installed solver on the test configs:
+
+        python run.py benchmark_cli solvers -r 1 --config datasets/configs/testing/*.yaml
+        '''
+    )
+    parser.add_argument('benchmark', choices=BENCHMARKS, help='The benchmark to run.')
+    parser.add_argument(
+        '-s',
+        '--scale',
+        type=int,
+        action='append',
+        help='Size of the synthetic county as a multiple of the base county. Can be repeated.',
+    )
+    parser.add_argument(
+        '-r',
+        '--repeat',
+        type=int,
+        default=DEFAULT_REPEAT,
+        help='How many times to repeat each timing, the fastest is reported.',
+    )
+    parser.add_argument(
+        '--chunk-size',
+        type=int,
+        default=None,
+        help='Chunk size for the vectorized haversine calculation.',
+    )
+    parser.add_argument(
+        '--config',
+        nargs='+',
+        default=None,
+        help='Config files to benchmark the solvers on instead of the synthetic county.',
+    )
+    parser.add_argument(
+        '--array-model',
+        action='store_true',
+        help='Benchmark the solvers on the array model instead of the pyomo model.',
+    )
+    parser.add_argument(
+        '--threads',
+        type=int,
+        default=None,
+        help='The number of threads the solvers may use.',
+    )
+
+    main(parser.parse_args())
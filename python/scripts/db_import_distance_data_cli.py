@@ -16,6 +16,7 @@ from python.database.query import Query
 from python.solver.model_data import build_distance_data
 from python.utils import is_int, log_date_prefix
 from python.solver.constants import DATA_SOURCE_DB
+from python.solver.spatial_index import DEFAULT_NEAREST_K
 from python.utils.environments import Environment, load_env
 from python.utils.directory_constants import DEFAULT_LOG_DIR
 
@@ -59,6 +60,8 @@ def build_and_import_distance_data(
     driving: bool,
     maps_source_date: str,
     log_distance: bool,
+    max_distance_m: float=None,
+    nearest_k: int=DEFAULT_NEAREST_K,
 ) -> ImportResult:
     build_distance_meta_data = build_distance_data(
         data_source=DATA_SOURCE_DB,
@@ -69,6 +72,8 @@ def build_and_import_distance_data(
         map_source_date=maps_source_date,
         log=False,
         query=query,
+        max_distance_m=max_distance_m,
+        nearest_k=nearest_k,
     )
     distance_data_set = query.create_db_distance_data_set(
         potential_locations_set_id=build_distance_meta_data.potential_locations_set_id,
@@ -120,6 +125,8 @@ def main(args: argparse.Namespace):
     else:
         map_source_date = None
     log_distance: bool = args.type == LOG
+    max_distance_m: float = args.max_distance
+    nearest_k: int = args.nearest_k
 
     if verbose:
         print(f'Writing logs to dir: {logdir}')
@@ -129,6 +136,8 @@ def main(args: argparse.Namespace):
     print('driving:', driving)
     print('map_source_date:', map_source_date)
     print('log_distance:', log_distance)
+    print('max_distance_m:', max_distance_m)
+    print('nearest_k:', nearest_k)
 
     if len(census_year) != 4 or not is_int(census_year):
         raise ValueError(f'Invalid election year {census_year}')
@@ -154,6 +163,8 @@ def main(args: argparse.Namespace):
                 driving=driving,
                 maps_source_date=map_source_date,
                 log_distance=log_distance,
+                max_distance_m=max_distance_m,
+                nearest_k=nearest_k,
             )
             results.append(result)
 
@@ -229,6 +240,21 @@ Examples:
     # driving distances since this is not fully implemented yet
     # pylint: disable-next=line-too-long
     parser.add_argument('-d', '--driving', action='store_true', help='Use driving distances for the specified date (YYYYMMDD)')
+    parser.add_argument(
+        '-m',
+        '--max-distance',
+        type=float,
+        default=None,
+        help='Only keep the pairs within this distance in meters, plus the nearest locations of each type. '
+            'Keeps every pair if not given. Use at least the max_min radius of the configs run on the data.',
+    )
+    parser.add_argument(
+        '-k',
+        '--nearest-k',
+        type=int,
+        default=DEFAULT_NEAREST_K,
+        help=f'With --max-distance, the nearest locations of each type kept per block (default {DEFAULT_NEAREST_K})',
+    )
     parser.add_argument('census_year', nargs=1, help='The year of the census data used to generate the distances')
     parser.add_argument('locations', nargs='+', help='One or more locations to import')
 
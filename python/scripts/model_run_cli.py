@@ -7,18 +7,27 @@
 ''' Command line util to run models '''
 
 import argparse
+import json
 from functools import partial
 from glob import glob
-from multiprocessing import Pool
 import os
 import sys
-
-from tqdm import tqdm
+from typing import Iterator
 
 from python.solver.model_config import PollingModelConfig
-from python.solver.model_run import ModelRun
+from python.solver.solver_backends import (
+    SOLVER_BACKENDS, SOLVER_EMPHASES, SOLVER_PRESOLVE_ON, SOLVER_PRESOLVE_OFF,
+)
+from python.solver.model_batch import override_configs, run_scheduled, run_sweep
+from python.solver.model_estimate import size_estimates_df
+from python.solver.model_run import ModelRun, OUT_TYPE_CSV
+from python.solver.model_sweep import group_sweep_configs
+from python.solver.run_manifest import RunManifest
 from python import utils
-from python.utils.directory_constants import DEFAULT_LOG_DIR, RESULTS_FOLDER_NAME
+from python.utils.directory_constants import DEFAULT_LOG_DIR, RESULTS_FOLDER_NAME, RUN_MANIFEST_DIR
+from python.utils.spans import (
+    METRICS_FILE_SUFFIX, Span, aggregate_spans, metrics_file_path, read_span_record, record_spans, write_span_record,
+)
 
 DEFAULT_MULTI_PROCESS_CONCURRENT = 1
 
@@ -64,19 +73,70 @@ def load_configs(config_paths: list[str], logdir: str) -> tuple[bool, list[Polli
     return (valid, results)
 
 
+def write_run_metrics(config: PollingModelConfig, root: Span):
+    ''' Writes the spans recorded for the run of config next to its log file '''
+    if not config.log_file_path:
+        return
+
+    write_span_record(
+        metrics_file_path(config.log_file_path),
+        root,
+        config_set=config.config_set,
+        config_name=config.config_name,
+        config_file_path=config.config_file_path,
+    )
+
+
+def write_batch_metrics(configs: list[PollingModelConfig], logdir: str, verbose=False):
+    '''
+    Writes the totals of the spans recorded for the runs of the configs, by stage, to a report in
+    logdir. The runs that did not finish, and so wrote no record, are left out.
+    '''
+    roots: list[Span] = []
+    for config in configs:
+        if config.log_file_path and os.path.isfile(metrics_file_path(config.log_file_path)):
+            roots.append(read_span_record(metrics_file_path(config.log_file_path))[1])
+    if not roots:
+        return
+
+    stages = aggregate_spans(roots)
+    report_path = os.path.join(logdir, f'{utils.log_date_prefix()}_batch{METRICS_FILE_SUFFIX}')
+    with open(report_path, 'w', encoding='utf-8') as report_file:
+        json.dump({'runs': len(roots), 'stages': stages}, report_file, indent=2)
+
+    print(f'Wrote the metrics of {len(roots)} run(s) to {report_path}')
+    if verbose:
+        for path, stats in stages.items():
+            cpu_time = stats['cpu_time'] + stats['children_cpu_time']
+            peak_rss = '-' if stats['max_peak_rss'] is None else f'{stats["max_peak_rss"] / 1024**3:.2f} GB'
+            print(
+                f'{path:<50} {stats["count"]:>5} x {stats["mean_wall_time"]:>8.2f}s, '
+                f'cpu {cpu_time:>9.2f}s, peak {peak_rss}'
+            )
+
+
 def run_config(
         config: PollingModelConfig,
         log: bool=False,
         verbose=False,
+        manifest: RunManifest=None,
+        sweep_runs: Iterator[ModelRun]=None,
 ):
-    ''' run a config file '''
+    '''
+    run a config file, recording it in the manifest once its results are written. In a sweep its
+    ModelRun is taken from sweep_runs, see run_sweep.
+    '''
 
     if verbose:
         results_path = os.path.join(RESULTS_FOLDER_NAME, config.config_set)
         print(f'Starting config: {config.config_file_path} -> CSV output to directory {results_path}')
 
-    model_run = ModelRun(config, log)
-    model_run.write_results_csv()
+    with record_spans(f'{config.config_set}/{config.config_name}') as root:
+        model_run = next(sweep_runs) if sweep_runs is not None else ModelRun(config, log)
+        result_files = model_run.write_results_csv()
+    write_run_metrics(config, root)
+    if manifest is not None:
+        manifest.mark_complete(model_run.run_hash(OUT_TYPE_CSV), config, OUT_TYPE_CSV, result_files)
 
     if verbose:
         print(f'Finished config: {config.config_file_path}')
@@ -102,18 +162,45 @@ def main(args: argparse.Namespace):
     if not valid:
         sys.exit(1)
 
+    override_configs(configs, args)
+
+    manifest = RunManifest(args.manifest_dir)
+    if args.resume:
+        num_configs = len(configs)
+        configs = manifest.incomplete_configs(configs, OUT_TYPE_CSV, verbose)
+        print(f'Resuming: skipping {num_configs - len(configs)} of {num_configs} config file(s) with complete results')
+
+    if args.dry_run:
+        # Report the size of each config's model without building or solving it
+        estimates_df = size_estimates_df(configs, verbose)
+        print(estimates_df.to_string(float_format='{:.1f}'.format))
+        print(
+            f'Estimated {estimates_df.peak_memory_gb.sum():.1f} GB of peak memory in total '
+            f'for {len(configs)} config(s)'
+        )
+        return
+
     total_files: int = len(configs)
 
+    # With --sweep the configs that share their data run one after the other as a sweep
+    if args.sweep:
+        run_func = partial(run_sweep, run_func=run_config, in_memory=not args.no_sweep_in_memory)
+        work = group_sweep_configs(configs)
+        if verbose:
+            print(f'Running {total_files} config file(s) as {len(work)} sweep(s)')
+    else:
+        run_func, work = run_config, configs
+
     if args.concurrent > 1:
         worker_func = partial(
-            run_config,
+            run_func,
             log=True,
-            verbose=verbose
+            verbose=verbose,
+            manifest=manifest,
         )
-        print(f'Running concurrent with a pool size of {args.concurrent} against {total_files} config file(s)')
-        with Pool(args.concurrent) as pool:
-            for _ in tqdm(pool.imap_unordered(worker_func, configs), total=total_files):
-                pass
+        if args.memory_budget is None:
+            print(f'Running concurrent with a pool size of {args.concurrent} against {total_files} config file(s)')
+        run_scheduled(worker_func, work, args.memory_budget, args.concurrent, verbose)
     else:
         # Disable function timers messages unless verbosity 2 or higher is set
         if verbose:
@@ -121,11 +208,13 @@ def main(args: argparse.Namespace):
 
             print(f'Running single process against {total_files} config file(s)')
 
-        for config_file in configs:
-            run_config(config_file, True, verbose)
+        for item in work:
+            run_func(item, log=True, verbose=verbose, manifest=manifest)
             if verbose:
                 print('--------------------------------------------------------------------------------')
 
+    write_batch_metrics(configs, logdir, verbose)
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -156,8 +245,105 @@ Examples:
         type=int,
         help='How many concurrent optimization processes to run at the same time.  ' +
             'Be mindful of ram availability - full runs can use in excess of 40 GB' +
-            ' for each concurrent process.')
+            ' for each concurrent process, see --memory-budget.')
+    parser.add_argument(
+        '--memory-budget',
+        type=float,
+        default=None,
+        help='With --concurrent, the memory in GB that the concurrent runs may use together. Each run ' +
+            'is started when its estimated peak memory fits, up to --concurrent at a time, and gets a ' +
+            'process of its own. Runs larger than the budget run alone.',
+    )
     parser.add_argument('-v', '--verbose', action='count', default=0, help='Print extra logging.')
+    parser.add_argument(
+        '-s',
+        '--sparse',
+        action='store_true',
+        help='Only build model variables for the residence, precinct pairs within the max_min radius. ' +
+            'Gives the same results with a much smaller model.',
+    )
+    parser.add_argument(
+        '--array-model',
+        action='store_true',
+        help='Build the model as arrays and write it straight to an MPS file for the solver instead of ' +
+            'building it with pyomo. Gives the same results, faster and with less memory.',
+    )
+    parser.add_argument(
+        '--in-memory',
+        action='store_true',
+        help='Build array models and solve them with scip or highs in this process, keeping the ' +
+            'model loaded between the solves of a run instead of writing a file for each.',
+    )
+    parser.add_argument(
+        '--no-warm-start',
+        action='store_true',
+        help='Solve the models of the penalty workflow from scratch instead of starting Model 2 and ' +
+            'Model 3 from the solutions of the earlier models, overriding the configs.',
+    )
+    parser.add_argument(
+        '--speculative',
+        action='store_true',
+        help='For penalized configs, solve Model 2 in a separate process while Model 1 solves instead ' +
+            'of after it. Uses an extra process, and the memory of a second model, per run.',
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Skip the configs whose results were already written completely, for the same config ' +
+            'and distance data, by an earlier run of this command.',
+    )
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='Print the number of residences, precincts, pairs within max_min, variables, constraints ' +
+            'and nonzeros of each config, with its estimated model file size and peak memory, ' +
+            'without building or solving any model.',
+    )
+    parser.add_argument(
+        '--manifest-dir',
+        type=str,
+        default=RUN_MANIFEST_DIR,
+        help='The directory to record the runs whose results were written completely in, for --resume.',
+    )
+    parser.add_argument(
+        '--sweep',
+        action='store_true',
+        help='Run the configs that share their location and data settings as a sweep, loading the ' +
+            'data once and starting each solve from the solution of the config before. With ' +
+            '--concurrent, each sweep runs in one process. Sweeps build array models and solve them ' +
+            'in memory when the solver supports it, see --no-sweep-in-memory.',
+    )
+    parser.add_argument(
+        '--no-sweep-in-memory',
+        action='store_true',
+        help='With --sweep, build each config of a sweep as the configs say instead of as an array ' +
+            'model solved in memory, rebuilding the whole model for each config.',
+    )
+    parser.add_argument(
+        '--solver',
+        choices=list(SOLVER_BACKENDS),
+        default=None,
+        help='The solver to use, overriding the configs. Defaults to scip.',
+    )
+    parser.add_argument(
+        '--solver-threads',
+        type=int,
+        default=None,
+        help='The number of threads the solver may use, overriding the configs.',
+    )
+    parser.add_argument(
+        '--solver-presolve',
+        choices=[SOLVER_PRESOLVE_ON, SOLVER_PRESOLVE_OFF],
+        default=None,
+        help='Turn the solver presolve on or off, overriding the configs.',
+    )
+    parser.add_argument(
+        '--solver-emphasis',
+        choices=SOLVER_EMPHASES,
+        default=None,
+        help='Have the solver focus on finding good solutions quickly (feasibility) or on proving ' +
+            'optimality (optimality), overriding the configs.',
+    )
     parser.add_argument(
         '-L',
         '--logdir',
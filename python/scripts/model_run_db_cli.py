@@ -10,24 +10,28 @@ files will be read from the db instead of from yaml files on disk, and all resul
 the db.
 '''
 
-from typing import Literal
+from typing import Iterator, Literal
 
 import argparse
 import datetime
-from multiprocessing import Pool
 import os
 from functools import partial
 import sys
 
-from tqdm import tqdm
-
 from python.database.query import Query
 from python.solver.model_config import PollingModelConfig
+from python.solver.solver_backends import (
+    SOLVER_BACKENDS, SOLVER_EMPHASES, SOLVER_PRESOLVE_ON, SOLVER_PRESOLVE_OFF,
+)
+from python.solver.model_batch import override_configs, run_scheduled, run_sweep
+from python.solver.model_estimate import size_estimates_df
 from python.solver.model_run import ModelRun, OUT_TYPE_CSV, OUT_TYPE_DB
+from python.solver.model_sweep import group_sweep_configs
+from python.solver.run_manifest import RunManifest
 from python.database.models import ModelConfig
 from python import utils
 from python.solver.constants import DATA_SOURCE_DB
-from python.utils.directory_constants import DEFAULT_LOG_DIR, RESULTS_FOLDER_NAME
+from python.utils.directory_constants import DEFAULT_LOG_DIR, RESULTS_FOLDER_NAME, RUN_MANIFEST_DIR
 from python.utils.environments import load_env, Environment
 
 DEFAULT_MULTI_PROCESS_CONCURRENT = 1
@@ -73,6 +77,8 @@ def load_configs(config_args: list[str], logdir: str, environment: Environment=N
             # Convert the db config into a polling model config object
             polling_model_config = query.create_polling_model_config(config)
             polling_model_config.environment = environment
+            # Set before the run so that --resume and --dry-run look at the data the run will use
+            polling_model_config.data_source = DATA_SOURCE_DB
 
             # Setup logs as needed
             # pylint: disable-next=line-too-long
@@ -91,13 +97,33 @@ def load_configs(config_args: list[str], logdir: str, environment: Environment=N
     return results
 
 
+def write_results(
+    model_run: ModelRun,
+    config: PollingModelConfig,
+    outtype: Literal['db', 'csv'],
+    manifest: RunManifest=None,
+):
+    ''' write the results of a model run, recording it in the manifest if they were written completely '''
+
+    if outtype == OUT_TYPE_DB:
+        model_run_id = model_run.write_results_db()
+        if manifest is not None and model_run_id is not None:
+            manifest.mark_complete(model_run.run_hash(outtype), config, outtype, model_run_id=model_run_id)
+    else:
+        result_files = model_run.write_results_csv()
+        if manifest is not None:
+            manifest.mark_complete(model_run.run_hash(outtype), config, outtype, result_files)
+
+
 def run_config(
     config: PollingModelConfig,
     log: bool=False,
     outtype: Literal['db', 'csv']=OUT_TYPE_DB,
     verbose=False,
+    manifest: RunManifest=None,
+    sweep_runs: Iterator[ModelRun]=None,
 ):
-    ''' run a config file '''
+    ''' run a config file, or in a sweep take its ModelRun from sweep_runs (see run_sweep) '''
 
     config_info = f'{config.db_id} {config.config_set}/{config.config_name}'
 
@@ -109,12 +135,9 @@ def run_config(
         print(f'Starting config: {config_info} -> CSV output to directory {results_path}')
 
     config.data_source = DATA_SOURCE_DB
-    model_run = ModelRun(config, log)
+    model_run = next(sweep_runs) if sweep_runs is not None else ModelRun(config, log)
 
-    if outtype == OUT_TYPE_DB:
-        model_run.write_results_db()
-    else:
-        model_run.write_results_csv()
+    write_results(model_run, config, outtype, manifest)
 
     if verbose:
         print(f'Finished config: {config_info}')
@@ -140,24 +163,48 @@ def main(args: argparse.Namespace):
     # Check that all files are valid, exist if they do not exist
     configs = load_configs(args.configs, logdir, environment)
 
+    override_configs(configs, args)
+
+    manifest = RunManifest(args.manifest_dir)
+    if args.resume:
+        num_configs = len(configs)
+        configs = manifest.incomplete_configs(configs, outtype, verbose)
+        print(f'Resuming: skipping {num_configs - len(configs)} of {num_configs} config(s) with complete results')
+
+    if args.dry_run:
+        # Report the size of each config's model without building or solving it
+        estimates_df = size_estimates_df(configs, verbose)
+        print(estimates_df.to_string(float_format='{:.1f}'.format))
+        print(
+            f'Estimated {estimates_df.peak_memory_gb.sum():.1f} GB of peak memory in total '
+            f'for {len(configs)} config(s)'
+        )
+        return
+
     total_files: int = len(configs)
 
+    # With --sweep the configs that share their data run one after the other as a sweep
+    if args.sweep:
+        run_func = partial(run_sweep, run_func=run_config, in_memory=not args.no_sweep_in_memory)
+        work = group_sweep_configs(configs)
+        if verbose:
+            print(f'Running {total_files} config(s) as {len(work)} sweep(s)')
+    else:
+        run_func, work = run_config, configs
+
     if args.concurrent > 1:
         worker_func = partial(
-            run_config,
+            run_func,
             log=True,
             outtype=outtype,
             verbose=verbose,
+            manifest=manifest,
         )
 
-        # pylint: disable-next=line-too-long
-        print(f'Running concurrent with a pool size of {args.concurrent} against {total_files} config file(s). Environment {environment}')
-        with Pool(args.concurrent) as pool:
-            for _ in tqdm(
-                pool.imap_unordered(worker_func, configs),
-                total=total_files,
-            ):
-                pass
+        if args.memory_budget is None:
+            # pylint: disable-next=line-too-long
+            print(f'Running concurrent with a pool size of {args.concurrent} against {total_files} config file(s). Environment {environment}')
+        run_scheduled(worker_func, work, args.memory_budget, args.concurrent, verbose)
     else:
         # Disable function timers messages unless verbosity 2 or higher is set
         if verbose:
@@ -165,9 +212,10 @@ def main(args: argparse.Namespace):
 
             print(f'Running single process against {total_files} config file(s)')
 
-        for config_file in configs:
-            print(f'Running config: {config_file.db_id} {config_file.config_set}/{config_file.config_name}')
-            run_config(config_file, True, outtype, verbose)
+        for item in work:
+            if not args.sweep:
+                print(f'Running config: {item.db_id} {item.config_set}/{item.config_name}')
+            run_func(item, log=True, outtype=outtype, verbose=verbose, manifest=manifest)
             if verbose:
                 print('--------------------------------------------------------------------------------')
 
@@ -208,8 +256,105 @@ Examples:
         type=int,
         help='How many concurrent optimization processes to run at the same time.  ' +
             'Be mindful of ram availability - full runs can use in excess of 40 GB' +
-            ' for each concurrent process.')
+            ' for each concurrent process, see --memory-budget.')
+    parser.add_argument(
+        '--memory-budget',
+        type=float,
+        default=None,
+        help='With --concurrent, the memory in GB that the concurrent runs may use together. Each run ' +
+            'is started when its estimated peak memory fits, up to --concurrent at a time, and gets a ' +
+            'process of its own. Runs larger than the budget run alone.',
+    )
     parser.add_argument('-v', '--verbose', action='count', default=0, help='Print extra logging.')
+    parser.add_argument(
+        '-s',
+        '--sparse',
+        action='store_true',
+        help='Only build model variables for the residence, precinct pairs within the max_min radius. ' +
+            'Gives the same results with a much smaller model.',
+    )
+    parser.add_argument(
+        '--array-model',
+        action='store_true',
+        help='Build the model as arrays and write it straight to an MPS file for the solver instead of ' +
+            'building it with pyomo. Gives the same results, faster and with less memory.',
+    )
+    parser.add_argument(
+        '--in-memory',
+        action='store_true',
+        help='Build array models and solve them with scip or highs in this process, keeping the ' +
+            'model loaded between the solves of a run instead of writing a file for each.',
+    )
+    parser.add_argument(
+        '--no-warm-start',
+        action='store_true',
+        help='Solve the models of the penalty workflow from scratch instead of starting Model 2 and ' +
+            'Model 3 from the solutions of the earlier models, overriding the configs.',
+    )
+    parser.add_argument(
+        '--speculative',
+        action='store_true',
+        help='For penalized configs, solve Model 2 in a separate process while Model 1 solves instead ' +
+            'of after it. Uses an extra process, and the memory of a second model, per run.',
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Skip the configs whose results were already written completely, for the same config ' +
+            'and distance data, by an earlier run of this command.',
+    )
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='Print the number of residences, precincts, pairs within max_min, variables, constraints ' +
+            'and nonzeros of each config, with its estimated model file size and peak memory, ' +
+            'without building or solving any model.',
+    )
+    parser.add_argument(
+        '--manifest-dir',
+        type=str,
+        default=RUN_MANIFEST_DIR,
+        help='The directory to record the runs whose results were written completely in, for --resume.',
+    )
+    parser.add_argument(
+        '--sweep',
+        action='store_true',
+        help='Run the configs that share their location and data settings as a sweep, loading the ' +
+            'data once and starting each solve from the solution of the config before. With ' +
+            '--concurrent, each sweep runs in one process. Sweeps build array models and solve them ' +
+            'in memory when the solver supports it, see --no-sweep-in-memory.',
+    )
+    parser.add_argument(
+        '--no-sweep-in-memory',
+        action='store_true',
+        help='With --sweep, build each config of a sweep as the configs say instead of as an array ' +
+            'model solved in memory, rebuilding the whole model for each config.',
+    )
+    parser.add_argument(
+        '--solver',
+        choices=list(SOLVER_BACKENDS),
+        default=None,
+        help='The solver to use, overriding the configs. Defaults to scip.',
+    )
+    parser.add_argument(
+        '--solver-threads',
+        type=int,
+        default=None,
+        help='The number of threads the solver may use, overriding the configs.',
+    )
+    parser.add_argument(
+        '--solver-presolve',
+        choices=[SOLVER_PRESOLVE_ON, SOLVER_PRESOLVE_OFF],
+        default=None,
+        help='Turn the solver presolve on or off, overriding the configs.',
+    )
+    parser.add_argument(
+        '--solver-emphasis',
+        choices=SOLVER_EMPHASES,
+        default=None,
+        help='Have the solver focus on finding good solutions quickly (feasibility) or on proving ' +
+            'optimality (optimality), overriding the configs.',
+    )
     parser.add_argument(
         '-L',
         '--logdir',
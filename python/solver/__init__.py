@@ -1,11 +1,25 @@
 ''' This module contains the files required to run the optimization solver. '''
 
 from . import (
+  array_model,
+  distance_matrix,
+  heuristic,
   model_data,
+  model_estimate,
   model_factory,
   model_penalties,
   model_results,
   model_run,
+  model_scheduler,
   model_solver,
+  model_sweep,
+  pair_adjacency,
+  persistent_solver,
   run_setup,
+  scip_log,
+  site_evaluator,
+  solver_backends,
+  spatial_index,
+  speculative_model,
+  warm_start,
 )
@@ -0,0 +1,541 @@
+'''
+An array based version of the polling location model that is written straight to an MPS file.
+
+The pyomo model built by polling_model_factory creates python objects for every variable, parameter
+and constraint term, which for large counties costs more time and memory than anything but the solve.
+All of the coefficients of the model are already columns of the distance data, so ArrayModel builds
+the same MIP as numpy arrays and a sparse constraint matrix, writes it to an MPS file for the solver,
+and maps the solution vector back to the matched (id_orig, id_dest) pairs.
+
+polling_model_factory remains the reference implementation; array_model_factory takes the same
+arguments and builds the same model.
+'''
+
+import math
+from dataclasses import dataclass
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix, csc_matrix, vstack
+
+from python.utils import timer
+
+from .constants import (
+    DISTANCE_ID_ORIG, DISTANCE_ID_DEST, DISTANCE_TOTAL_POPULATION, DISTANCE_DISTANCE_M,
+    DISTANCE_WEIGHTED_DIST, PD_MEAN, RESULT_KP_FACTOR, RESULT_NEW_LOCATION, RESULT_MATCHING,
+    SOLVER_BACKEND_HEURISTIC,
+)
+from .model_config import PollingModelConfig
+from .model_factory import (
+    add_pair_columns, get_linearization_points, get_max_min, get_max_population, get_old_polls,
+    get_pair_adjacency, get_penalized_sites, get_precincts_open, get_total_pop, polling_model_factory,
+)
+from .pair_adjacency import PairAdjacency
+
+MPS_OBJECTIVE_ROW = 'obj'
+''' The name of the objective row in written MPS files '''
+MPS_ROW_PREFIX = 'c'
+''' Constraint rows are named c0, c1, ... in written MPS files '''
+MPS_COLUMN_PREFIX = 'x'
+''' Variable columns are named x0, x1, ... in written MPS files '''
+MPS_FILE_NAME = 'model.mps'
+''' The name of the temporary MPS files models are written to for the solver '''
+
+SENSE_EQUAL = 'E'
+SENSE_LESS = 'L'
+SENSE_GREATER = 'G'
+
+
+@dataclass
+class SiteConstraints:
+    '''
+    The site selection constraints of an ArrayModel as array_model_factory built them, for solvers
+    that search the open sites directly instead of solving the constraint matrix
+    '''
+
+    population: np.ndarray
+    ''' The population of each residence '''
+    max_population: float
+    ''' The population each precinct can serve '''
+    precincts_open: int
+    ''' The number of precincts to open '''
+    new_locations: np.ndarray
+    ''' 1 for each precinct that is a new location, 0 for an existing polling location '''
+    max_new: float | None
+    ''' The most new locations that can be open, None if there is no limit '''
+    min_old: float | None
+    ''' The fewest existing polling locations that can be open, None if there is no limit '''
+    penalized: np.ndarray
+    ''' True for each penalized precinct '''
+    penalty_per_site: float | None
+    '''
+    The value of the penalty variable for each penalized precinct open, None if the model has no
+    penalty variables. The least penalty_exp is then the exponential of the penalty.
+    '''
+
+
+class ArrayModel:
+    '''
+    A mixed integer program over the matching variables of the residence, precinct pairs within
+    max_min, followed by the open variables of the precincts and, for penalized models, the
+    penalty_exp and penalty variables:
+
+        minimize    objective @ x + objective_offset
+        subject to  constraints @ x (row_senses) rhs
+                    0 <= x <= upper_bounds, x integer where integer is True
+    '''
+
+    residence_ids: pd.Index
+    ''' The id_orig of each residence '''
+    precinct_ids: pd.Index
+    ''' The id_dest of each precinct, in the order of the open variables '''
+    pair_residences: np.ndarray
+    ''' The residence position of each matching variable '''
+    pair_precincts: np.ndarray
+    ''' The precinct position of each matching variable '''
+    objective: np.ndarray
+    ''' The objective coefficient of each variable '''
+    objective_offset: float
+    ''' The constant term of the objective '''
+    constraints: csc_matrix
+    ''' The constraint coefficients, constraints x variables '''
+    row_senses: np.ndarray
+    ''' The sense of each constraint, one of E, L or G '''
+    rhs: np.ndarray
+    ''' The right hand side of each constraint '''
+    upper_bounds: np.ndarray
+    ''' The upper bound of each variable, inf if unbounded. All lower bounds are 0. '''
+    integer: np.ndarray
+    ''' True for the integer variables, which are all before the continuous ones '''
+    solution: np.ndarray = None
+    ''' The value of each variable once solved '''
+    start: np.ndarray = None
+    ''' The value of each variable in a known feasible solution for the solver to start from '''
+    sites: SiteConstraints = None
+    ''' The site selection constraints of the model, None if it was not built by array_model_factory '''
+
+    def __init__(
+        self,
+        residence_ids: pd.Index,
+        precinct_ids: pd.Index,
+        pair_residences: np.ndarray,
+        pair_precincts: np.ndarray,
+        objective: np.ndarray,
+        objective_offset: float,
+        constraints: csc_matrix,
+        row_senses: np.ndarray,
+        rhs: np.ndarray,
+        upper_bounds: np.ndarray,
+        integer: np.ndarray,
+        sites: SiteConstraints=None,
+    ):
+        num_variables = len(objective)
+        if constraints.shape != (len(rhs), num_variables):
+            raise ValueError(
+                # pylint: disable-next=line-too-long
+                f'Constraints shape {constraints.shape} does not match {len(rhs)} constraints and {num_variables} variables',
+            )
+        if np.any(np.diff(integer.astype(np.int8)) > 0):
+            raise ValueError('Integer variables must come before continuous variables')
+
+        self.residence_ids = residence_ids
+        self.precinct_ids = precinct_ids
+        self.pair_residences = pair_residences
+        self.pair_precincts = pair_precincts
+        self.objective = objective
+        self.objective_offset = objective_offset
+        self.constraints = constraints
+        self.row_senses = row_senses
+        self.rhs = rhs
+        self.upper_bounds = upper_bounds
+        self.integer = integer
+        self.sites = sites
+
+    @property
+    def num_pairs(self) -> int:
+        ''' The number of matching variables '''
+        return len(self.pair_residences)
+
+    @property
+    def num_variables(self) -> int:
+        return len(self.objective)
+
+    @property
+    def num_constraints(self) -> int:
+        return len(self.rhs)
+
+    @property
+    def open_positions(self) -> slice:
+        ''' The positions of the open variables of the precincts '''
+        return slice(self.num_pairs, self.num_pairs + len(self.precinct_ids))
+
+    @property
+    def obj(self) -> float:
+        ''' The objective value of the solution, like pyo.value(model.obj) of the pyomo model '''
+        if self.solution is None:
+            raise ValueError('The model has not been solved')
+
+        return float(self.objective @ self.solution) + self.objective_offset
+
+    def row_bounds(self) -> tuple[np.ndarray, np.ndarray]:
+        ''' The lower and upper bound of each constraint, -inf or inf where unbounded '''
+        lower = np.where(self.row_senses == SENSE_LESS, -np.inf, self.rhs)
+        upper = np.where(self.row_senses == SENSE_GREATER, np.inf, self.rhs)
+
+        return lower, upper
+
+    def same_constraints(self, other: 'ArrayModel') -> bool:
+        '''
+        True if other has the same variables and constraint coefficients as this model, so that it can
+        only differ in its bounds, right hand sides and objective.
+        '''
+        return (
+            self.constraints.shape == other.constraints.shape
+            and np.array_equal(self.integer, other.integer)
+            and np.array_equal(self.row_senses, other.row_senses)
+            and (self.constraints != other.constraints).nnz == 0
+        )
+
+    def set_solution(self, values: np.ndarray):
+        ''' Sets the value of each variable from a solver's solution '''
+        values = np.asarray(values, dtype=np.float64)
+        if values.shape != (self.num_variables,):
+            raise ValueError(f'Expected {self.num_variables} solution values, got {values.shape}')
+
+        self.solution = values
+
+    def matching_df(self) -> pd.DataFrame:
+        ''' The id_orig, id_dest and matching value of every matching variable, as incorporate_result uses '''
+        if self.solution is None:
+            raise ValueError('The model has not been solved')
+
+        return pd.DataFrame({
+            DISTANCE_ID_ORIG: self.residence_ids.to_numpy()[self.pair_residences],
+            DISTANCE_ID_DEST: self.precinct_ids.to_numpy()[self.pair_precincts],
+            RESULT_MATCHING: self.solution[:self.num_pairs],
+        })
+
+    def matched_pairs(self) -> tuple[np.ndarray, np.ndarray]:
+        ''' The id_orig and id_dest of each pair matched in the solution, read from the solution vector '''
+        if self.solution is None:
+            raise ValueError('The model has not been solved')
+
+        matched = np.flatnonzero(self.solution[:self.num_pairs] >= 0.5)
+
+        return (
+            self.residence_ids.to_numpy()[self.pair_residences[matched]],
+            self.precinct_ids.to_numpy()[self.pair_precincts[matched]],
+        )
+
+    def open_precincts(self) -> set:
+        ''' The id_dests of the precincts opened in the solution '''
+        if self.solution is None:
+            raise ValueError('The model has not been solved')
+
+        return set(self.precinct_ids[self.solution[self.open_positions] >= 0.5])
+
+    def start_by_name(self) -> dict:
+        ''' The nonzero start values keyed by their MPS column names '''
+        if self.start is None:
+            raise ValueError('The model has no start')
+
+        start = np.asarray(self.start)
+        columns = np.flatnonzero(start)
+
+        return dict(zip(self.column_names()[columns], start[columns].tolist()))
+
+    def row_names(self) -> np.ndarray:
+        ''' The names of the constraints in written MPS files '''
+        return _names(MPS_ROW_PREFIX, self.num_constraints)
+
+    def column_names(self) -> np.ndarray:
+        ''' The names of the variables in written MPS files '''
+        return _names(MPS_COLUMN_PREFIX, self.num_variables)
+
+    @timer
+    def write_mps(self, path: str):
+        ''' Writes the model to path in free MPS format '''
+        row_names = self.row_names()
+        column_names = self.column_names()
+
+        # The objective is written as the first row of the COLUMNS section, ahead of the constraints
+        matrix = vstack([csc_matrix(self.objective), self.constraints], format='csc')
+        matrix.eliminate_zeros()
+        matrix.sort_indices()
+        all_row_names = np.concatenate([[MPS_OBJECTIVE_ROW], row_names])
+
+        # Free MPS data lines start with a space, which the empty indent column gives
+        column_entries = pd.DataFrame({
+            'indent': '',
+            'column': np.repeat(column_names, np.diff(matrix.indptr)),
+            'row': all_row_names[matrix.indices],
+            'value': matrix.data,
+        })
+        num_integer_entries = matrix.indptr[np.count_nonzero(self.integer)]
+
+        rhs = pd.DataFrame({'indent': '', 'set': 'RHS', 'row': row_names, 'value': self.rhs})
+        rhs = rhs[rhs.value != 0]
+
+        bounded = np.isfinite(self.upper_bounds)
+        bounds = pd.DataFrame({
+            'indent': '',
+            'type': 'UP',
+            'set': 'BND',
+            'column': column_names[bounded],
+            'value': self.upper_bounds[bounded],
+        })
+
+        with open(path, 'w', encoding='utf-8') as mps_file:
+            mps_file.write('NAME polling_model\nROWS\n')
+            mps_file.write(f' N {MPS_OBJECTIVE_ROW}\n')
+            pd.DataFrame({'indent': '', 'sense': self.row_senses, 'row': row_names}).to_csv(
+                mps_file, sep=' ', header=False, index=False,
+            )
+
+            mps_file.write('COLUMNS\n')
+            mps_file.write(" MARKER 'MARKER' 'INTORG'\n")
+            column_entries.iloc[:num_integer_entries].to_csv(mps_file, sep=' ', header=False, index=False)
+            mps_file.write(" MARKER 'MARKER' 'INTEND'\n")
+            column_entries.iloc[num_integer_entries:].to_csv(mps_file, sep=' ', header=False, index=False)
+
+            mps_file.write('RHS\n')
+            rhs.to_csv(mps_file, sep=' ', header=False, index=False)
+
+            mps_file.write('BOUNDS\n')
+            bounds.to_csv(mps_file, sep=' ', header=False, index=False)
+
+            mps_file.write('ENDATA\n')
+
+    def set_solution_from_names(self, names: list[str], values: list[float]):
+        ''' Sets the solution from the values of the named MPS columns, missing columns are 0 '''
+        solution = np.zeros(self.num_variables)
+        positions = [int(name[len(MPS_COLUMN_PREFIX):]) for name in names]
+        solution[positions] = values
+
+        self.set_solution(solution)
+
+
+def _names(prefix: str, count: int) -> np.ndarray:
+    return np.array([f'{prefix}{i}' for i in range(count)], dtype=object)
+
+
+class _ConstraintRows:
+    ''' Collects blocks of constraint rows given as coordinates, to be stacked into one sparse matrix '''
+
+    def __init__(self, num_variables: int):
+        self.num_variables = num_variables
+        self.num_rows = 0
+        self._rows = []
+        self._columns = []
+        self._values = []
+        self._senses = []
+        self._rhs = []
+
+    def add(self, rows: np.ndarray, columns: np.ndarray, values: np.ndarray, num_rows: int, sense: str, rhs):
+        ''' Adds num_rows constraints, with coefficients at the given rows (from 0) and columns '''
+        self._rows.append(np.asarray(rows) + self.num_rows)
+        self._columns.append(np.asarray(columns))
+        self._values.append(np.broadcast_to(np.asarray(values, dtype=np.float64), np.shape(rows)))
+        self._senses.append(np.full(num_rows, sense, dtype=object))
+        self._rhs.append(np.broadcast_to(np.asarray(rhs, dtype=np.float64), (num_rows,)))
+        self.num_rows += num_rows
+
+    def matrix(self) -> csc_matrix:
+        return coo_matrix(
+            (np.concatenate(self._values), (np.concatenate(self._rows), np.concatenate(self._columns))),
+            shape=(self.num_rows, self.num_variables),
+        ).tocsc()
+
+    def senses(self) -> np.ndarray:
+        return np.concatenate(self._senses)
+
+    def rhs(self) -> np.ndarray:
+        return np.concatenate(self._rhs)
+
+
+@timer
+def array_model_factory(
+    distance_df,
+    alpha,
+    config: PollingModelConfig, *,
+    exclude_penalized_sites: bool=False,
+    site_penalty: float=0,
+    kp_penalty_parameter: float=0,
+    adjacency: PairAdjacency=None,
+) -> ArrayModel:
+    '''
+        Returns the polling location model as an ArrayModel. Takes the same arguments, and builds
+        the same model, as polling_model_factory with sparse_pairs.
+    '''
+
+    if site_penalty and not kp_penalty_parameter:
+        raise ValueError(f'kp_penalty_parameter must be positive if site_penalty is positive ({site_penalty=}')
+
+    max_min = get_max_min(config, distance_df)
+    adjacency = get_pair_adjacency(distance_df, max_min, adjacency)
+
+    old_polls = get_old_polls(distance_df)
+    precincts_open = get_precincts_open(config, distance_df, old_polls, exclude_penalized_sites)
+    total_pop = get_total_pop(distance_df)
+    penalized_sites = get_penalized_sites(config, distance_df)
+
+    add_pair_columns(config, alpha, distance_df)
+
+    residence_ids = adjacency.residence_ids
+    precinct_ids = adjacency.precinct_ids
+    num_precincts = len(precinct_ids)
+
+    #the pairs that can be matched, i.e. within the max_min radius
+    pair_df = distance_df[distance_df[DISTANCE_DISTANCE_M] <= max_min]
+    pair_residences = residence_ids.get_indexer(pair_df[DISTANCE_ID_ORIG])
+    pair_precincts = precinct_ids.get_indexer(pair_df[DISTANCE_ID_DEST])
+    num_pairs = len(pair_df)
+
+    population = distance_df.groupby(DISTANCE_ID_ORIG)[DISTANCE_TOTAL_POPULATION].agg(PD_MEAN)
+    population = population.reindex(residence_ids).to_numpy(dtype=np.float64)
+
+    new_locations = pd.Series(
+        distance_df[RESULT_NEW_LOCATION].to_numpy(), index=distance_df[DISTANCE_ID_DEST],
+    )
+    new_locations = new_locations[~new_locations.index.duplicated()]
+    new_locations = new_locations.reindex(precinct_ids).to_numpy(dtype=np.float64)
+
+    penalized = precinct_ids.isin(penalized_sites)
+
+    #variables: matching of each pair, open of each precinct, then penalty_exp and penalty
+    pair_columns = np.arange(num_pairs)
+    open_columns = num_pairs + np.arange(num_precincts)
+    num_variables = num_pairs + num_precincts
+    if site_penalty:
+        penalty_exp_column = num_variables
+        penalty_column = num_variables + 1
+        num_variables += 2
+
+    integer = np.zeros(num_variables, dtype=bool)
+    integer[:num_pairs + num_precincts] = True
+    upper_bounds = np.full(num_variables, np.inf)
+    upper_bounds[:num_pairs + num_precincts] = 1
+
+    #optionally exclude penalized sites
+    if exclude_penalized_sites:
+        upper_bounds[open_columns[penalized]] = 0
+
+    #objective
+    objective = np.zeros(num_variables)
+    objective_offset = 0.0
+    if config.beta:
+        #take average by kp factor weight
+        objective[pair_columns] = (
+            population[pair_residences] * pair_df[RESULT_KP_FACTOR].to_numpy(dtype=np.float64) / total_pop
+        )
+        if site_penalty:
+            penalty_factor = math.exp(-config.beta * alpha * kp_penalty_parameter)
+            objective[penalty_exp_column] = penalty_factor
+            objective_offset = -penalty_factor
+    else:
+        #take average populated weighted distance
+        objective[pair_columns] = pair_df[DISTANCE_WEIGHTED_DIST].to_numpy(dtype=np.float64) / total_pop
+        if site_penalty:
+            objective[open_columns[penalized]] = site_penalty
+
+    rows = _ConstraintRows(num_variables)
+
+    #Can have exactly precincts_open number of open precincts
+    rows.add(np.zeros(num_precincts, dtype=np.int64), open_columns, 1, 1, SENSE_EQUAL, precincts_open)
+
+    if site_penalty:
+        #penalty == -alpha * beta * site_penalty * open penalized sites
+        penalized_columns = open_columns[penalized]
+        rows.add(
+            np.zeros(len(penalized_columns) + 1, dtype=np.int64),
+            np.append(penalized_columns, penalty_column),
+            np.append(np.full(len(penalized_columns), alpha * config.beta * site_penalty), 1),
+            1, SENSE_EQUAL, 0,
+        )
+
+        #penalty_exp >= exp(point) * (1 + penalty - point) at each linearization point
+        points = np.array(get_linearization_points(alpha, config.beta, site_penalty, np.count_nonzero(penalized)))
+        num_points = len(points)
+        rows.add(
+            np.repeat(np.arange(num_points), 2),
+            np.tile([penalty_exp_column, penalty_column], num_points),
+            np.column_stack([np.ones(num_points), -np.exp(points)]).ravel(),
+            num_points, SENSE_GREATER, np.exp(points) * (1 - points),
+        )
+
+    max_population = get_max_population(config, total_pop, precincts_open)
+    max_new = None
+    min_old = None
+
+    #percent of new precincts not to exceed maxpctnew, skip if no new locations in data
+    if new_locations.any():
+        max_new = config.maxpctnew * precincts_open
+        new_columns = open_columns[new_locations != 0]
+        rows.add(
+            np.zeros(len(new_columns), dtype=np.int64), new_columns, new_locations[new_locations != 0],
+            1, SENSE_LESS, max_new,
+        )
+
+    #percent of established precincts not to dip below minpctold, skip if set to 0
+    if config.minpctold != 0:
+        min_old = config.minpctold * old_polls
+        old_columns = open_columns[new_locations != 1]
+        rows.add(
+            np.zeros(len(old_columns), dtype=np.int64), old_columns, 1 - new_locations[new_locations != 1],
+            1, SENSE_GREATER, min_old,
+        )
+
+    #assigns each census block to a single precinct in its neighborhood
+    rows.add(pair_residences, pair_columns, 1, len(residence_ids), SENSE_EQUAL, 1)
+
+    #residences can only be covered by precincts that are opened
+    rows.add(
+        np.repeat(np.arange(num_pairs), 2),
+        np.column_stack([pair_columns, open_columns[pair_precincts]]).ravel(),
+        np.tile([1.0, -1.0], num_pairs),
+        num_pairs, SENSE_LESS, 0,
+    )
+
+    #Each polling location can serve a max population
+    rows.add(
+        pair_precincts, pair_columns, population[pair_residences],
+        num_precincts, SENSE_LESS, max_population,
+    )
+
+    return ArrayModel(
+        residence_ids=residence_ids,
+        precinct_ids=precinct_ids,
+        pair_residences=pair_residences,
+        pair_precincts=pair_precincts,
+        objective=objective,
+        objective_offset=objective_offset,
+        constraints=rows.matrix(),
+        row_senses=rows.senses(),
+        rhs=rows.rhs(),
+        upper_bounds=upper_bounds,
+        integer=integer,
+        sites=SiteConstraints(
+            population=population,
+            max_population=max_population,
+            precincts_open=precincts_open,
+            new_locations=new_locations,
+            max_new=max_new,
+            min_old=min_old,
+            penalized=penalized,
+            penalty_per_site=-alpha * config.beta * site_penalty if site_penalty else None,
+        ),
+    )
+
+
+def uses_array_model(config: PollingModelConfig) -> bool:
+    ''' True if the config asks for an array model, an in-memory solver or the heuristic solver '''
+    return config.array_model or config.solver_in_memory or config.solver == SOLVER_BACKEND_HEURISTIC
+
+
+def get_model_factory(config: PollingModelConfig) -> Callable:
+    '''
+    array_model_factory if the config's model is an ArrayModel (see uses_array_model), otherwise
+    polling_model_factory
+    '''
+    return array_model_factory if uses_array_model(config) else polling_model_factory
@@ -34,6 +34,10 @@ CONFIG_FILE_PATH = 'config_file_path'
 CONFIG_LOG_FILE_PATH = 'log_file_path'
 CONFIG_MAP_SOURCE_DATE = 'map_source_date'
 CONFIG_LOCATION_SOURCE = 'data_source'
+CONFIG_SPARSE_PAIRS = 'sparse_pairs'
+CONFIG_ARRAY_MODEL = 'array_model'
+CONFIG_SOLVER_IN_MEMORY = 'solver_in_memory'
+CONFIG_SPECULATIVE_PENALTY = 'speculative_penalty'
 
 # Potential locations data related constants
 POT_LOC_LOCATION = 'Location'
@@ -75,6 +79,9 @@ DISTANCE_SOURCE_DRIVING_DISTANCE = 'driving distance'
 DISTANCE_SOURCE_LOG_WITH_SPACE = 'log '
 ''' A type value for the LOC_LOCATION_TYPE field that works with other types (e.g. "log haversine distance") '''
 
+HAVERSINE_EARTH_RADIUS_KM = 6371.0088
+''' Mean earth radius in km, the same value used by the haversine package '''
+
 POT_LOC_LOCATION_TYPE_POTENTIAL_SUBSTR = 'Potential'
 ''' A flag in the field POTENTIAL_LOC_LOCATION_TYPE indicating a potential location '''
 DISTANCE_LOCATION_TYPE_CENTROID_SUBSTR = 'centroid'
@@ -137,6 +144,15 @@ DB_LOCATION_TYPE = 'location_type'
 DB_LAT_LON = 'lat_lon'
 
 # Solver related constants
+SOLVER_MODEL1 = 'model1'
 SOLVER_MODEL2 = 'model2'
 SOLVER_MODEL3 = 'model3'
 SOLVER_PENALTY = 'penalty'
+
+# Solver backends and settings
+SOLVER_BACKEND_SCIP = 'scip'
+SOLVER_BACKEND_HIGHS = 'highs'
+SOLVER_BACKEND_CBC = 'cbc'
+SOLVER_BACKEND_HEURISTIC = 'heuristic'
+SOLVER_EMPHASIS_FEASIBILITY = 'feasibility'
+SOLVER_EMPHASIS_OPTIMALITY = 'optimality'
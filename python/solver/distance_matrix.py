@@ -0,0 +1,459 @@
+'''
+A compact origin x destination representation of distance data.
+
+The distance files hold one row per (id_orig, id_dest) pair, so every demographic, address and
+coordinate column is repeated for every pair. DistanceMatrix instead keeps a dense
+origins x destinations array of distances next to one table of origins (population and demographics)
+and one table of destinations (type, address and coordinates). The long form is only built when asked
+for with to_distance_df.
+'''
+
+from dataclasses import dataclass
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+
+from .constants import (
+    DISTANCE_ID_ORIG, DISTANCE_ID_DEST, DISTANCE_ADDRESS, DISTANCE_DEST_LAT, DISTANCE_DEST_LON,
+    DISTANCE_ORIG_LAT, DISTANCE_ORIG_LON, DISTANCE_LOCATION_TYPE, DISTANCE_DEST_TYPE,
+    DISTANCE_TOTAL_POPULATION, DISTANCE_HISPANIC, DISTANCE_NON_HISPANIC, DISTANCE_WHITE, DISTANCE_BLACK,
+    DISTANCE_NATIVE, DISTANCE_ASIAN, DISTANCE_PACIFIC_ISLANDER, DISTANCE_OTHER, DISTANCE_MULTIPLE_RACES,
+    DISTANCE_DISTANCE_M, DISTANCE_SOURCE,
+)
+
+DISTANCE_MATRIX_DTYPE = np.dtype(np.float32)
+''' The default dtype for the distances array '''
+
+ORIGIN_COLS = [
+    DISTANCE_ORIG_LAT,
+    DISTANCE_ORIG_LON,
+    DISTANCE_TOTAL_POPULATION,
+    DISTANCE_HISPANIC,
+    DISTANCE_NON_HISPANIC,
+    DISTANCE_WHITE,
+    DISTANCE_BLACK,
+    DISTANCE_NATIVE,
+    DISTANCE_ASIAN,
+    DISTANCE_PACIFIC_ISLANDER,
+    DISTANCE_OTHER,
+    DISTANCE_MULTIPLE_RACES,
+]
+''' Columns of the distance data that only depend on id_orig '''
+
+DESTINATION_COLS = [
+    DISTANCE_ADDRESS,
+    DISTANCE_DEST_LAT,
+    DISTANCE_DEST_LON,
+    DISTANCE_LOCATION_TYPE,
+    DISTANCE_DEST_TYPE,
+]
+''' Columns of the distance data that only depend on id_dest '''
+
+LONG_FORM_COLS = [
+    DISTANCE_ID_ORIG,
+    DISTANCE_ID_DEST,
+    DISTANCE_ADDRESS,
+    DISTANCE_DEST_LAT,
+    DISTANCE_DEST_LON,
+    DISTANCE_ORIG_LAT,
+    DISTANCE_ORIG_LON,
+    DISTANCE_LOCATION_TYPE,
+    DISTANCE_DEST_TYPE,
+    DISTANCE_TOTAL_POPULATION,
+    DISTANCE_HISPANIC,
+    DISTANCE_NON_HISPANIC,
+    DISTANCE_WHITE,
+    DISTANCE_BLACK,
+    DISTANCE_NATIVE,
+    DISTANCE_ASIAN,
+    DISTANCE_PACIFIC_ISLANDER,
+    DISTANCE_OTHER,
+    DISTANCE_MULTIPLE_RACES,
+    DISTANCE_DISTANCE_M,
+    DISTANCE_SOURCE,
+]
+''' The column order of the long form distance data, matching the files written by build_distance_data '''
+
+
+@dataclass
+class DistanceMatrix:
+    '''
+    Distance data stored as an origins x destinations array of distances plus one table describing
+    the origins and one describing the destinations.
+    '''
+
+    distances: np.ndarray
+    ''' num_origins x num_destinations array of distances in meters. NaN marks a missing distance. '''
+    origins: pd.DataFrame
+    ''' Indexed by id_orig in the row order of distances, holds the ORIGIN_COLS that are available '''
+    destinations: pd.DataFrame
+    ''' Indexed by id_dest in the column order of distances, holds the DESTINATION_COLS that are available '''
+    source: str = None
+    ''' The type of distance (e.g. "haversine distance"), written to the source column in long form '''
+    pairs: np.ndarray = None
+    '''
+    Boolean array marking the pairs that are part of the distance data, None if every pair is. A pair
+    that is part of it without a distance is missing, unlike one that is not part of it.
+    '''
+    columns: list[str] = None
+    ''' The long form columns in the order of the distance data it was built from, None for LONG_FORM_COLS '''
+
+    def __post_init__(self):
+        if self.distances.shape != (len(self.origins), len(self.destinations)):
+            raise ValueError(
+                # pylint: disable-next=line-too-long
+                f'Distances shape {self.distances.shape} does not match {len(self.origins)} origins and {len(self.destinations)} destinations',
+            )
+        if self.pairs is not None and self.pairs.shape != self.distances.shape:
+            raise ValueError(f'Pairs shape {self.pairs.shape} does not match distances shape {self.distances.shape}')
+
+    @classmethod
+    def from_tables(
+        cls,
+        origins: pd.DataFrame,
+        destinations: pd.DataFrame,
+        distances: np.ndarray=None,
+        source: str=None,
+        dtype=DISTANCE_MATRIX_DTYPE,
+    ) -> 'DistanceMatrix':
+        '''
+        Builds a DistanceMatrix from origins and destinations tables with id_orig and id_dest columns
+        (or indexes). If distances is not given, all distances start out missing.
+        '''
+        origins, destinations = prepare_tables(origins, destinations)
+
+        if distances is None:
+            distances = np.full((len(origins), len(destinations)), np.nan, dtype=dtype)
+        else:
+            distances = np.asarray(distances, dtype=dtype)
+
+        return cls(distances=distances, origins=origins, destinations=destinations, source=source)
+
+    @classmethod
+    def from_distance_df(
+        cls,
+        distance_df: pd.DataFrame,
+        dtype=DISTANCE_MATRIX_DTYPE,
+        sort: bool=True,
+    ) -> 'DistanceMatrix':
+        '''
+        Builds a DistanceMatrix from long form distance data with one row per (id_orig, id_dest) pair.
+        Origins and destinations are sorted by id, or if sort is False kept in the order they first
+        appear, so that the long form of a full cross join ordered by origin then destination (as the
+        files written by build_distance_data are unless pruned) keeps its row order. Pairs not in
+        distance_df are not part of the DistanceMatrix (see pairs).
+
+        Raises
+        ValueError - if a pair appears more than once with different values, or if an origin has more
+        than one population
+        '''
+        orig_codes, orig_ids = pd.factorize(distance_df[DISTANCE_ID_ORIG].astype(str), sort=sort)
+        dest_codes, dest_ids = pd.factorize(distance_df[DISTANCE_ID_DEST].astype(str), sort=sort)
+
+        num_origins = len(orig_ids)
+        num_dests = len(dest_ids)
+        pair_codes = orig_codes.astype(np.int64) * num_dests + dest_codes
+
+        num_unique_pairs = len(np.unique(pair_codes))
+        if num_unique_pairs != len(pair_codes):
+            # Exact duplicate rows are dropped the same way filter_distance_data does
+            deduplicated_df = distance_df.drop_duplicates()
+            if len(deduplicated_df) != num_unique_pairs:
+                raise ValueError('Some (id_orig, id_dest) pairs have more than one row of distance data.')
+            return cls.from_distance_df(deduplicated_df, dtype=dtype, sort=sort)
+
+        distances = np.full(num_origins * num_dests, np.nan, dtype=dtype)
+        distances[pair_codes] = distance_df[DISTANCE_DISTANCE_M].to_numpy(dtype=dtype)
+        distances = distances.reshape(num_origins, num_dests)
+
+        # Only distance data that is not a full cross join needs to mark its pairs
+        pairs = None
+        if len(pair_codes) < num_origins * num_dests:
+            pairs = np.zeros(num_origins * num_dests, dtype=bool)
+            pairs[pair_codes] = True
+            pairs = pairs.reshape(num_origins, num_dests)
+
+        # The first row for each origin and destination provides its attributes
+        _, first_orig_rows = np.unique(orig_codes, return_index=True)
+        _, first_dest_rows = np.unique(dest_codes, return_index=True)
+
+        origin_cols = [col for col in ORIGIN_COLS if col in distance_df.columns]
+        origins = distance_df[origin_cols].iloc[first_orig_rows]
+        origins.index = pd.Index(orig_ids, name=DISTANCE_ID_ORIG)
+
+        if DISTANCE_TOTAL_POPULATION in origin_cols:
+            population = distance_df[DISTANCE_TOTAL_POPULATION].to_numpy()
+            if (population != origins[DISTANCE_TOTAL_POPULATION].to_numpy()[orig_codes]).any():
+                raise ValueError('Some id_orig has multiple associated populations.')
+
+        destination_cols = [col for col in DESTINATION_COLS if col in distance_df.columns]
+        destinations = distance_df[destination_cols].iloc[first_dest_rows]
+        destinations.index = pd.Index(dest_ids, name=DISTANCE_ID_DEST)
+
+        source = None
+        if DISTANCE_SOURCE in distance_df.columns and len(distance_df):
+            source = distance_df[DISTANCE_SOURCE].iloc[0]
+
+        return cls(
+            distances=distances,
+            origins=origins,
+            destinations=destinations,
+            source=source,
+            pairs=pairs,
+            columns=[col for col in distance_df.columns if col in LONG_FORM_COLS],
+        )
+
+    @property
+    def num_origins(self) -> int:
+        return self.distances.shape[0]
+
+    @property
+    def num_destinations(self) -> int:
+        return self.distances.shape[1]
+
+    @property
+    def origin_ids(self) -> pd.Index:
+        return self.origins.index
+
+    @property
+    def destination_ids(self) -> pd.Index:
+        return self.destinations.index
+
+    @property
+    def populations(self) -> np.ndarray:
+        ''' The population of each origin '''
+        return self.origins[DISTANCE_TOTAL_POPULATION].to_numpy()
+
+    @property
+    def nbytes(self) -> int:
+        ''' Approximate memory used by this DistanceMatrix in bytes '''
+        return int(
+            self.distances.nbytes
+            + self.origins.memory_usage(index=True, deep=True).sum()
+            + self.destinations.memory_usage(index=True, deep=True).sum()
+        )
+
+    def pair_mask(self) -> np.ndarray:
+        ''' Boolean array marking the pairs that are part of the distance data '''
+        if self.pairs is None:
+            return np.ones(self.distances.shape, dtype=bool)
+
+        return self.pairs
+
+    def missing(self) -> np.ndarray:
+        ''' Boolean array marking the pairs of the distance data without a distance '''
+        missing = np.isnan(self.distances)
+        if self.pairs is not None:
+            missing &= self.pairs
+
+        return missing
+
+    def min_distances(self) -> np.ndarray:
+        ''' The distance from each origin to its closest destination, NaN for an origin without any '''
+        min_distances = np.where(np.isnan(self.distances), np.inf, self.distances).min(axis=1)
+        min_distances[np.isinf(min_distances)] = np.nan
+
+        return min_distances
+
+    def weighted_distances(self) -> np.ndarray:
+        ''' The distances multiplied by the population of the origin '''
+        return self.distances * self.populations[:, np.newaxis]
+
+    def destination_positions(self, id_dests) -> np.ndarray:
+        ''' The column positions of the given id_dests, -1 for ids not in this DistanceMatrix '''
+        return self.destinations.index.get_indexer(pd.Index(id_dests).astype(str))
+
+    def origin_positions(self, id_origs) -> np.ndarray:
+        ''' The row positions of the given id_origs, -1 for ids not in this DistanceMatrix '''
+        return self.origins.index.get_indexer(pd.Index(id_origs).astype(str))
+
+    def select_destinations(self, selection) -> 'DistanceMatrix':
+        ''' Returns a new DistanceMatrix with only the destinations in selection (a boolean mask or positions) '''
+        positions = np.arange(self.num_destinations)[selection]
+
+        return DistanceMatrix(
+            distances=self.distances[:, positions],
+            origins=self.origins,
+            destinations=self.destinations.iloc[positions],
+            source=self.source,
+            pairs=None if self.pairs is None else self.pairs[:, positions],
+            columns=self.columns,
+        )
+
+    def select_origins(self, selection) -> 'DistanceMatrix':
+        ''' Returns a new DistanceMatrix with only the origins in selection (a boolean mask or positions) '''
+        positions = np.arange(self.num_origins)[selection]
+
+        return DistanceMatrix(
+            distances=self.distances[positions, :],
+            origins=self.origins.iloc[positions],
+            destinations=self.destinations,
+            source=self.source,
+            pairs=None if self.pairs is None else self.pairs[positions, :],
+            columns=self.columns,
+        )
+
+    def set_distances(self, id_origs, id_dests, distances):
+        '''
+        Sets the distances for the given (id_orig, id_dest) pairs in place. Pairs with ids that are not
+        in this DistanceMatrix are ignored.
+        '''
+        orig_positions = self.origin_positions(id_origs)
+        dest_positions = self.destination_positions(id_dests)
+        found = (orig_positions >= 0) & (dest_positions >= 0)
+
+        self.distances[orig_positions[found], dest_positions[found]] = np.asarray(distances)[found]
+
+    def to_distance_df(self, columns: list[str]=None, include_missing: bool=False) -> pd.DataFrame:
+        '''
+        Expands this DistanceMatrix to long form, one row per (id_orig, id_dest) pair ordered by origin
+        then destination, with the columns in the order of the distance data it was built from, or
+        otherwise the same order as the files written by build_distance_data.
+
+        Arguments
+        columns: if given, only these columns are built
+        include_missing: if True, pairs without a distance are included with a NaN distance_m
+        '''
+        if include_missing and self.pairs is None:
+            orig_positions = np.repeat(np.arange(self.num_origins), self.num_destinations)
+            dest_positions = np.tile(np.arange(self.num_destinations), self.num_origins)
+        elif include_missing:
+            orig_positions, dest_positions = np.nonzero(self.pairs)
+        else:
+            orig_positions, dest_positions = np.nonzero(~np.isnan(self.distances))
+
+        return pairs_to_distance_df(
+            self.origins,
+            self.destinations,
+            orig_positions,
+            dest_positions,
+            self.distances[orig_positions, dest_positions],
+            source=self.source,
+            columns=self.columns if columns is None else columns,
+        )
+
+    def iter_distance_df(
+        self,
+        chunk_size: int,
+        columns: list[str]=None,
+        include_missing: bool=False,
+    ) -> Iterator[pd.DataFrame]:
+        '''
+        Yields the long form of to_distance_df in chunks of the pairs of chunk_size origins at a time,
+        indexed as the rows of to_distance_df are, so that it can be written out without ever being
+        held in full. At least one, possibly empty, chunk is yielded.
+        '''
+        start_row = 0
+        for start in range(0, max(self.num_origins, 1), chunk_size):
+            chunk_df = self.select_origins(slice(start, start + chunk_size)).to_distance_df(
+                columns=columns, include_missing=include_missing,
+            )
+            chunk_df.index = pd.RangeIndex(start_row, start_row + len(chunk_df))
+            start_row += len(chunk_df)
+
+            yield chunk_df
+
+    def expand_pairs(self, pairs_df: pd.DataFrame) -> pd.DataFrame:
+        '''
+        The long form rows of the (id_orig, id_dest) pairs of pairs_df, with their distance_m taken from
+        pairs_df, followed by the other columns of pairs_df (such as the columns added by the models),
+        indexed as pairs_df is. This builds the full rows for a few pairs, such as those matched by a
+        model, from long form data holding only the columns the models need.
+
+        Raises
+        ValueError - if some pair of pairs_df is not in this DistanceMatrix
+        '''
+        orig_positions = self.origin_positions(pairs_df[DISTANCE_ID_ORIG])
+        dest_positions = self.destination_positions(pairs_df[DISTANCE_ID_DEST])
+        if (orig_positions < 0).any() or (dest_positions < 0).any():
+            raise ValueError('Some pairs are not in the distance matrix.')
+
+        long_df = pairs_to_distance_df(
+            self.origins,
+            self.destinations,
+            orig_positions,
+            dest_positions,
+            pairs_df[DISTANCE_DISTANCE_M].to_numpy(),
+            source=self.source,
+            columns=self.columns,
+        )
+        for col in pairs_df.columns:
+            if col not in long_df.columns:
+                long_df[col] = pairs_df[col].to_numpy()
+
+        return long_df.set_axis(pairs_df.index, axis=0)
+
+
+def prepare_tables(origins: pd.DataFrame, destinations: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    '''
+    Indexes origins by id_orig and destinations by id_dest (as strings) and keeps only their
+    ORIGIN_COLS and DESTINATION_COLS, as held by a DistanceMatrix.
+
+    Raises
+    ValueError - if the ids are not unique
+    '''
+    if DISTANCE_ID_ORIG in origins.columns:
+        origins = origins.set_index(DISTANCE_ID_ORIG)
+    if DISTANCE_ID_DEST in destinations.columns:
+        destinations = destinations.set_index(DISTANCE_ID_DEST)
+
+    origins = origins[[col for col in ORIGIN_COLS if col in origins.columns]]
+    destinations = destinations[[col for col in DESTINATION_COLS if col in destinations.columns]]
+    origins.index = origins.index.astype(str).rename(DISTANCE_ID_ORIG)
+    destinations.index = destinations.index.astype(str).rename(DISTANCE_ID_DEST)
+
+    if not origins.index.is_unique:
+        raise ValueError('Non-unique id_orig values in origins.')
+    if not destinations.index.is_unique:
+        raise ValueError('Non-unique id_dest values in destinations.')
+
+    return origins, destinations
+
+
+def pairs_to_distance_df(
+    origins: pd.DataFrame,
+    destinations: pd.DataFrame,
+    orig_positions: np.ndarray,
+    dest_positions: np.ndarray,
+    distances: np.ndarray,
+    source: str=None,
+    columns: list[str]=None,
+) -> pd.DataFrame:
+    '''
+    Builds long form distance data with one row per (origin, destination) pair, where the pairs are
+    given as row positions into the origins and destinations tables (as held by a DistanceMatrix) and
+    distances holds the distance of each pair. This allows sparse sets of pairs to be expanded without
+    a dense distances array.
+
+    Arguments
+    columns: if given, only these columns are built, otherwise all available columns are built in the
+    same order as the files written by build_distance_data
+    '''
+    available_cols = [DISTANCE_ID_ORIG, DISTANCE_ID_DEST] + list(origins.columns) \
+        + list(destinations.columns) + [DISTANCE_DISTANCE_M]
+    if source is not None:
+        available_cols.append(DISTANCE_SOURCE)
+    if columns is None:
+        columns = [col for col in LONG_FORM_COLS if col in available_cols]
+    else:
+        unknown = set(columns) - set(available_cols)
+        if unknown:
+            raise ValueError(f'Unknown distance data columns {unknown}')
+
+    data = {}
+    for col in columns:
+        if col == DISTANCE_ID_ORIG:
+            data[col] = origins.index.to_numpy()[orig_positions]
+        elif col == DISTANCE_ID_DEST:
+            data[col] = destinations.index.to_numpy()[dest_positions]
+        elif col == DISTANCE_DISTANCE_M:
+            data[col] = np.asarray(distances)
+        elif col == DISTANCE_SOURCE:
+            data[col] = np.full(len(orig_positions), source, dtype=object)
+        elif col in origins.columns:
+            data[col] = origins[col].to_numpy()[orig_positions]
+        else:
+            data[col] = destinations[col].to_numpy()[dest_positions]
+
+    return pd.DataFrame(data, columns=columns)
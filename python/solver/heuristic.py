@@ -0,0 +1,625 @@
+'''
+A fast heuristic for the site selection of an ArrayModel, for quick answers on large counties and
+solutions to warm start the MIP from.
+
+With the open sites chosen, each residence is matched to its cheapest open site unless the capacity
+binds, so the search is over the open sites alone:
+    start        -- the greedy selection, which opens precincts_open sites one at a time, each the
+                    site that most lowers the objective given those already open, or the sites of the
+                    largest open values in the LP relaxation, whichever is better
+    local search -- Teitz-Bart swaps: for each closed site, the open site whose swap for it most
+                    lowers the objective, taken if it does, until a pass over the closed sites finds
+                    no improving swap
+    capacity     -- the residences are assigned to the chosen sites within their capacity. Where it
+                    binds, the sites are searched again with the price of the capacity each pair takes
+                    up, from the LP relaxation of the assignment, added to its cost, keeping whichever
+                    sites have the cheapest assignment within capacity
+
+The search keeps the cheapest and second cheapest open site of each residence, so the cost of every
+swap for a closed site is found in one pass over that site's pairs and the open sites. The number of
+sites opened, the new and old location limits and the excluded sites of the model are kept through
+the search, and the site penalty is part of the objective.
+
+The assignment within capacity rounds its LP relaxation, in which only a few residences are split
+between sites: each of those goes to its cheapest site with room, or one of its sites once another
+residence is moved from it to a site with room. Only if that fails is the assignment solved as a MIP.
+
+The LP relaxation of the model is solved first, within the time limit, as a bound on the optimum, so
+the gap of the solution can be reported and the search can stop once it is within limits_gap.
+
+The solution is set on the model like a solver's, so it is incorporated the same way, and
+solution_warm_start turns it into a warm start for the MIP.
+'''
+
+from dataclasses import dataclass
+import math
+from time import perf_counter
+
+import numpy as np
+from scipy.optimize import linprog
+from scipy.sparse import csr_matrix, vstack
+
+from .array_model import ArrayModel, SENSE_EQUAL, SENSE_GREATER, SENSE_LESS
+from .site_evaluator import CAPACITY_TOLERANCE, solve_transportation
+
+IMPROVEMENT_TOLERANCE = 1e-9
+''' The relative amount a swap must lower the objective by to be taken '''
+
+CAPACITY_ROUNDS = 5
+''' The most times the sites are searched again with the prices of the capacity where it binds '''
+
+ASSIGNMENT_GAP = 1e-3
+''' The relative gap an assignment within capacity is solved to when it can not be found from its LP relaxation '''
+
+MIN_ASSIGNMENT_TIME = 10.0
+''' The least time in seconds given to such an assignment, even past the time limit '''
+
+LIMIT_TOLERANCE = 1e-9
+''' The amount the new and old location counts may go past their limits, for rounding in the limits '''
+
+LINPROG_INFEASIBLE = 2
+''' The status of linprog for an infeasible problem '''
+
+HEURISTIC_STATUS = 'heuristic'
+''' The solver status of a model solved by the heuristic '''
+
+
+@dataclass
+class HeuristicSolution:
+    ''' The solution the heuristic found for a model '''
+
+    open_sites: np.ndarray
+    ''' The positions in precinct_ids of the open precincts '''
+    objective: float
+    ''' The objective of the model for the solution '''
+    bound: float | None
+    ''' The optimum of the LP relaxation, a bound on the model's, None if it was not solved in time '''
+    swaps: int
+    ''' The number of swaps the local search made '''
+    passes: int
+    ''' The number of passes the local search made over the closed sites '''
+    capacity_binding: bool
+    ''' True if some site could not take every residence for which it is the cheapest '''
+    time: float
+    ''' The time in seconds the heuristic took '''
+    status: str = HEURISTIC_STATUS
+    ''' The solver status, for callers of solve_model '''
+
+    @property
+    def gap(self) -> float | None:
+        ''' The gap between the objective and the bound relative to the objective, None with no bound '''
+        if self.bound is None:
+            return None
+        if self.objective == 0:
+            return 0.0 if self.bound == 0 else math.inf
+
+        return (self.objective - self.bound) / abs(self.objective)
+
+
+class _SiteSearch:
+    ''' The open sites of a search over the sites of a model, and the cheapest open sites of each residence '''
+
+    def __init__(self, model: ArrayModel):
+        sites = model.sites
+        num_pairs = model.num_pairs
+
+        self.num_residences = len(model.residence_ids)
+        self.num_sites = len(model.precinct_ids)
+        self.precincts_open = sites.precincts_open
+        self.max_new = sites.max_new
+        self.min_old = sites.min_old
+        self.new = sites.new_locations != 0
+        self.penalized = sites.penalized
+        self.new_counts = self.new.astype(np.int64)
+        self.old_counts = 1 - self.new_counts
+        self.penalized_counts = self.penalized.astype(np.int64)
+        self.penalty_per_site = sites.penalty_per_site
+
+        self.pair_residences = model.pair_residences
+        self.pair_sites = model.pair_precincts
+        self.population = sites.population
+        self.max_population = sites.max_population
+        self.base_pair_costs = model.objective[:num_pairs]
+        self.base_open_costs = model.objective[model.open_positions]
+        self.pair_costs = self.base_pair_costs
+        self.open_costs = self.base_open_costs
+        self.allowed = model.upper_bounds[model.open_positions] > 0
+        if self.penalty_per_site is not None:
+            self.penalty_exp_cost = model.objective[num_pairs + self.num_sites]
+            self.penalty_cost = model.objective[num_pairs + self.num_sites + 1]
+
+        if len(np.unique(self.pair_residences)) < self.num_residences:
+            raise ValueError('Some residences have no site within the max_min radius')
+
+        # The pairs in order of residence, and in order of site, with where each one's pairs start
+        self.by_residence = np.argsort(self.pair_residences, kind='stable')
+        self.residence_starts = np.searchsorted(self.pair_residences[self.by_residence], np.arange(self.num_residences))
+        self.residence_ends = np.append(self.residence_starts[1:], len(self.by_residence))
+        self.by_site = np.argsort(self.pair_sites, kind='stable')
+        self.site_starts = np.searchsorted(self.pair_sites[self.by_site], np.arange(self.num_sites + 1))
+
+        # The cost of a residence with no open site, more than any assignment of all residences
+        self.unserved_cost = (np.abs(self.pair_costs).max(initial=0) + 1) * (self.num_residences + 1)
+
+        self.is_open = np.zeros(self.num_sites, dtype=bool)
+        self.best_pair = None
+        self.best_site = None
+        self.first_cost = None
+        self.second_cost = None
+        self.site_loss = None
+
+    def set_prices(self, prices: np.ndarray):
+        '''
+        Adds the price of each site's capacity to the cost of its pairs, by the population of the
+        residence, less the price of all of its capacity to the cost of opening it, then finds the
+        cheapest open sites of each residence at the new costs
+        '''
+        self.pair_costs = self.base_pair_costs + self.population[self.pair_residences] * prices[self.pair_sites]
+        self.open_costs = self.base_open_costs - prices * self.max_population
+        self.unserved_cost = (np.abs(self.pair_costs).max(initial=0) + 1) * (self.num_residences + 1)
+        self.set_open(self.is_open)
+
+    def residence_pairs(self, residence: int) -> np.ndarray:
+        ''' The pairs of the residence '''
+        return self.by_residence[self.residence_starts[residence]:self.residence_ends[residence]]
+
+    def site_pairs(self, site: int) -> np.ndarray:
+        ''' The pairs of the site '''
+        return self.by_site[self.site_starts[site]:self.site_starts[site + 1]]
+
+    def site_penalty(self, num_penalized) -> np.ndarray | float:
+        ''' The objective of the penalty variables with num_penalized penalized sites open '''
+        if self.penalty_per_site is None:
+            return 0.0
+        penalty = self.penalty_per_site * np.asarray(num_penalized, dtype=np.float64)
+
+        return self.penalty_exp_cost * np.exp(penalty) + self.penalty_cost * penalty
+
+    def counts(self) -> tuple[int, int, int]:
+        ''' The number of new, old and penalized sites open '''
+        return (
+            int(np.count_nonzero(self.is_open & self.new)),
+            int(np.count_nonzero(self.is_open & ~self.new)),
+            int(np.count_nonzero(self.is_open & self.penalized)),
+        )
+
+    def within_limits(self, is_open: np.ndarray) -> bool:
+        ''' True if the open sites are allowed and as many as the model opens within its limits '''
+        num_new = np.count_nonzero(is_open & self.new)
+        num_old = np.count_nonzero(is_open & ~self.new)
+
+        return (
+            np.count_nonzero(is_open) == self.precincts_open
+            and not (is_open & ~self.allowed).any()
+            and (self.max_new is None or num_new <= self.max_new + LIMIT_TOLERANCE)
+            and (self.min_old is None or num_old >= self.min_old - LIMIT_TOLERANCE)
+        )
+
+    def objective(self) -> float:
+        ''' The objective of the open sites, each residence matched to its cheapest open site '''
+        return float(
+            self.first_cost.sum() + self.open_costs[self.is_open].sum() + self.site_penalty(self.counts()[2])
+        )
+
+    def set_open(self, is_open: np.ndarray):
+        ''' Opens the sites, finding the cheapest and second cheapest open site of each residence '''
+        self.is_open = is_open
+
+        residences = self.pair_residences[self.by_residence]
+        sites = self.pair_sites[self.by_residence]
+        costs = np.where(self.is_open[sites], self.pair_costs[self.by_residence], self.unserved_cost)
+        self.first_cost = np.minimum.reduceat(costs, self.residence_starts)
+
+        # The first of the cheapest pairs of each residence
+        best = np.flatnonzero(costs == self.first_cost[residences])
+        best = best[np.r_[True, residences[best][1:] != residences[best][:-1]]]
+        self.best_pair = self.by_residence[best]
+        served = self.first_cost < self.unserved_cost
+        self.best_site = np.where(served, sites[best], -1)
+
+        costs[best] = self.unserved_cost
+        self.second_cost = np.minimum.reduceat(costs, self.residence_starts)
+
+        # What closing each open site costs its residences, which move to their second cheapest site
+        self.site_loss = np.bincount(
+            self.best_site[served],
+            weights=(self.second_cost - self.first_cost)[served],
+            minlength=self.num_sites,
+        )
+
+    def _candidates(self, is_open: np.ndarray) -> np.ndarray:
+        # The sites that can be opened next and still leave the rest to open within the limits
+        num_new = np.count_nonzero(is_open & self.new)
+        num_old = np.count_nonzero(is_open & ~self.new)
+        left = self.precincts_open - num_new - num_old
+
+        candidates = self.allowed & ~is_open
+        if self.max_new is not None and num_new + 1 > self.max_new + LIMIT_TOLERANCE:
+            candidates &= ~self.new
+        if self.min_old is not None and num_old + left - 1 < self.min_old - LIMIT_TOLERANCE:
+            # Every site left to open has to be old to reach min_old
+            candidates &= ~self.new
+        if not candidates.any():
+            raise ValueError(f'No site is left to open within the new and old location limits ({left=})')
+
+        return candidates
+
+    def greedy(self) -> np.ndarray:
+        ''' Opens precincts_open sites one at a time, each the one that most lowers the objective '''
+        is_open = np.zeros(self.num_sites, dtype=bool)
+        first_cost = np.full(self.num_residences, self.unserved_cost)
+        for _ in range(self.precincts_open):
+            num_penalized = np.count_nonzero(is_open & self.penalized)
+            gains = np.bincount(
+                self.pair_sites,
+                weights=np.maximum(first_cost[self.pair_residences] - self.pair_costs, 0),
+                minlength=self.num_sites,
+            )
+            gains -= self.open_costs
+            gains[self.penalized] -= self.site_penalty(num_penalized + 1) - self.site_penalty(num_penalized)
+
+            site = int(np.argmax(np.where(self._candidates(is_open), gains, -np.inf)))
+            is_open[site] = True
+            pairs = self.site_pairs(site)
+            residences = self.pair_residences[pairs]
+            first_cost[residences] = np.minimum(first_cost[residences], self.pair_costs[pairs])
+
+        return is_open
+
+    def rounded(self, values: np.ndarray) -> np.ndarray:
+        ''' Opens the precincts_open sites of the largest values, such as the open values of the LP relaxation '''
+        is_open = np.zeros(self.num_sites, dtype=bool)
+        for _ in range(self.precincts_open):
+            is_open[int(np.argmax(np.where(self._candidates(is_open), values, -np.inf)))] = True
+
+        return is_open
+
+    def best_swap(self, site: int) -> tuple[float, int | None]:
+        ''' The change in the objective of the best swap of an open site for the closed site, and that open site '''
+        pairs = self.site_pairs(site)
+        residences = self.pair_residences[pairs]
+        costs = self.pair_costs[pairs]
+        first_cost = self.first_cost[residences]
+        second_cost = self.second_cost[residences]
+
+        # Residences move to the site where it is cheaper than their cheapest open site
+        gain = np.minimum(costs - first_cost, 0).sum()
+
+        # Closing a residence's cheapest site moves it to the cheaper of the site and its second cheapest
+        served = self.best_site[residences] >= 0
+        correction = (np.minimum(costs, second_cost) - np.minimum(costs, first_cost)) - (second_cost - first_cost)
+        loss = self.site_loss + np.bincount(
+            self.best_site[residences][served], weights=correction[served], minlength=self.num_sites,
+        )
+
+        num_new, num_old, num_penalized = self.counts()
+        penalty = (
+            self.site_penalty(num_penalized + self.penalized_counts[site] - self.penalized_counts)
+            - self.site_penalty(num_penalized)
+        )
+        delta = gain + loss + self.open_costs[site] - self.open_costs + penalty
+
+        valid = self.is_open.copy()
+        if self.max_new is not None:
+            valid &= num_new + self.new_counts[site] - self.new_counts <= self.max_new + LIMIT_TOLERANCE
+        if self.min_old is not None:
+            valid &= num_old + self.old_counts[site] - self.old_counts >= self.min_old - LIMIT_TOLERANCE
+        if not valid.any():
+            return 0.0, None
+
+        closed = int(np.argmin(np.where(valid, delta, np.inf)))
+
+        return float(delta[closed]), closed
+
+    def local_search(self, deadline: float, done) -> tuple[int, int]:
+        '''
+        Swaps open sites for closed ones while a swap lowers the objective, until the deadline or done
+        returns True for the objective. Returns the number of swaps and of passes over the closed sites.
+        '''
+        swaps = 0
+        passes = 0
+        value = self.objective()
+        improved = True
+        while improved and perf_counter() < deadline and not done(value):
+            improved = False
+            passes += 1
+            for site in np.flatnonzero(self.allowed & ~self.is_open):
+                if perf_counter() >= deadline or done(value):
+                    break
+                delta, closed = self.best_swap(site)
+                if closed is None or delta >= -IMPROVEMENT_TOLERANCE * abs(value):
+                    continue
+
+                is_open = self.is_open.copy()
+                is_open[closed] = False
+                is_open[site] = True
+                self.set_open(is_open)
+                value = self.objective()
+                swaps += 1
+                improved = True
+
+        return swaps, passes
+
+
+def lp_relaxation(model: ArrayModel, time_limit: float=None):
+    '''
+    The optimum of the LP relaxation of the model, a bound on the model's, and the value of each
+    variable at it. None if it was not solved within time_limit.
+    '''
+    constraints = model.constraints.tocsr()
+    less = model.row_senses == SENSE_LESS
+    greater = model.row_senses == SENSE_GREATER
+    equal = model.row_senses == SENSE_EQUAL
+
+    options = {'presolve': True}
+    if time_limit is not None:
+        options['time_limit'] = max(time_limit, 0.0)
+
+    result = linprog(
+        c=model.objective,
+        A_ub=vstack([constraints[less], -constraints[greater]]),
+        b_ub=np.concatenate([model.rhs[less], -model.rhs[greater]]),
+        A_eq=constraints[equal],
+        b_eq=model.rhs[equal],
+        bounds=np.column_stack([np.zeros(model.num_variables), model.upper_bounds]),
+        method='highs',
+        options=options,
+    )
+    if result.status == LINPROG_INFEASIBLE:
+        raise ValueError('The LP relaxation of the model is infeasible, so the model is infeasible')
+    if result.status != 0:
+        return None
+
+    return float(result.fun) + model.objective_offset, result.x
+
+
+class _CapacityAssignment:
+    ''' An assignment of the residences to the open sites of a search within their capacity '''
+
+    def __init__(self, search: _SiteSearch, deadline: float=math.inf):
+        self.matched = search.best_pair
+        ''' The matched pairs '''
+        self.prices = np.zeros(search.num_sites)
+        '''
+        The price of a unit of each site's capacity in the LP relaxation of the assignment, 0 if it
+        does not bind
+        '''
+
+        loads = np.bincount(
+            search.pair_sites[self.matched], weights=search.population[search.pair_residences[self.matched]],
+            minlength=search.num_sites,
+        )
+        self.capacity_binding = bool((loads > search.max_population * (1 + CAPACITY_TOLERANCE)).any())
+        ''' True if some site could not take every residence for which it is the cheapest '''
+        if self.capacity_binding:
+            self._assign(search, deadline)
+
+        self.objective = float(
+            search.base_pair_costs[self.matched].sum()
+            + search.base_open_costs[search.is_open].sum()
+            + search.site_penalty(search.counts()[2])
+        )
+        ''' The objective of the model for the assignment '''
+
+    def _assign(self, search: _SiteSearch, deadline: float):
+        # Solve the LP relaxation of the assignment, in which nearly every residence goes to one site,
+        # then fit in the few residences it splits between sites
+        pairs = np.flatnonzero(search.is_open[search.pair_sites])
+        residences = search.pair_residences[pairs]
+        sites = search.pair_sites[pairs]
+        columns = np.arange(len(pairs))
+        result = linprog(
+            c=search.base_pair_costs[pairs],
+            A_ub=csr_matrix(
+                (search.population[residences], (sites, columns)), shape=(search.num_sites, len(pairs)),
+            ),
+            b_ub=np.full(search.num_sites, search.max_population),
+            A_eq=csr_matrix((np.ones(len(pairs)), (residences, columns)), shape=(search.num_residences, len(pairs))),
+            b_eq=np.ones(search.num_residences),
+            bounds=(0, 1),
+            method='highs',
+        )
+        if result.status != 0:
+            raise ValueError(f'No assignment to the open sites respects their capacity ({result.message})')
+        self.prices = np.maximum(-result.ineqlin.marginals, 0)
+
+        whole = result.x >= 1 - CAPACITY_TOLERANCE
+        self.matched = np.full(search.num_residences, -1)
+        self.matched[residences[whole]] = pairs[whole]
+        try:
+            self._repair(search, pairs)
+        except ValueError:
+            # The split residences can not be fitted in by moving one other residence, assign them all again
+            self.matched = solve_transportation(
+                pairs, search.pair_residences, search.pair_sites, search.base_pair_costs, search.population,
+                search.num_sites, search.max_population,
+                None if deadline == math.inf else max(deadline - perf_counter(), MIN_ASSIGNMENT_TIME),
+                ASSIGNMENT_GAP,
+            )
+
+    def _repair(self, search: _SiteSearch, pairs: np.ndarray):
+        # Assign each residence the LP split between sites, largest first, to its cheapest site with
+        # room, or else to one of its sites after moving another residence from it to a site with room
+        assigned = self.matched >= 0
+        matched_sites = np.where(assigned, search.pair_sites[self.matched], -1)
+        left = search.max_population - np.bincount(
+            matched_sites[assigned], weights=search.population[assigned], minlength=search.num_sites,
+        )
+        pair_populations = search.population[search.pair_residences[pairs]]
+
+        split = np.flatnonzero(~assigned)
+        for residence in split[np.argsort(-search.population[split], kind='stable')]:
+            population = search.population[residence]
+            residence_pairs = search.residence_pairs(residence)
+            residence_pairs = residence_pairs[search.is_open[search.pair_sites[residence_pairs]]]
+            residence_sites = search.pair_sites[residence_pairs]
+            residence_costs = search.base_pair_costs[residence_pairs]
+
+            fits = left[residence_sites] >= population * (1 - CAPACITY_TOLERANCE)
+            if fits.any():
+                chosen = int(np.argmin(np.where(fits, residence_costs, np.inf)))
+                self.matched[residence] = residence_pairs[chosen]
+                left[residence_sites[chosen]] -= population
+                continue
+
+            # The pair of the residence at each site, for moving another residence from that site
+            site_pair = np.full(search.num_sites, -1)
+            site_pair[residence_sites] = np.arange(len(residence_sites))
+            pair_residences = search.pair_residences[pairs]
+            current = matched_sites[pair_residences]
+            movable = (
+                (current >= 0)
+                & (site_pair[np.maximum(current, 0)] >= 0)
+                & (search.pair_sites[pairs] != current)
+                & (pair_populations >= population - left[np.maximum(current, 0)])
+                & (left[search.pair_sites[pairs]] >= pair_populations * (1 - CAPACITY_TOLERANCE))
+            )
+            if not movable.any():
+                raise ValueError(f'No room can be made for residence {residence}')
+
+            delta = np.where(
+                movable,
+                search.base_pair_costs[pairs]
+                - search.base_pair_costs[self.matched[pair_residences]]
+                + residence_costs[site_pair[np.maximum(current, 0)]],
+                np.inf,
+            )
+            move = int(np.argmin(delta))
+            moved = pair_residences[move]
+            site = current[move]
+            self.matched[moved] = pairs[move]
+            matched_sites[moved] = search.pair_sites[pairs[move]]
+            left[matched_sites[moved]] -= search.population[moved]
+            left[site] += search.population[moved] - population
+            self.matched[residence] = residence_pairs[site_pair[site]]
+            matched_sites[residence] = site
+
+
+def solve_heuristic(
+    model: ArrayModel,
+    time_limit: float=None,
+    limits_gap: float=0.0,
+    bound: bool=True,
+    log: bool=False,
+    log_file_path: str=None,
+    warm_start: bool=False,
+) -> HeuristicSolution:
+    '''
+    Chooses the open sites of a model built by array_model_factory by greedy selection and swaps,
+    and sets the solution on the model.
+
+    time_limit is the limit in seconds of the relaxation and the local search together, None for no
+    limit. With bound, the LP relaxation is solved first, for a bound and a second start rounded from
+    its open values, and the search stops once the solution is within limits_gap of the bound. With
+    warm_start the search starts from the open sites of the model's start instead, if it has one
+    within the model's limits.
+    '''
+    if model.sites is None:
+        raise ValueError('The heuristic needs the site constraints of a model built by array_model_factory')
+
+    start_time = perf_counter()
+    deadline = math.inf if time_limit is None else start_time + time_limit
+    sites = model.sites
+    lines = []
+
+    relaxation = lp_relaxation(model, time_limit) if bound else None
+    lower_bound = None if relaxation is None else relaxation[0]
+
+    search = _SiteSearch(model)
+    starts = {}
+    if warm_start and model.start is not None:
+        start_open = model.start[model.open_positions] >= 0.5
+        if search.within_limits(start_open):
+            starts['Warm start'] = start_open
+        else:
+            lines.append('The warm start is not within the limits of the model')
+    if not starts:
+        starts['Greedy'] = search.greedy()
+        if relaxation is not None:
+            starts['LP rounding'] = search.rounded(relaxation[1][model.open_positions])
+
+    # Search from the best start
+    values = {}
+    for name, start_open in starts.items():
+        search.set_open(start_open)
+        values[name] = search.objective()
+        lines.append(f'{name} objective: {values[name]}')
+    search.set_open(starts[min(values, key=values.get)])
+
+    def done(value: float) -> bool:
+        # Below the bound the capacity binds, and the objective within capacity is not known yet
+        if lower_bound is None or value < lower_bound - IMPROVEMENT_TOLERANCE * abs(value):
+            return False
+
+        return value - lower_bound <= limits_gap * abs(value)
+
+    swaps, passes = search.local_search(deadline, done)
+    lines.append(f'Local search: {swaps} swaps in {passes} passes, objective {search.objective()}')
+
+    unserved = np.count_nonzero(search.best_site < 0)
+    if unserved:
+        raise ValueError(f'{unserved} residence(s) have no open site within the max_min radius')
+
+    assignment = _CapacityAssignment(search, deadline)
+    best_assignment = assignment
+    best_open = search.is_open
+    if assignment.capacity_binding:
+        lines.append(f'Within capacity: objective {assignment.objective}')
+
+    # Where the capacity binds, search again with the cost of each pair including the price of the
+    # capacity it takes up, keeping the sites whose assignment within capacity is the cheapest
+    for _ in range(CAPACITY_ROUNDS if assignment.capacity_binding else 0):
+        if perf_counter() >= deadline:
+            break
+        search.set_prices(assignment.prices)
+        round_open = search.is_open
+        round_swaps, round_passes = search.local_search(deadline, lambda value: False)
+        swaps += round_swaps
+        passes += round_passes
+        if not round_swaps or (search.best_site < 0).any():
+            break
+
+        try:
+            assignment = _CapacityAssignment(search, deadline)
+        except ValueError:
+            lines.append('Capacity prices: the sites found can not serve every residence within capacity')
+            break
+        lines.append(f'Capacity prices: {round_swaps} swaps, objective {assignment.objective}')
+        if assignment.objective < best_assignment.objective:
+            best_assignment = assignment
+            best_open = search.is_open
+        elif np.array_equal(search.is_open, round_open):
+            break
+
+    open_sites = np.flatnonzero(best_open)
+    solution = np.zeros(model.num_variables)
+    solution[best_assignment.matched] = 1
+    solution[model.num_pairs + open_sites] = 1
+    if sites.penalty_per_site is not None:
+        penalty = sites.penalty_per_site * np.count_nonzero(best_open & sites.penalized)
+        solution[model.num_pairs + search.num_sites] = math.exp(penalty)
+        solution[model.num_pairs + search.num_sites + 1] = penalty
+    model.set_solution(solution)
+
+    result = HeuristicSolution(
+        open_sites=open_sites,
+        objective=model.obj,
+        bound=lower_bound,
+        swaps=swaps,
+        passes=passes,
+        capacity_binding=best_assignment.capacity_binding,
+        time=perf_counter() - start_time,
+    )
+
+    lines.append(f'Capacity binding: {result.capacity_binding}')
+    lines.append(f'Objective: {result.objective}')
+    lines.append(f'LP bound: {result.bound}')
+    lines.append(f'Gap: {result.gap}')
+    lines.append(f'Time (sec): {result.time:.2f}')
+    if log:
+        print('\n'.join(lines))
+    if log_file_path:
+        with open(log_file_path, 'a', encoding='utf-8') as log_file:
+            log_file.write('\n'.join(lines) + '\n')
+
+    return result
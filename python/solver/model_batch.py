@@ -0,0 +1,125 @@
+'''
+Runs batches of configs for the command line tools, model_run_cli and model_run_db_cli.
+
+Both tools take the same options for how their configs are built and solved, and run them in the
+same ways: one at a time, as sweeps of the configs that share their data (see model_sweep), or in
+separate processes, within a memory budget if one is given (see model_scheduler). Only writing the
+results of a run differs between them, which each tool does in the run_func it hands to run_sweep.
+'''
+
+import argparse
+from functools import partial
+from typing import Callable, Iterator
+
+from tqdm import tqdm
+
+from .model_config import PollingModelConfig
+from .model_estimate import estimate_peak_memory
+from .model_run import (
+    load_shared_data, location_work_groups, release_shared_data, shared_data_mp_context, work_configs,
+)
+from .model_scheduler import JobGroup, MemoryScheduler, ScheduledJob
+from .model_sweep import ModelSweep
+from .solver_backends import SOLVER_PRESOLVE_ON
+
+
+def override_configs(configs: list[PollingModelConfig], args: argparse.Namespace):
+    '''
+    Applies the options given on the command line to the configs: --sparse, --array-model,
+    --in-memory, --speculative, --no-warm-start and the --solver options.
+    '''
+    for config in configs:
+        config.sparse_pairs = args.sparse
+        config.array_model = args.array_model
+        config.solver_in_memory = args.in_memory
+        config.speculative_penalty = args.speculative
+        if args.no_warm_start:
+            config.warm_start = False
+        if args.solver is not None:
+            config.solver = args.solver
+        if args.solver_threads is not None:
+            config.solver_threads = args.solver_threads
+        if args.solver_presolve is not None:
+            config.solver_presolve = args.solver_presolve == SOLVER_PRESOLVE_ON
+        if args.solver_emphasis is not None:
+            config.solver_emphasis = args.solver_emphasis
+
+
+def run_sweep(
+        configs: list[PollingModelConfig],
+        run_func: Callable,
+        log: bool=False,
+        in_memory: bool=True,
+        **kwargs,
+):
+    '''
+    Runs configs that share their data as a ModelSweep, building the data once. run_func is called as
+    run_func(config, log, sweep_runs=..., **kwargs) for each config in the order the sweep runs them,
+    and takes the ModelRun of the config from sweep_runs. Each run of the sweep is built from the one
+    before when it is taken.
+    '''
+    sweep = ModelSweep(configs, log, in_memory)
+    sweep_runs = sweep.model_runs()
+    for config in sweep.configs:
+        run_func(config, log, sweep_runs=sweep_runs, **kwargs)
+
+
+def _work_name(item: PollingModelConfig | list[PollingModelConfig]) -> str:
+    if isinstance(item, list):
+        return f'sweep of {len(item)} config(s) from {item[0].config_set}/{item[0].config_name}'
+
+    return f'{item.config_set}/{item.config_name}'
+
+
+def location_job_groups(work: list, estimate_memory: bool=True, log: bool=False) -> Iterator[JobGroup]:
+    '''
+    The items of work (configs or sweeps) as a JobGroup per location. The distance data of a location
+    is loaded to share (see load_shared_data) when its group is taken, and released with it. With
+    estimate_memory, the memory of each job is its estimated peak memory, otherwise 0.
+    '''
+    for location_work in location_work_groups(work):
+        configs = [config for item in location_work for config in work_configs(item)]
+        shared_data = load_shared_data(configs, log)
+        jobs = [
+            ScheduledJob(
+                name=_work_name(item), args=(item,), memory=estimate_peak_memory(item) if estimate_memory else 0,
+            )
+            for item in location_work
+        ]
+        if estimate_memory:
+            total_memory = sum(job.memory for job in jobs)
+            print(
+                f'{configs[0].location}: {len(jobs)} run(s) estimated {total_memory / 1024**3:.1f} GB in total, '
+                f'with {shared_data.memory / 1024**3:.1f} GB of shared distance data'
+            )
+        yield JobGroup(jobs=jobs, memory=shared_data.memory, release=partial(release_shared_data, shared_data))
+
+
+def run_scheduled(
+    worker_func: Callable,
+    work: list,
+    memory_budget: float | None,
+    max_processes: int,
+    verbose=False,
+):
+    '''
+    Runs worker_func on each config or sweep in work in a new process, up to max_processes at a time
+    and, unless memory_budget is None, within memory_budget GB. The work of a location shares the
+    location's distance data, which counts against the budget. The next location is loaded once the
+    work of those before has all started, so its runs fill the processes that the last runs of the
+    location before leave free. A failed run does not stop the others: a ValueError naming every
+    failed run is raised once all of the work has finished.
+    '''
+    if memory_budget is not None:
+        print(f'Running up to {max_processes} at a time within {memory_budget} GB against {len(work)} run(s)')
+
+    scheduler = MemoryScheduler(
+        int(memory_budget * 1024**3) if memory_budget is not None else None,
+        max_processes,
+        shared_data_mp_context(),
+        log=verbose,
+    )
+    groups = location_job_groups(work, estimate_memory=memory_budget is not None, log=verbose)
+    with tqdm(total=len(work)) as progress:
+        for _ in scheduler.run_groups(worker_func, groups):
+            progress.update()
@@ -14,7 +14,8 @@ import datetime as dt
 from .constants import (
     CONFIG_DB_ID, CONFIG_COMMIT_HASH, CONFIG_RUN_TIME, CONFIG_FILE_PATH, CONFIG_LOG_FILE_PATH,
     CONFIG_MAP_SOURCE_DATE, CONFIG_LOCATION_SOURCE, CONFIG_YEAR, CONFIG_BAD_TYPES, CONFIG_PENALIZED_SITES,
-    DATA_SOURCE_CSV,
+    CONFIG_SPARSE_PAIRS, CONFIG_ARRAY_MODEL, CONFIG_SOLVER_IN_MEMORY, CONFIG_SPECULATIVE_PENALTY, DATA_SOURCE_CSV,
+    SOLVER_BACKEND_SCIP,
 )
 from python.utils.environments import Environment
 
@@ -31,7 +32,7 @@ ENVIRONMENT = 'environment'
 IGNORE_ON_LOAD = [
     CONFIG_DB_ID, CONFIG_COMMIT_HASH, CONFIG_RUN_TIME, CONFIG_FILE_PATH,
     CONFIG_LOG_FILE_PATH, CONFIG_MAP_SOURCE_DATE, CONFIG_LOCATION_SOURCE,
-    ENVIRONMENT,
+    ENVIRONMENT, CONFIG_SPARSE_PAIRS, CONFIG_ARRAY_MODEL, CONFIG_SOLVER_IN_MEMORY, CONFIG_SPECULATIVE_PENALTY,
 ]
 
 @dataclass
@@ -125,6 +126,50 @@ class PollingModelConfig:
     ''' Environment configs, specifically on which bigquery project and dataset
         to use when connectingt to the database. '''
 
+    sparse_pairs: bool = False
+    ''' If True, the model only has matching variables (and the related parameters and constraints) for
+        residence, precinct pairs within the max_min radius, the only pairs that can be matched. This
+        gives the same solution as the full model with a much smaller model. Set from the command line,
+        not from config files. '''
+
+    array_model: bool = False
+    ''' If True, the model is built as numpy arrays by array_model_factory and written straight to an
+        MPS file for the solver instead of being built with pyomo. The model always only has the pairs
+        within the max_min radius, as with sparse_pairs. Set from the command line, not from config
+        files. '''
+
+    solver: Literal['scip', 'highs', 'cbc', 'heuristic'] = SOLVER_BACKEND_SCIP
+    ''' The solver backend to solve the model with. Can be overridden from the command line. '''
+
+    solver_threads: int = None
+    ''' The number of threads the solver may use, the solver's default if None (1 LP thread for scip).
+        Can be overridden from the command line. '''
+
+    solver_presolve: bool = None
+    ''' Whether the solver presolves the model, the solver's default if None. Can be overridden from
+        the command line. '''
+
+    solver_emphasis: Literal['feasibility', 'optimality'] = None
+    ''' Whether the solver focuses on finding good solutions quickly (feasibility) or on proving
+        optimality (optimality), the solver's default if None. Can be overridden from the command
+        line. '''
+
+    warm_start: bool = True
+    ''' If True, Model 2 and Model 3 of the penalty workflow start the solver from the solution of
+        Model 1 (and Model 2 for Model 3), repaired to be feasible for them. Can be overridden from
+        the command line. '''
+
+    solver_in_memory: bool = False
+    ''' If True, the model is built as arrays (as with array_model) and handed to a solver kept in
+        this process, which keeps it loaded between the solves of a run and only updates what changed
+        from one model to the next. Only for the scip and highs solvers. Set from the command line,
+        not from config files. '''
+
+    speculative_penalty: bool = False
+    ''' If True and there are penalized sites, Model 2 of the penalty workflow is built and solved in
+        a separate process while Model 1 solves, and cancelled if Model 1 selects no penalized sites.
+        Set from the command line, not from config files. '''
+
     def __post_init__(self):
         self.varnames = list(vars(self).keys()) # Not sure if this will work, let's see
 
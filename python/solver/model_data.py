@@ -8,7 +8,6 @@ from typing import Literal
 import pandas as pd
 import numpy as np
 import os
-from haversine import haversine
 import geopandas as gpd
 
 from python.database.query import Query
@@ -16,6 +15,7 @@ from python.utils import (
     build_driving_distances_file_path,
     build_potential_locations_file_path,
     build_distance_file_path,
+    DISTANCE_FILE_FORMAT_PARQUET,
     build_demographics_dir_path,
     build_p3_source_file_path,
     build_p4_source_file_path,
@@ -27,6 +27,8 @@ from python.utils import (
 
 from python.utils.pull_census_data import pull_census_data
 from .model_config import PollingModelConfig
+from .distance_matrix import DistanceMatrix, prepare_tables, pairs_to_distance_df
+from .spatial_index import DEFAULT_NEAREST_K, candidate_pairs
 
 # pylint: disable-next=wildcard-import,unused-wildcard-import
 from .constants import *
@@ -94,6 +96,31 @@ FULL_DISTANCE_DATA_DF_COLS = [
     DISTANCE_MULTIPLE_RACES,
 ]
 
+DEFAULT_HAVERSINE_CHUNK_SIZE = 1_000_000
+''' The default number of origin/destination pairs to compute haversine distances for at a time '''
+
+DEFAULT_DISTANCE_WRITE_CHUNK_SIZE = 1_000_000
+''' The default number of origin/destination pairs to write to the distance data file at a time '''
+
+DISTANCE_PARQUET_COMPRESSION = 'zstd'
+''' Compression used for the parquet distance data cache '''
+
+MODEL_DISTANCE_DTYPE = np.dtype(np.float64)
+'''
+The dtype of the DistanceMatrix a model is run on. The distances are kept at the precision of the
+distance files so that results are the same as those computed from the long form data.
+'''
+
+MODEL_DISTANCE_COLS = [
+    DISTANCE_ID_ORIG,
+    DISTANCE_ID_DEST,
+    DISTANCE_LOCATION_TYPE,
+    DISTANCE_DEST_TYPE,
+    DISTANCE_TOTAL_POPULATION,
+    DISTANCE_DISTANCE_M,
+]
+''' The columns of the distance data the models are built from, see model_distance_df '''
+
 @dataclass
 class PotentialLocationsData:
     ''' A simple dataclass to hold potential locations data '''
@@ -325,11 +352,23 @@ def build_distance_data(
     potential_locations_path_override: str=None,
     output_path_override: str=None,
     query: Query=None,
+    haversine_chunk_size: int=DEFAULT_HAVERSINE_CHUNK_SIZE,
+    max_distance_m: float=None,
+    nearest_k: int=DEFAULT_NEAREST_K,
+    write_chunk_size: int=DEFAULT_DISTANCE_WRITE_CHUNK_SIZE,
 ) -> BuildDistanceMetaData:
     '''
     Build distance data set from census data and potential locations data
     and write it to a csv file. An instance of SourceData is returned with metadata about the
     built data set.
+
+    haversine_chunk_size bounds how many pairs haversine distances are computed for at once, set it
+    to None to compute all pairs in a single pass. write_chunk_size bounds how many pairs are
+    expanded to rows of the file at once.
+
+    By default every (block, location) pair is written. If max_distance_m is set, only the pairs
+    within max_distance_m (haversine) of each other plus the nearest_k locations of every location
+    type for each block are written, see build_candidate_distance_df.
     '''
 
     potential_locations_data = get_potential_locations_data(
@@ -379,29 +418,27 @@ def build_distance_data(
     if len(all_locations.Location) != len(set(all_locations.Location)):
         raise ValueError('Non-unique names in Location column. This will cause errors later.')
 
-    #####
-    # Cross join polling locations and demographics tables
-    #####
-    demographics_block_df = get_demographics_block(census_year, location)
-    distance_df = demographics_block_df.merge(all_locations, how=PD_CROSS)
-
     #####
     # Rename, select columns
     #####
+    demographics_block_df = get_demographics_block(census_year, location)
 
-    distance_df = distance_df.rename(columns = {
-        CEN20_GEO_ID: DISTANCE_ID_ORIG, POT_LOC_ADDRESS: DISTANCE_ADDRESS, POT_LOC_LATITUDE: DISTANCE_DEST_LAT,
-        POT_LOC_LONGITUDE: DISTANCE_DEST_LON, TIGER20_INTPTLAT20: DISTANCE_ORIG_LAT,
-        TIGER20_INTPTLON20: DISTANCE_ORIG_LON, POT_LOC_LOCATION_TYPE: DISTANCE_LOCATION_TYPE,
+    origins_df = demographics_block_df.rename(columns = {
+        CEN20_GEO_ID: DISTANCE_ID_ORIG, TIGER20_INTPTLAT20: DISTANCE_ORIG_LAT,
+        TIGER20_INTPTLON20: DISTANCE_ORIG_LON,
+    })
+    destinations_df = all_locations.rename(columns = {
+        POT_LOC_ADDRESS: DISTANCE_ADDRESS, POT_LOC_LATITUDE: DISTANCE_DEST_LAT,
+        POT_LOC_LONGITUDE: DISTANCE_DEST_LON, POT_LOC_LOCATION_TYPE: DISTANCE_LOCATION_TYPE,
         POT_LOC_LOCATION: DISTANCE_ID_DEST,
     })
-    distance_df = distance_df[FULL_DISTANCE_DATA_DF_COLS]
 
     #####
     # Calculate appropriate distance
     #####
+    driving_distances_df = None
     if driving:
-        # Load driving distances to insert them into distance_df
+        # Load driving distances to insert them into the distance data
         if data_source == DATA_SOURCE_DB:
             # Load the driving_distances_df from DB
             driving_distance_set = query.find_driving_distance_set(census_year, map_source_date, location)
@@ -415,27 +452,47 @@ def build_distance_data(
             # Load the driving_distances_df from CSV
             driving_distances_df = get_csv_driving_distances(census_year, map_source_date, location)
 
-        distance_df = insert_driving_distances(distance_df, driving_distances_df)
+    if max_distance_m is None:
+        # Distances are held as an origins x destinations matrix rather than a cross join of the two tables
+        distance_matrix = DistanceMatrix.from_tables(origins_df, destinations_df, dtype=np.float64)
 
+        if driving:
+            insert_driving_distances_matrix(distance_matrix, driving_distances_df)
+        else:
+            # driving == false so calculate haversine distances instead of using driving distances
+            distance_matrix.distances = haversine_matrix(
+                distance_matrix.origins[DISTANCE_ORIG_LAT].to_numpy(),
+                distance_matrix.origins[DISTANCE_ORIG_LON].to_numpy(),
+                distance_matrix.destinations[DISTANCE_DEST_LAT].to_numpy(),
+                distance_matrix.destinations[DISTANCE_DEST_LON].to_numpy(),
+                chunk_size=haversine_chunk_size,
+            )
+            distance_matrix.source = DISTANCE_SOURCE_HAVERSINE_DISTANCE
+
+        # if log distance, modify the source and distance columns
+        if log_distance:
+            distance_matrix.source = DISTANCE_SOURCE_LOG_WITH_SPACE + distance_matrix.source
+            distance_matrix.distances = log_distances(distance_matrix.distances)
+
+        # Expand to one row per (id_orig, id_dest) pair, ordered by origin then destination as the cross
+        # join was, a chunk of origins at a time so the whole long form is never held next to the matrix.
+        # The distances stay float64, the precision they are written with. DISTANCE_ID_ORIG and
+        # DISTANCE_ID_DEST are strings.
+        distance_dfs = distance_matrix.iter_distance_df(
+            max(1, write_chunk_size // max(distance_matrix.num_destinations, 1)),
+            include_missing=True,
+        )
     else:
-        # driving == false so calculate haversine distances instead of using driving distances
-        distance_df[DISTANCE_DISTANCE_M] = distance_df.apply(
-            lambda row: haversine((row.orig_lat, row.orig_lon), (row.dest_lat, row.dest_lon)),
-            axis=1,
-        ) * 1000
-
-        distance_df[DISTANCE_SOURCE] = DISTANCE_SOURCE_HAVERSINE_DISTANCE
-
-    # if log distance, modify the source and distance columns
-    if log_distance:
-        distance_df[DISTANCE_SOURCE] = DISTANCE_SOURCE_LOG_WITH_SPACE + distance_df[DISTANCE_SOURCE]
-        #TODO: why are there 0 distances showing up?
-        distance_df[DISTANCE_DISTANCE_M].mask(distance_df[DISTANCE_DISTANCE_M] == 0.0, 0.001, inplace=True)
-        distance_df[DISTANCE_DISTANCE_M] = np.log(distance_df[DISTANCE_DISTANCE_M])
-
-    # Ensure DISTANCE_ID_ORIG and DISTANCE_ID_DEST are strings
-    distance_df[DISTANCE_ID_ORIG] = distance_df[DISTANCE_ID_ORIG].astype(str)
-    distance_df[DISTANCE_ID_DEST] = distance_df[DISTANCE_ID_DEST].astype(str)
+        # Only the candidate pairs found with the spatial index are kept
+        distance_dfs = [build_candidate_distance_df(
+            origins_df,
+            destinations_df,
+            max_distance_m=max_distance_m,
+            nearest_k=nearest_k,
+            driving_distances_df=driving_distances_df,
+            log_distance=log_distance,
+            haversine_chunk_size=haversine_chunk_size,
+        )]
 
     #####
     # Reformat and write to file (making directory if it doesn't exist)
@@ -445,12 +502,206 @@ def build_distance_data(
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    distance_df.to_csv(output_path, index = True)
+    for chunk, distance_df in enumerate(distance_dfs):
+        distance_df.to_csv(output_path, index = True, mode='w' if chunk == 0 else 'a', header=chunk == 0)
 
     # Return metadata about the built distance data
     return build_distance_meta_data
 
 
+def build_candidate_distance_df(
+    origins_df: pd.DataFrame,
+    destinations_df: pd.DataFrame,
+    max_distance_m: float,
+    nearest_k: int=DEFAULT_NEAREST_K,
+    driving_distances_df: pd.DataFrame=None,
+    log_distance: bool=False,
+    haversine_chunk_size: int=DEFAULT_HAVERSINE_CHUNK_SIZE,
+) -> pd.DataFrame:
+    '''
+    Builds sparse distance data holding only candidate pairs instead of the full cross join of
+    origins and destinations. The candidates are every pair within max_distance_m meters (haversine)
+    of each other, plus the nearest_k destinations of every location type for each origin. Keeping
+    the nearest destinations of each location type means that alpha and the minimum distances used by
+    the model are unchanged for any choice of bad_types. The number of rows grows with the number
+    of origins times the number of nearby destinations rather than all destinations.
+
+    Arguments
+    origins_df: origins with id_orig, orig_lat, orig_lon and demographic columns
+    destinations_df: destinations with id_dest, dest_lat, dest_lon, location_type and the other
+        destination columns
+    driving_distances_df: if given, driving distances are used for the candidate pairs (which are
+        still selected by haversine distance), pairs without a driving distance get a NaN distance_m
+
+    Returns
+    Long form distance data with the same columns as the files written by build_distance_data, ordered
+    by origin then destination
+    '''
+    origins, destinations = prepare_tables(origins_df, destinations_df)
+
+    orig_positions, dest_positions = candidate_pairs(
+        origins[DISTANCE_ORIG_LAT].to_numpy(),
+        origins[DISTANCE_ORIG_LON].to_numpy(),
+        destinations[DISTANCE_DEST_LAT].to_numpy(),
+        destinations[DISTANCE_DEST_LON].to_numpy(),
+        dest_groups=destinations[DISTANCE_LOCATION_TYPE].to_numpy(),
+        max_distance_m=max_distance_m,
+        nearest_k=nearest_k,
+    )
+
+    if driving_distances_df is not None:
+        distance_df = pairs_to_distance_df(
+            origins, destinations, orig_positions, dest_positions, None, columns=FULL_DISTANCE_DATA_DF_COLS,
+        )
+        distance_df = insert_driving_distances(distance_df, driving_distances_df)
+    else:
+        distance_df = pairs_to_distance_df(
+            origins,
+            destinations,
+            orig_positions,
+            dest_positions,
+            haversine_distances(
+                origins[DISTANCE_ORIG_LAT].to_numpy()[orig_positions],
+                origins[DISTANCE_ORIG_LON].to_numpy()[orig_positions],
+                destinations[DISTANCE_DEST_LAT].to_numpy()[dest_positions],
+                destinations[DISTANCE_DEST_LON].to_numpy()[dest_positions],
+                chunk_size=haversine_chunk_size,
+            ),
+            source=DISTANCE_SOURCE_HAVERSINE_DISTANCE,
+        )
+
+    if log_distance:
+        distance_df[DISTANCE_SOURCE] = DISTANCE_SOURCE_LOG_WITH_SPACE + distance_df[DISTANCE_SOURCE]
+        distance_df[DISTANCE_DISTANCE_M] = log_distances(distance_df[DISTANCE_DISTANCE_M])
+
+    return distance_df
+
+
+def log_distances(distances: np.ndarray) -> np.ndarray:
+    ''' The log of distances, as used for log distance data. Zero distances are treated as 0.001. '''
+    distances = np.array(distances, dtype=np.float64)
+    #TODO: why are there 0 distances showing up?
+    distances[distances == 0.0] = 0.001
+
+    return np.log(distances)
+
+
+def haversine_distances(
+    orig_lat: np.ndarray,
+    orig_lon: np.ndarray,
+    dest_lat: np.ndarray,
+    dest_lon: np.ndarray,
+    chunk_size: int=None,
+) -> np.ndarray:
+    '''
+    Computes the great circle distance in meters between each origin and destination coordinate
+    pair (in degrees). This gives the same results as calling haversine((orig_lat, orig_lon),
+    (dest_lat, dest_lon)) * 1000 on every pair, but operates on whole arrays at once.
+
+    Arguments
+    orig_lat, orig_lon, dest_lat, dest_lon: equal length arrays of coordinates
+    chunk_size: if set, distances are computed for at most chunk_size pairs at a time so that
+        the intermediate arrays stay small.
+
+    Returns
+    A float64 array of distances in meters
+    '''
+    orig_lat = np.asarray(orig_lat, dtype=np.float64)
+    orig_lon = np.asarray(orig_lon, dtype=np.float64)
+    dest_lat = np.asarray(dest_lat, dtype=np.float64)
+    dest_lon = np.asarray(dest_lon, dtype=np.float64)
+
+    num_pairs = len(orig_lat)
+    if not len(orig_lon) == len(dest_lat) == len(dest_lon) == num_pairs:
+        raise ValueError('Origin and destination coordinate arrays must all be the same length')
+    if chunk_size is not None and chunk_size <= 0:
+        raise ValueError(f'Invalid haversine chunk_size {chunk_size}')
+
+    result = np.empty(num_pairs, dtype=np.float64)
+    step = chunk_size or max(num_pairs, 1)
+
+    for start in range(0, num_pairs, step):
+        chunk = slice(start, start + step)
+        _haversine_kernel(
+            orig_lat[chunk], orig_lon[chunk], dest_lat[chunk], dest_lon[chunk], out=result[chunk],
+        )
+
+    return result
+
+
+def haversine_matrix(
+    orig_lat: np.ndarray,
+    orig_lon: np.ndarray,
+    dest_lat: np.ndarray,
+    dest_lon: np.ndarray,
+    chunk_size: int=None,
+) -> np.ndarray:
+    '''
+    Computes the haversine distance in meters from every origin to every destination, returning a
+    num_origins x num_destinations array. If chunk_size is set, blocks of origins are processed so
+    that at most about chunk_size pairs are computed at a time.
+    '''
+    orig_lat = np.asarray(orig_lat, dtype=np.float64)
+    orig_lon = np.asarray(orig_lon, dtype=np.float64)
+    dest_lat = np.asarray(dest_lat, dtype=np.float64)[np.newaxis, :]
+    dest_lon = np.asarray(dest_lon, dtype=np.float64)[np.newaxis, :]
+
+    num_origins = len(orig_lat)
+    num_dests = dest_lat.shape[1]
+    if chunk_size is not None and chunk_size <= 0:
+        raise ValueError(f'Invalid haversine chunk_size {chunk_size}')
+
+    result = np.empty((num_origins, num_dests), dtype=np.float64)
+    step = max(chunk_size // max(num_dests, 1), 1) if chunk_size else max(num_origins, 1)
+
+    for start in range(0, num_origins, step):
+        rows = slice(start, start + step)
+        _haversine_kernel(
+            orig_lat[rows, np.newaxis], orig_lon[rows, np.newaxis], dest_lat, dest_lon, out=result[rows],
+        )
+
+    return result
+
+
+def _haversine_kernel(
+    orig_lat: np.ndarray,
+    orig_lon: np.ndarray,
+    dest_lat: np.ndarray,
+    dest_lon: np.ndarray,
+    out: np.ndarray,
+):
+    '''
+    Writes haversine distances in meters into out, reusing out as the working array. The coordinate
+    arrays only need to broadcast to the shape of out.
+    '''
+    lat1 = np.radians(orig_lat)
+    lat2 = np.radians(dest_lat)
+
+    # sin^2(dlon / 2)
+    np.subtract(dest_lon, orig_lon, out=out)
+    np.radians(out, out=out)
+    out *= 0.5
+    np.sin(out, out=out)
+    np.square(out, out=out)
+
+    # cos(lat1) * cos(lat2) * sin^2(dlon / 2)
+    out *= np.cos(lat1)
+    out *= np.cos(lat2)
+
+    # + sin^2(dlat / 2)
+    dlat = np.subtract(lat2, lat1)
+    dlat *= 0.5
+    np.sin(dlat, out=dlat)
+    np.square(dlat, out=dlat)
+    out += dlat
+
+    # 2 * R * asin(sqrt(d)), in meters
+    np.sqrt(out, out=out)
+    np.arcsin(out, out=out)
+    out *= 2 * HAVERSINE_EARTH_RADIUS_KM
+    out *= 1000
+
+
 def insert_driving_distances(
     distance_df: pd.DataFrame,
     driving_distances_df: pd.DataFrame,
@@ -480,6 +731,31 @@ def insert_driving_distances(
     return combined_df
 
 
+def insert_driving_distances_matrix(
+    distance_matrix: DistanceMatrix,
+    driving_distances_df: pd.DataFrame,
+):
+    '''
+    The DistanceMatrix version of insert_driving_distances. Sets the distances of distance_matrix in
+    place to the driving distances in driving_distances_df. Pairs without a driving distance are left
+    missing (NaN) and driving distances for unknown ids are ignored.
+
+    Raises
+    ValueError - if driving_distances_df is missing a required column
+    '''
+
+    if {DISTANCE_ID_ORIG, DISTANCE_ID_DEST, DISTANCE_DISTANCE_M} - set(driving_distances_df.columns):
+        raise ValueError('Driving Distances must contain id_orig, id_dest, and distance_m columns')
+
+    distance_matrix.distances[:] = np.nan
+    distance_matrix.set_distances(
+        driving_distances_df[DISTANCE_ID_ORIG],
+        driving_distances_df[DISTANCE_ID_DEST],
+        driving_distances_df[DISTANCE_DISTANCE_M].to_numpy(),
+    )
+    distance_matrix.source = DISTANCE_SOURCE_DRIVING_DISTANCE
+
+
 def get_csv_driving_distances(census_year: str, map_source_date: str, location: str) -> pd.DataFrame:
     '''
     Builds the path to the driving distances file and uses it to call load_driving_distances_csv to load
@@ -524,16 +800,50 @@ def load_potential_locations_csv(potential_locations_csv_path: str) -> pd.DataFr
     return pd.read_csv(potential_locations_csv_path, index_col=False, dtype=dtype_spec)
 
 
-def load_distance_data_csv(distance_data_csv_path: str) -> pd.DataFrame:
+def load_distance_data_csv(distance_data_csv_path: str, columns: list[str]=None) -> pd.DataFrame:
     '''
-    Load distance data from a CSV file.
+    Load distance data from a CSV file. If columns is given only those columns are loaded.
     '''
     if not os.path.isfile(distance_data_csv_path):
         raise ValueError(f'Distance data file {distance_data_csv_path} does not exist.')
 
     dtype_spec = {DISTANCE_ID_ORIG: PD_DTYPE_STR, DISTANCE_ID_DEST: PD_DTYPE_STR}
 
-    return pd.read_csv(distance_data_csv_path, index_col=0, dtype=dtype_spec)
+    usecols = None
+    if columns is not None:
+        # The first column of the file is the index
+        index_col_name = pd.read_csv(distance_data_csv_path, nrows=0).columns[0]
+        usecols = [index_col_name] + list(columns)
+
+    return pd.read_csv(distance_data_csv_path, index_col=0, dtype=dtype_spec, usecols=usecols)
+
+
+def load_distance_data_parquet(distance_data_parquet_path: str, columns: list[str]=None) -> pd.DataFrame:
+    '''
+    Load distance data from a parquet file. If columns is given only those columns are read from disk.
+    '''
+    if not os.path.isfile(distance_data_parquet_path):
+        raise ValueError(f'Distance data file {distance_data_parquet_path} does not exist.')
+
+    return pd.read_parquet(distance_data_parquet_path, columns=columns)
+
+
+def write_distance_data_parquet(distance_df: pd.DataFrame, distance_data_parquet_path: str):
+    '''
+    Writes distance data to a parquet file. The file is written next to its final path and then
+    moved into place so that concurrent readers never see a partial file.
+    '''
+    output_dir = os.path.dirname(distance_data_parquet_path)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+
+    distance_df = distance_df.astype({
+        col: PD_DTYPE_STR for col in [DISTANCE_ID_ORIG, DISTANCE_ID_DEST] if col in distance_df.columns
+    })
+
+    tmp_path = f'{distance_data_parquet_path}.{os.getpid()}.tmp'
+    distance_df.to_parquet(tmp_path, index=True, compression=DISTANCE_PARQUET_COMPRESSION)
+    os.replace(tmp_path, distance_data_parquet_path)
 
 
 def load_driving_distances_csv(driving_distance_file_path: str) -> pd.DataFrame:
@@ -550,9 +860,65 @@ def load_driving_distances_csv(driving_distance_file_path: str) -> pd.DataFrame:
 
 @dataclass
 class DistanceData:
-    ''' A simple dataclass to hold distance data and associated metadata '''
+    '''
+    A simple dataclass to hold distance data and associated metadata. The data is held either in long
+    form as distance_df, as it is loaded, or as distance_matrix, as it is run on (see
+    distance_matrix_data).
+    '''
     distance_df: pd.DataFrame
     distance_data_set_id: str = None
+    distance_matrix: DistanceMatrix = None
+
+    @property
+    def nbytes(self) -> int:
+        ''' Approximate memory used by the distance data in bytes '''
+        if self.distance_df is None:
+            return self.distance_matrix.nbytes
+
+        return int(self.distance_df.memory_usage(deep=True).sum())
+
+
+def distance_matrix_data(distance_data: DistanceData) -> DistanceData:
+    '''
+    distance_data held as a DistanceMatrix of MODEL_DISTANCE_DTYPE instead of in long form, as models
+    are run on it. Its origins and destinations keep the order they appear in, so that the long form
+    built from it keeps the order of the rows of the (unpruned) distance files.
+    '''
+    if distance_data.distance_df is None:
+        return distance_data
+
+    return DistanceData(
+        distance_df=None,
+        distance_data_set_id=distance_data.distance_data_set_id,
+        distance_matrix=DistanceMatrix.from_distance_df(
+            distance_data.distance_df, dtype=MODEL_DISTANCE_DTYPE, sort=False,
+        ),
+    )
+
+
+PRELOADED_DISTANCE_DATA: dict[tuple, DistanceData] = {}
+''' Distance data loaded once by preload_distance_data, by distance_data_key '''
+
+
+def distance_data_key(census_year: str, location: str, log_distance: bool, driving: bool) -> tuple:
+    ''' The key of the distance data of a location in PRELOADED_DISTANCE_DATA '''
+    return (census_year, location, log_distance, driving)
+
+
+def preload_distance_data(
+    distance_data: DistanceData,
+    census_year: str,
+    location: str,
+    log_distance: bool,
+    driving: bool,
+):
+    '''
+    Keeps distance_data for get_distance_data to return for its location in this process, and in the
+    processes forked from it, which share it copy-on-write instead of each loading its own copy. The
+    distance_df or distance_matrix must then be treated as read-only.
+    '''
+    PRELOADED_DISTANCE_DATA[distance_data_key(census_year, location, log_distance, driving)] = distance_data
+
 
 def get_distance_data_csv(
     census_year: str,
@@ -560,6 +926,7 @@ def get_distance_data_csv(
     log_distance: bool,
     driving: bool,
     log: bool,
+    columns: list[str]=None,
 ) -> DistanceData | None:
     '''
     Builds the file path and loads the distance data from a CSV file using load_distance_data_csv
@@ -575,7 +942,46 @@ def get_distance_data_csv(
     if log:
         print(f'Loading distance data for {location} from {distance_data_csv_path}')
 
-    distance_df = load_distance_data_csv(distance_data_csv_path)
+    distance_df = load_distance_data_csv(distance_data_csv_path, columns=columns)
+
+    return DistanceData(
+        distance_df=distance_df,
+    )
+
+
+def get_distance_data_parquet(
+    census_year: str,
+    location: str,
+    log_distance: bool,
+    driving: bool,
+    log: bool,
+    columns: list[str]=None,
+) -> DistanceData | None:
+    '''
+    Builds the file path and loads the distance data from the parquet cache using
+    load_distance_data_parquet
+
+    Returns
+    None if the cache does not exist or is older than the CSV file, otherwise returns the
+    DistanceData object
+    '''
+    distance_data_parquet_path = build_distance_file_path(
+        census_year, location, driving, log_distance, file_format=DISTANCE_FILE_FORMAT_PARQUET,
+    )
+    distance_data_csv_path = build_distance_file_path(census_year, location, driving, log_distance)
+
+    if not os.path.isfile(distance_data_parquet_path):
+        return None
+
+    # A CSV file that was (re)built after the cache was written takes precedence
+    if os.path.isfile(distance_data_csv_path) and \
+        os.path.getmtime(distance_data_csv_path) > os.path.getmtime(distance_data_parquet_path):
+        return None
+
+    if log:
+        print(f'Loading distance data for {location} from {distance_data_parquet_path}')
+
+    distance_df = load_distance_data_parquet(distance_data_parquet_path, columns=columns)
 
     return DistanceData(
         distance_df=distance_df,
@@ -624,43 +1030,71 @@ def get_distance_data(
     driving: bool,
     query: Query=None,
     log: bool=False,
+    columns: list[str]=None,
 ) -> DistanceData:
     '''
     Gets the distance data either from local files or from the database based on data_source.
+
+    Distance data kept by preload_distance_data is returned as is, without loading it again.
+    Otherwise, local data is read from the parquet cache when it is up to date and otherwise from the
+    CSV file, after which the cache is written. Data from the database is also cached as parquet. If
+    columns is given only those columns are returned, and only those are read from the parquet cache.
     '''
 
     if not census_year:
         raise ValueError('Invalid Census year for location {location}')
 
+    preloaded = PRELOADED_DISTANCE_DATA.get(distance_data_key(census_year, location, log_distance, driving))
+    if preloaded is not None:
+        if log:
+            print(f'Using the preloaded distance data for {location}')
+        if columns is None:
+            return preloaded
+        if preloaded.distance_df is None:
+            # Only the columns asked for are expanded to long form
+            return DistanceData(
+                distance_df=preloaded.distance_matrix.to_distance_df(columns=columns, include_missing=True),
+                distance_data_set_id=preloaded.distance_data_set_id,
+            )
+        return DistanceData(
+            distance_df=preloaded.distance_df[columns],
+            distance_data_set_id=preloaded.distance_data_set_id,
+        )
+
+    parquet_path = build_distance_file_path(
+        census_year, location, driving, log_distance, file_format=DISTANCE_FILE_FORMAT_PARQUET,
+    )
+
     # Attempt to get the locations locally first - this saves much time if they have already been saved locally
-    distance_data = get_distance_data_csv(
+    distance_data = get_distance_data_parquet(
         census_year=census_year, location=location, log_distance=log_distance, driving=driving, log=log,
+        columns=columns,
     )
 
     if distance_data:
         return distance_data
 
-    if data_source != DATA_SOURCE_DB:
-        # If data source is not database, we cannot proceed further
-        # pylint: disable-next=line-too-long
-        raise ValueError(f'Polling location data cannot be found for census_year={census_year}, log_distance={log_distance}, driving={driving}, location {location}')
-
-    # distance_data was not found locally, we now have to get it from the database
-    distance_data = get_distance_data_db(
-        census_year=census_year, location=location, log_distance=log_distance, driving=driving, query=query, log=log,
+    distance_data = get_distance_data_csv(
+        census_year=census_year, location=location, log_distance=log_distance, driving=driving, log=log,
     )
 
-    # Write the locations out locally
-    output_path = build_distance_file_path(
-        census_year, location, driving, log_distance,
-    )
+    if not distance_data:
+        if data_source != DATA_SOURCE_DB:
+            # If data source is not database, we cannot proceed further
+            # pylint: disable-next=line-too-long
+            raise ValueError(f'Polling location data cannot be found for census_year={census_year}, log_distance={log_distance}, driving={driving}, location {location}')
 
-    # The following writes the distance data to a local CSV file as a way to cache it for future use
-    output_dir = os.path.dirname(output_path)
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+        # distance_data was not found locally, we now have to get it from the database
+        distance_data = get_distance_data_db(
+            census_year=census_year, location=location, log_distance=log_distance, driving=driving,
+            query=query, log=log,
+        )
 
-    distance_data.distance_df.to_csv(output_path, index=True)
+    # The following writes the distance data to a local parquet file as a way to cache it for future use
+    write_distance_data_parquet(distance_data.distance_df, parquet_path)
+
+    if columns is not None:
+        distance_data.distance_df = distance_data.distance_df[columns]
 
     return distance_data
 
@@ -689,22 +1123,17 @@ def filter_dest_type(distance_df: pd.DataFrame, year_list: list[str]):
     )
 
 
-# pylint: disable-next=unused-argument
-def filter_distance_data(config: PollingModelConfig, distance_df: pd.DataFrame, for_alpha: bool, log: bool):
+def filter_destination_types(config: PollingModelConfig, df: pd.DataFrame, for_alpha: bool) -> pd.DataFrame:
     '''
-    Reads the intermediate data frame from file, and pull the relevant rows.
-    Notes:
-        - This this function is called twice, once for calculating alpha and once for
-          the base data set.
-        - The call for alpha should only take the original polling locations
+    A copy of the rows of df (distance data, or a table of destinations) whose location type is kept
+    for the config, with their dest_type set for the years of the config. These are the destination
+    rules of filter_distance_data and filter_distance_matrix.
     '''
     location = config.location
     year_list = config.year
 
-    filtered_distance_df = distance_df.copy(deep=True)
-
     # Pull out unique location types is this data
-    unique_location_types = filtered_distance_df[DISTANCE_LOCATION_TYPE].unique()
+    unique_location_types = df[DISTANCE_LOCATION_TYPE].unique()
 
     if for_alpha: #if this is running to calculate alpha, remove all potential locations and centroids.
                     #Note, this keeps all historical locations from all years.
@@ -717,9 +1146,7 @@ def filter_distance_data(config: PollingModelConfig, distance_df: pd.DataFrame,
     else:
         bad_location_list = config.bad_types
 
-    polling_location_types = set(
-        filtered_distance_df[filtered_distance_df.dest_type == DISTANCE_DEST_TYPE_POLLING][DISTANCE_LOCATION_TYPE]
-    )
+    polling_location_types = set(df[df.dest_type == DISTANCE_DEST_TYPE_POLLING][DISTANCE_LOCATION_TYPE])
 
     for year in year_list:
         if not any(str(year) in poll for poll in polling_location_types):
@@ -732,9 +1159,33 @@ def filter_distance_data(config: PollingModelConfig, distance_df: pd.DataFrame,
         raise ValueError(f'unrecognized bad location types {unrecognized} in {config.config_file_path}')
 
     # Drop rows of bad location types in df
-    filtered_distance_df = filtered_distance_df[~filtered_distance_df[DISTANCE_LOCATION_TYPE].isin(bad_location_list)]
+    filtered_df = df[~df[DISTANCE_LOCATION_TYPE].isin(bad_location_list)].copy()
+
+    filter_dest_type(filtered_df, year_list)
+
+    return filtered_df
+
 
-    filter_dest_type(filtered_distance_df, year_list)
+def print_missing_distances(missing_origs: set, missing_dests: set):
+    ''' Prints the origins and destinations without any distance '''
+    if len(missing_dests) > 0:
+        print(f'distances missing for {len(missing_dests)} destination(s): {missing_dests}')
+    if len(missing_origs) > 0:
+        print(f'distances missing for {len(missing_origs)} origin(s): {missing_origs}')
+
+
+# pylint: disable-next=unused-argument
+def filter_distance_data(config: PollingModelConfig, distance_df: pd.DataFrame, for_alpha: bool, log: bool):
+    '''
+    Reads the intermediate data frame from file, and pull the relevant rows.
+    Notes:
+        - This this function is called twice, once for calculating alpha and once for
+          the base data set.
+        - The call for alpha should only take the original polling locations
+    '''
+    # distance_df is only read, it may be shared with other processes (see preload_distance_data).
+    # The rows kept are copied.
+    filtered_distance_df = filter_destination_types(config, distance_df, for_alpha)
 
     # Check that this hasn't created duplicates (should not have); drop these
     filtered_distance_df = filtered_distance_df.drop_duplicates()
@@ -752,12 +1203,7 @@ def filter_distance_data(config: PollingModelConfig, distance_df: pd.DataFrame,
         notna_df = filtered_distance_df[pd.notna(filtered_distance_df.distance_m)]
         notna_orig = set(notna_df.id_orig)
         notna_dest = set(notna_df.id_dest)
-        missing_origs = all_orig - notna_orig
-        missing_dests = all_dest - notna_dest
-        if len(missing_dests) > 0:
-            print(f'distances missing for {len(missing_dests)} destination(s): {missing_dests}')
-        if len(missing_origs) > 0:
-            print(f'distances missing for {len(missing_origs)} origin(s): {missing_origs}')
+        print_missing_distances(all_orig - notna_orig, all_dest - notna_dest)
         raise ValueError('Some distances are missing for current config setting.')
 
     # Create other useful columns
@@ -768,12 +1214,67 @@ def filter_distance_data(config: PollingModelConfig, distance_df: pd.DataFrame,
     return filtered_distance_df
 
 
-def alpha_min(df: pd.DataFrame) -> float:
+def filter_distance_matrix(
+    config: PollingModelConfig,
+    distance_matrix: DistanceMatrix,
+    for_alpha: bool,
+    # pylint: disable-next=unused-argument
+    log: bool,
+) -> DistanceMatrix:
+    '''
+    The DistanceMatrix of the destinations of distance_matrix that filter_distance_data keeps, with
+    their dest_type set as it does. The population of each origin is checked to be unique when the
+    DistanceMatrix is built.
+    '''
+    destinations = filter_destination_types(config, distance_matrix.destinations, for_alpha)
+    filtered_matrix = distance_matrix.select_destinations(
+        distance_matrix.destination_positions(destinations.index),
+    )
+    filtered_matrix.destinations = destinations
+
+    # Raise error if there are any missing distances
+    missing = filtered_matrix.missing()
+    if missing.any():
+        # indicate destinations and origins that are missing driving distances
+        pairs = filtered_matrix.pair_mask()
+        print_missing_distances(
+            set(filtered_matrix.origin_ids[(missing == pairs).all(axis=1) & pairs.any(axis=1)]),
+            set(filtered_matrix.destination_ids[(missing == pairs).all(axis=0) & pairs.any(axis=0)]),
+        )
+        raise ValueError('Some distances are missing for current config setting.')
+
+    return filtered_matrix
+
+
+def model_distance_df(distance_matrix: DistanceMatrix) -> pd.DataFrame:
+    '''
+    The long form of distance_matrix, as filtered by filter_distance_matrix, that the models are built
+    from. It only has the MODEL_DISTANCE_COLS and weighted_dist, the other columns of the pairs matched
+    by a model are added by incorporate_result.
+    '''
+    distance_df = distance_matrix.to_distance_df(columns=MODEL_DISTANCE_COLS)
+    distance_df[DISTANCE_WEIGHTED_DIST] = distance_df[DISTANCE_TOTAL_POPULATION] * distance_df[DISTANCE_DISTANCE_M]
+
+    return distance_df
+
+
+def alpha_min(df: pd.DataFrame | DistanceMatrix) -> float:
     ''' Finds the minimal distance to polling location '''
 
-    min_df = df[
-        [DISTANCE_ID_ORIG, DISTANCE_DISTANCE_M, DISTANCE_TOTAL_POPULATION]
-    ].groupby(DISTANCE_ID_ORIG).agg(PD_MIN)
+    if isinstance(df, DistanceMatrix):
+        # Same frame as the groupby below, in the same (sorted id_orig) order. Origins without any pair
+        # are not in the groupby.
+        min_df = pd.DataFrame(
+            {
+                DISTANCE_DISTANCE_M: df.min_distances(),
+                DISTANCE_TOTAL_POPULATION: df.populations,
+            },
+            index=df.origin_ids,
+        )[df.pair_mask().any(axis=1)].sort_index()
+    else:
+        min_df = df[
+            [DISTANCE_ID_ORIG, DISTANCE_DISTANCE_M, DISTANCE_TOTAL_POPULATION]
+        ].groupby(DISTANCE_ID_ORIG).agg(PD_MIN)
 
     #find the square of the min distances
     min_df[DISTANCE_DISTANCE_SQUARED] = min_df[DISTANCE_DISTANCE_M] * min_df[DISTANCE_DISTANCE_M]
@@ -0,0 +1,235 @@
+'''
+Estimates of the size and peak memory of a model run from the dimensions of its data.
+
+The numbers of variables, constraints and nonzeros of Model 1 are exact, counted the way
+polling_model_factory and array_model_factory build the model, without building it. The models of
+the penalty workflow differ from it by a few rows.
+
+A run's memory is dominated by the model, which has a matching variable, its objective and
+constraint coefficients for every residence, precinct pair the model includes: all of the pairs for
+the default pyomo model, or only the pairs within the max_min radius with sparse_pairs or an array
+model (see uses_array_model). The per pair and per row costs below were measured on the synthetic county of
+the benchmark CLI with highs and are rough. They are meant for packing runs into a memory budget, not
+as a guarantee.
+'''
+
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from .constants import (
+    DISTANCE_ID_ORIG, DISTANCE_ID_DEST, DISTANCE_DISTANCE_M, DISTANCE_LOCATION_TYPE, DISTANCE_DEST_TYPE,
+    DISTANCE_DEST_TYPE_POLLING, SOLVER_BACKEND_HEURISTIC, SOLVER_BACKEND_SCIP,
+)
+from .array_model import uses_array_model
+from .model_config import PollingModelConfig
+from .model_factory import get_max_min_dist
+from .model_run import ModelRun
+
+DIMENSION_COLS = [
+    DISTANCE_ID_ORIG, DISTANCE_ID_DEST, DISTANCE_DISTANCE_M, DISTANCE_LOCATION_TYPE, DISTANCE_DEST_TYPE,
+]
+''' The columns of the distance data that model_dimensions reads '''
+
+PROCESS_BYTES = 500 * 1024**2
+''' The memory of a run before any model is built: the interpreter, pandas, pyomo and the solver libraries '''
+
+DATA_BYTES_PER_ROW = 600
+''' The memory of each row of the filtered distance data and of the dense distance matrices made from it '''
+
+PYOMO_BYTES_PER_PAIR = 4500
+''' The memory of each pair of a pyomo model, with its NL file and the solver's copy '''
+
+ARRAY_BYTES_PER_PAIR = 1500
+''' The memory of each pair of an ArrayModel, with the solver's copy '''
+
+PENALTY_MODELS = 3
+''' The number of models held at once by the penalty workflow, Models 1, 2 and 3 '''
+
+NL_BYTES_PER_NONZERO = 20
+''' The size of the NL file pyomo writes for scip, per nonzero of the constraints and objective '''
+
+MPS_BYTES_PER_NONZERO = 27
+''' The size of the MPS file written for an ArrayModel, per nonzero of the constraints and objective '''
+
+MODEL_FILE_NL = 'nl'
+MODEL_FILE_MPS = 'mps'
+
+
+@dataclass
+class ModelDimensions:
+    ''' The dimensions of the data of a model run '''
+
+    origins: int
+    ''' The number of residences '''
+    destinations: int
+    ''' The number of potential and existing polling locations '''
+    rows: int
+    ''' The number of rows of the filtered distance data '''
+    pairs: int
+    ''' The number of residence, precinct pairs within the max_min radius '''
+    new_sites: int = 0
+    ''' The number of potential locations that are not existing polling locations '''
+    old_sites: int = 0
+    ''' The number of existing polling locations '''
+
+
+@dataclass
+class ModelSizeEstimate:
+    ''' The estimated size of the model of a config and the peak memory of running it '''
+
+    dimensions: ModelDimensions
+    ''' The dimensions of the data of the run '''
+    variables: int
+    ''' The number of variables of Model 1 '''
+    constraints: int
+    ''' The number of constraints of Model 1 '''
+    nonzeros: int
+    ''' The number of nonzeros of the constraints of Model 1 '''
+    objective_nonzeros: int
+    ''' The number of nonzeros of the objective of Model 1 '''
+    model_file: str | None
+    ''' The format of the file the model is written to for the solver, None if it is not written to one '''
+    model_file_bytes: int | None
+    ''' The estimated size of the model file in bytes '''
+    peak_memory: int
+    ''' The estimated peak memory of the run in bytes, see estimate_model_memory '''
+
+
+def model_dimensions(config: PollingModelConfig, distance_df: pd.DataFrame) -> ModelDimensions:
+    '''
+    The dimensions of the model that config builds from distance_df, the unfiltered distance data.
+    Only drops the bad location types of the config, without copying distance_df as
+    filter_distance_data does.
+    '''
+    kept_df = distance_df.loc[
+        ~distance_df[DISTANCE_LOCATION_TYPE].isin(config.bad_types),
+        [DISTANCE_ID_ORIG, DISTANCE_ID_DEST, DISTANCE_DISTANCE_M, DISTANCE_DEST_TYPE],
+    ]
+    max_min = config.max_min_mult * get_max_min_dist(kept_df)
+
+    destinations = kept_df[DISTANCE_ID_DEST].nunique()
+    old_sites = kept_df.loc[kept_df[DISTANCE_DEST_TYPE] == DISTANCE_DEST_TYPE_POLLING, DISTANCE_ID_DEST].nunique()
+
+    return ModelDimensions(
+        origins=kept_df[DISTANCE_ID_ORIG].nunique(),
+        destinations=destinations,
+        rows=len(kept_df),
+        pairs=int(np.count_nonzero(kept_df[DISTANCE_DISTANCE_M].to_numpy() <= max_min)),
+        new_sites=destinations - old_sites,
+        old_sites=old_sites,
+    )
+
+
+def load_model_dimensions(config: PollingModelConfig, log: bool=False) -> ModelDimensions:
+    ''' The dimensions of the model of config, loading only the DIMENSION_COLS of its distance data '''
+    return model_dimensions(config, ModelRun(config, log).load_distance_data(DIMENSION_COLS).distance_df)
+
+
+def model_pairs(config: PollingModelConfig, dimensions: ModelDimensions) -> int:
+    '''
+    The number of pairs the model of config has a matching variable for: only those within the
+    max_min radius for sparse_pairs and array models, otherwise every pair in the data.
+    '''
+    if config.sparse_pairs or uses_array_model(config):
+        return dimensions.pairs
+
+    return dimensions.rows
+
+
+def estimate_model_memory(config: PollingModelConfig, dimensions: ModelDimensions) -> int:
+    ''' The estimated peak memory in bytes of running config on data with the given dimensions '''
+    if uses_array_model(config):
+        pair_bytes = dimensions.pairs * ARRAY_BYTES_PER_PAIR
+    else:
+        pair_bytes = model_pairs(config, dimensions) * PYOMO_BYTES_PER_PAIR
+
+    if config.penalized_sites:
+        # A speculative Model 2 is solved in a process of its own, with the overhead of another process
+        pair_bytes *= PENALTY_MODELS
+        if config.speculative_penalty:
+            pair_bytes += PROCESS_BYTES
+
+    return PROCESS_BYTES + dimensions.rows * DATA_BYTES_PER_ROW + pair_bytes
+
+
+def estimate_peak_memory(configs: PollingModelConfig | list[PollingModelConfig], log: bool=False) -> int:
+    '''
+    The estimated peak memory in bytes of running a config, or the largest of the estimates of a list
+    of configs run one after the other in a process, as a sweep is. Loads the distance data of each
+    config, which is quick once it is preloaded (see shared_data_context).
+    '''
+    if isinstance(configs, PollingModelConfig):
+        configs = [configs]
+
+    return max(
+        estimate_model_memory(config, load_model_dimensions(config, log))
+        for config in configs
+    )
+
+
+def estimate_model_size(config: PollingModelConfig, dimensions: ModelDimensions) -> ModelSizeEstimate:
+    ''' The estimated size of the model config builds from data with the given dimensions '''
+    pairs = model_pairs(config, dimensions)
+
+    # A matching variable per pair and an open variable per precinct
+    variables = pairs + dimensions.destinations
+
+    # The number of precincts open, each residence assigned once, a residence only matched to an
+    # open precinct for each pair and the capacity of each precinct, with the new and old location
+    # limits if they apply. Only the pairs within max_min can be assigned or count towards capacity.
+    constraints = 1 + dimensions.origins + pairs + dimensions.destinations
+    nonzeros = dimensions.destinations + dimensions.pairs + 2 * pairs + dimensions.pairs
+    if dimensions.new_sites:
+        constraints += 1
+        nonzeros += dimensions.new_sites
+    if config.minpctold != 0:
+        constraints += 1
+        nonzeros += dimensions.old_sites
+
+    if config.solver_in_memory or config.solver == SOLVER_BACKEND_HEURISTIC:
+        model_file, bytes_per_nonzero = None, None
+    elif config.array_model:
+        model_file, bytes_per_nonzero = MODEL_FILE_MPS, MPS_BYTES_PER_NONZERO
+    elif config.solver == SOLVER_BACKEND_SCIP:
+        model_file, bytes_per_nonzero = MODEL_FILE_NL, NL_BYTES_PER_NONZERO
+    else:
+        # pyomo hands the model to the other solvers without an NL file
+        model_file, bytes_per_nonzero = None, None
+
+    return ModelSizeEstimate(
+        dimensions=dimensions,
+        variables=variables,
+        constraints=constraints,
+        nonzeros=nonzeros,
+        objective_nonzeros=pairs,
+        model_file=model_file,
+        model_file_bytes=None if model_file is None else (nonzeros + pairs) * bytes_per_nonzero,
+        peak_memory=estimate_model_memory(config, dimensions),
+    )
+
+
+def size_estimates_df(configs: list[PollingModelConfig], log: bool=False) -> pd.DataFrame:
+    '''
+    A table of the estimated model size and peak memory of each config, indexed by config_set and
+    config_name. Loads the distance data of each config but builds no model.
+    '''
+    rows = []
+    for config in configs:
+        estimate = estimate_model_size(config, load_model_dimensions(config, log))
+        rows.append({
+            'config_set': config.config_set,
+            'config_name': config.config_name,
+            'residences': estimate.dimensions.origins,
+            'precincts': estimate.dimensions.destinations,
+            'pairs_within_max_min': estimate.dimensions.pairs,
+            'variables': estimate.variables,
+            'constraints': estimate.constraints,
+            'nonzeros': estimate.nonzeros + estimate.objective_nonzeros,
+            'model_file': estimate.model_file,
+            'model_file_mb': None if estimate.model_file_bytes is None else estimate.model_file_bytes / 1024**2,
+            'peak_memory_gb': estimate.peak_memory / 1024**3,
+        })
+
+    return pd.DataFrame(rows).set_index(['config_set', 'config_name'])
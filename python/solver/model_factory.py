@@ -21,11 +21,12 @@ from python.utils import timer
 from .constants import (
   DISTANCE_ID_ORIG, DISTANCE_ID_DEST, DISTANCE_TOTAL_POPULATION, DISTANCE_DISTANCE_M,
   DISTANCE_WEIGHTED_DIST, DISTANCE_DEST_TYPE_POLLING, DISTANCE_LOCATION_TYPE, DISTANCE_DEST_TYPE, PD_MEAN,
-  PD_MIN, RESULT_KP_FACTOR, PD_MAX, RESULT_NEW_LOCATION, PD_UNIQUE,
+  PD_MIN, RESULT_KP_FACTOR, PD_MAX, RESULT_NEW_LOCATION,
 )
 
 
 from .model_config import PollingModelConfig
+from .pair_adjacency import PairAdjacency
 
 # SCIP can only handle values up to 1e20
 MAX_KP_FACTOR = 9e19
@@ -38,7 +39,7 @@ class PollingModel(pyo.ConcreteModel):
     residences = pyo.Set
     '''all possible residence locations with population > 0 (unique)'''
     pairs = pyo.Set
-    '''all (precinct, residence) pairs'''
+    '''all (residence, precinct) pairs in the data, or only those within the radius if config.sparse_pairs is set'''
     within_residence_radius = pyo.Set
     '''list of precincts within radius of each residence'''
     within_precincts_radius = pyo.Set
@@ -72,15 +73,19 @@ def build_objective_rule(
     kp_penalty_parameter: float=0,
 ):
     '''The function to be minimized:
-    Variables: model.matching, indexed by reisidence precinct pairs'''
+    Variables: model.matching, indexed by reisidence precinct pairs
+
+    The sums are built with quicksum so that pyomo produces a single flat linear expression over all
+    pairs instead of a deeply nested sum, and the numeric coefficients of each term are multiplied
+    out before the variable.'''
     if site_penalty:
         def obj_rule_0(model: pyo.ConcreteModel):
             average_weighted_distances = (
-                sum(
-                    model.matching[pair] * model.weighted_dist[pair]
+                pyo.quicksum(
+                    model.weighted_dist[pair] * model.matching[pair]
                     for pair in model.pairs
-                ) / total_pop + sum(
-                    model.open[site] * site_penalty
+                ) / total_pop + pyo.quicksum(
+                    site_penalty * model.open[site]
                     for site in model.penalized_sites
                 )
             )
@@ -90,8 +95,8 @@ def build_objective_rule(
         def obj_rule_not_0(model: pyo.ConcreteModel):
             average_weighted_distances = (
                 (
-                    sum(
-                        model.population[pair[0]] * model.matching[pair] * model.kp_factor[pair]
+                    pyo.quicksum(
+                        model.population[pair[0]] * model.kp_factor[pair] * model.matching[pair]
                         for pair in model.pairs
                     ) / total_pop
                 ) + (
@@ -102,8 +107,8 @@ def build_objective_rule(
     else:
         def obj_rule_0(model: pyo.ConcreteModel):
             #take average populated weighted distance
-            average_weighted_distances = sum(
-                model.matching[pair] * model.weighted_dist[pair]
+            average_weighted_distances = pyo.quicksum(
+                model.weighted_dist[pair] * model.matching[pair]
                 for pair in model.pairs
             ) / total_pop
 
@@ -112,8 +117,8 @@ def build_objective_rule(
         def obj_rule_not_0(model: pyo.ConcreteModel):
             #take average by kp factor weight
             #pair[0] = residence
-            average_weighted_distances = sum(
-                model.population[pair[0]] * model.matching[pair] * model.kp_factor[pair]
+            average_weighted_distances = pyo.quicksum(
+                model.population[pair[0]] * model.kp_factor[pair] * model.matching[pair]
                 for pair in model.pairs
             ) / total_pop
 
@@ -130,7 +135,7 @@ def build_open_rule(
     def open_rule(
             model: pyo.ConcreteModel,
         ) -> bool:
-        return sum(
+        return pyo.quicksum(
             model.open[precinct]
             for precinct in model.precincts
         ) == precincts_open
@@ -153,8 +158,8 @@ def build_max_new_rule(
         if not any(model.new_locations[precincts] for precincts in model.precincts):
             return pyo.Constraint.Skip
 
-        return sum(
-            model.open[precinct] * model.new_locations[precinct]
+        return pyo.quicksum(
+            model.new_locations[precinct] * model.open[precinct]
             for precinct in model.precincts
         ) <= maxpctnew*precincts_open
 
@@ -174,8 +179,8 @@ def build_min_old_rule(
         if config.minpctold == 0:
             return pyo.Constraint.Skip
         else:
-            return sum(
-                model.open[precinct] * (1 - model.new_locations[precinct])
+            return pyo.quicksum(
+                (1 - model.new_locations[precinct]) * model.open[precinct]
                 for precinct in model.precincts
             ) >= config.minpctold*old_polls
 
@@ -190,7 +195,7 @@ def build_res_assigned_rule():
             residence
         ) -> bool:
         return (
-            sum(model.matching[residence, precinct]
+            pyo.quicksum(model.matching[residence, precinct]
             for precinct in model.within_residence_radius[residence]
         ) == 1)
 
@@ -224,8 +229,8 @@ def build_penalty_rule(alpha: float, beta: float, site_penalty: float):
     '''set the penalty factor'''
     def penalty_rule(model: pyo.ConcreteModel) -> bool:
         return (
-            model.penalty == -alpha * beta * sum(
-                model.open[s]*site_penalty
+            model.penalty == -alpha * beta * pyo.quicksum(
+                site_penalty * model.open[s]
                 for s in model.penalized_sites
             )
         )
@@ -253,25 +258,32 @@ def build_capacity_rule(
     Respects capacity limits and prevents overcrowding by restricting the number that can go to a precinct
     to some scaling factor of the avg population per center
     '''
-    #modify the capacity according to the user defined default precints_open
-    if config.fixed_capacity_site_number is None:
-        #capacity rule uses capacity * total_pop / precincts open
-        capacity = config.capacity
-    else: #calculate capacity_rule by replacing precints_open with fixed_capacity_site_number
-        capacity = config.capacity * precincts_open / config.fixed_capacity_site_number
+    max_population = get_max_population(config, total_pop, precincts_open)
 
     def capacity_rule(
         model: pyo.AbstractModel,
         precinct,
     ) -> bool:
-        return sum(
-            model.population[res]*model.matching[res,precinct]
+        return pyo.quicksum(
+            model.population[res] * model.matching[res,precinct]
             for res in model.within_precinct_radius[precinct]
-        ) <= (capacity * total_pop / precincts_open)
+        ) <= max_population
 
     return capacity_rule
 
 
+def get_max_population(config: PollingModelConfig, total_pop: int, precincts_open: int) -> float:
+    ''' The maximum population that the capacity constraint allows to be assigned to a precinct '''
+    #modify the capacity according to the user defined default precints_open
+    if config.fixed_capacity_site_number is None:
+        #capacity rule uses capacity * total_pop / precincts open
+        capacity = config.capacity
+    else: #calculate capacity_rule by replacing precints_open with fixed_capacity_site_number
+        capacity = config.capacity * precincts_open / config.fixed_capacity_site_number
+
+    return capacity * total_pop / precincts_open
+
+
 def compute_kp_factor(config: PollingModelConfig, alpha: float, dist_df):
     return math.e**(-config.beta * alpha * dist_df[DISTANCE_DISTANCE_M])
 
@@ -285,6 +297,100 @@ def get_max_min_dist(distance_df: pd.DataFrame):
     return max_min_dist
 
 
+def get_max_min(config: PollingModelConfig, distance_df: pd.DataFrame) -> float:
+    ''' The radius within which residences can be assigned to precincts '''
+    global_max_min_dist = get_max_min_dist(distance_df)
+
+    return config.max_min_mult * global_max_min_dist
+
+
+def get_old_polls(distance_df: pd.DataFrame) -> int:
+    ''' The number of existing polling locations in distance_df '''
+    return len(set(distance_df[distance_df[DISTANCE_DEST_TYPE] == DISTANCE_DEST_TYPE_POLLING][DISTANCE_ID_DEST]))
+
+
+def get_precincts_open(
+    config: PollingModelConfig,
+    distance_df: pd.DataFrame,
+    old_polls: int,
+    exclude_penalized_sites: bool=False,
+) -> int:
+    ''' The number of precincts to open, the number of old polling locations unless set in the config '''
+    if config.precincts_open is None:
+        precincts_open = old_polls
+    else:
+        precincts_open = config.precincts_open
+    #The number of precincts to open might need to be reduced when
+    #excluding penalized sites (penalty Model 2) to avoid infeasible model
+    if exclude_penalized_sites:
+        num_dests = len(set(distance_df[DISTANCE_ID_DEST]) - set(config.penalized_sites))
+        precincts_open = min(precincts_open, num_dests)
+
+    return precincts_open
+
+
+def get_total_pop(distance_df: pd.DataFrame) -> int:
+    ''' The total population of the residences in distance_df '''
+    # The population of each residence is repeated on all of its rows, take it from the first one
+    return distance_df.drop_duplicates(DISTANCE_ID_ORIG)[DISTANCE_TOTAL_POPULATION].sum()
+
+
+def get_penalized_sites(config: PollingModelConfig, distance_df: pd.DataFrame) -> list:
+    ''' The id_dests of the destinations whose location type is penalized in the config '''
+    if not config.penalized_sites:
+        return []
+
+    return list(set(
+        distance_df.loc[
+            distance_df[DISTANCE_LOCATION_TYPE].isin(config.penalized_sites),
+            DISTANCE_ID_DEST,
+        ].unique())
+    )
+
+
+def add_pair_columns(config: PollingModelConfig, alpha: float, distance_df: pd.DataFrame):
+    ''' Adds the kp_factor and new_location columns used by the model to distance_df in place '''
+    #KP factor
+    distance_df[RESULT_KP_FACTOR] = compute_kp_factor(config, alpha, distance_df)
+    # math.e**(-config.beta*alpha*dist_df[DISTANCE_M])
+    max_kp_factor = distance_df.groupby(DISTANCE_ID_ORIG)[RESULT_KP_FACTOR].agg(PD_MAX).max()
+    if max_kp_factor > MAX_KP_FACTOR:
+        # pylint: disable-next=line-too-long
+        warnings.warn(f'Max kp_factor is {max_kp_factor}. SCIP can only handle values up to {MAX_KP_FACTOR+1}. Consider a less negative value of beta.')
+
+    #new location marker
+    distance_df[RESULT_NEW_LOCATION] = 0
+    distance_df[RESULT_NEW_LOCATION].mask(
+        distance_df[DISTANCE_DEST_TYPE] != DISTANCE_DEST_TYPE_POLLING,
+        1,
+        inplace=True,
+    )
+
+
+def get_linearization_points(alpha: float, beta: float, site_penalty: float, num_penalized_sites: int) -> list:
+    ''' The points at which the exponential of the site penalty is linearized '''
+    return [
+        -alpha * beta * i * site_penalty
+        for i in range(num_penalized_sites + 1)
+    ]
+
+
+@timer
+def build_pair_adjacency(config: PollingModelConfig, distance_df: pd.DataFrame) -> PairAdjacency:
+    ''' The residence, precinct pairs that the model built from distance_df can match '''
+    return PairAdjacency.from_distance_df(distance_df, get_max_min(config, distance_df))
+
+
+def get_pair_adjacency(distance_df: pd.DataFrame, max_min: float, adjacency: PairAdjacency=None) -> PairAdjacency:
+    ''' Checks that adjacency was built for max_min, building it from distance_df if not given '''
+    if adjacency is None:
+        return PairAdjacency.from_distance_df(distance_df, max_min)
+    if adjacency.max_min != max_min:
+        raise ValueError(f'The adjacency was built for max_min {adjacency.max_min}, not {max_min}')
+
+    return adjacency
+
+
 @timer
 def polling_model_factory(
     distance_df,
@@ -292,36 +398,34 @@ def polling_model_factory(
     config: PollingModelConfig, *,
     exclude_penalized_sites: bool=False,
     site_penalty: float=0,
-    kp_penalty_parameter: float=0
+    kp_penalty_parameter: float=0,
+    adjacency: PairAdjacency=None,
 ) -> PollingModel:
     '''
         Returns the polling location pyomo model.
+
+        adjacency can be given to reuse the PairAdjacency of distance_df from build_pair_adjacency,
+        otherwise it is built here.
     '''
 
     if site_penalty and not kp_penalty_parameter:
         raise ValueError(f'kp_penalty_parameter must be positive if site_penalty is positive ({site_penalty=}')
 
     #define max_min parameter needed for certain calculations
-    global_max_min_dist = get_max_min_dist(distance_df)
-    max_min = config.max_min_mult * global_max_min_dist
+    max_min = get_max_min(config, distance_df)
+
+    #the pairs within max_min
+    adjacency = get_pair_adjacency(distance_df, max_min, adjacency)
 
     #Calculate number of old polling locations
-    old_polls = len(set(distance_df[distance_df[DISTANCE_DEST_TYPE] == DISTANCE_DEST_TYPE_POLLING][DISTANCE_ID_DEST]))
+    old_polls = get_old_polls(distance_df)
 
     #Calculate precincts open value from data if not provided by user
-    if config.precincts_open is None:
-        precincts_open = old_polls
-    else:
-        precincts_open = config.precincts_open
-    #The number of precincts to open might need to be reduced when
-    #excluding penalized sites (penalty Model 2) to avoid infeasible model
-    if exclude_penalized_sites:
-        num_dests = len(set(distance_df[DISTANCE_ID_DEST]) - set(config.penalized_sites))
-        precincts_open = min(precincts_open, num_dests)
+    precincts_open = get_precincts_open(config, distance_df, old_polls, exclude_penalized_sites)
 
     ####define constants####
     #total population
-    total_pop = distance_df.groupby(DISTANCE_ID_ORIG)[DISTANCE_TOTAL_POPULATION].agg(PD_UNIQUE).str[0].sum()
+    total_pop = get_total_pop(distance_df)
     ####set model to be concrete####
     model = pyo.ConcreteModel()
 
@@ -330,68 +434,52 @@ def polling_model_factory(
     model.precincts = pyo.Set(initialize = list(set(distance_df[DISTANCE_ID_DEST])))
     #all possible residence locations with population > 0 (unique)
     model.residences = pyo.Set(initialize = list(set(distance_df[DISTANCE_ID_ORIG])))
-    #residence, precint pairs
-    model.pairs = model.residences * model.precincts
     #penalized sites
-    if config.penalized_sites:
-        penalized_sites = list(set(
-            distance_df.loc[
-                distance_df[DISTANCE_LOCATION_TYPE].isin(config.penalized_sites),
-                DISTANCE_ID_DEST,
-            ].unique())
-        )
+    model.penalized_sites = pyo.Set(initialize=get_penalized_sites(config, distance_df))
+
+    #KP factor and new location marker
+    add_pair_columns(config, alpha, distance_df)
+
+    #residence, precint pairs
+    if config.sparse_pairs:
+        #only the pairs that can be matched, i.e. within the max_min radius
+        pair_df = distance_df[distance_df[DISTANCE_DISTANCE_M] <= max_min]
     else:
-        penalized_sites = []
-    model.penalized_sites = pyo.Set(initialize=penalized_sites)
+        pair_df = distance_df
+
+    #the (residence, precinct) keys are built once and shared by all of the pair parameters
+    pair_keys = list(zip(pair_df[DISTANCE_ID_ORIG], pair_df[DISTANCE_ID_DEST]))
+
+    if config.sparse_pairs or len(pair_keys) < len(model.residences) * len(model.precincts):
+        #distance data pruned by build_distance_data has no rows for the pairs far apart, which can't be matched
+        model.pairs = pyo.Set(dimen=2, initialize=pair_keys)
+    else:
+        model.pairs = model.residences * model.precincts
 
     ####define model parameters####
     #Populations of residences
     model.population = pyo.Param(
         model.residences,
-        initialize=distance_df.groupby(DISTANCE_ID_ORIG)[DISTANCE_TOTAL_POPULATION].agg(PD_MEAN),
+        initialize=distance_df.groupby(DISTANCE_ID_ORIG)[DISTANCE_TOTAL_POPULATION].agg(PD_MEAN).to_dict(),
     )
     #Precinct residence distances
-
     model.distance = pyo.Param(
-        model.pairs, initialize=distance_df[
-            [DISTANCE_ID_ORIG, DISTANCE_ID_DEST, DISTANCE_DISTANCE_M]
-        ].set_index([DISTANCE_ID_ORIG, DISTANCE_ID_DEST]),
+        model.pairs, initialize=dict(zip(pair_keys, pair_df[DISTANCE_DISTANCE_M].tolist())),
     )
     #population weighted distances
     model.weighted_dist = pyo.Param(
-        model.pairs, initialize=distance_df[
-            [DISTANCE_ID_ORIG, DISTANCE_ID_DEST, DISTANCE_WEIGHTED_DIST]
-        ].set_index([DISTANCE_ID_ORIG, DISTANCE_ID_DEST]),
+        model.pairs, initialize=dict(zip(pair_keys, pair_df[DISTANCE_WEIGHTED_DIST].tolist())),
     )
-
     #KP factor
-    distance_df[RESULT_KP_FACTOR] = compute_kp_factor(config, alpha, distance_df)
-    # math.e**(-config.beta*alpha*dist_df[DISTANCE_M])
-    max_kp_factor = distance_df.groupby(DISTANCE_ID_ORIG)[RESULT_KP_FACTOR].agg(PD_MAX).max()
-    if max_kp_factor > MAX_KP_FACTOR:
-        # pylint: disable-next=line-too-long
-        warnings.warn(f'Max kp_factor is {max_kp_factor}. SCIP can only handle values up to {MAX_KP_FACTOR+1}. Consider a less negative value of beta.')
-
     model.kp_factor = pyo.Param(
-        model.pairs,
-        initialize = distance_df[
-            [DISTANCE_ID_ORIG, DISTANCE_ID_DEST, RESULT_KP_FACTOR]
-        ].set_index([DISTANCE_ID_ORIG, DISTANCE_ID_DEST]),
+        model.pairs, initialize=dict(zip(pair_keys, pair_df[RESULT_KP_FACTOR].tolist())),
     )
 
     #new location marker
-    distance_df[RESULT_NEW_LOCATION] = 0
-    distance_df[RESULT_NEW_LOCATION].mask(
-        distance_df[DISTANCE_DEST_TYPE] != DISTANCE_DEST_TYPE_POLLING,
-        1,
-        inplace=True,
-    )
-
+    new_locations_df = distance_df[[DISTANCE_ID_DEST, RESULT_NEW_LOCATION]].drop_duplicates()
     model.new_locations = pyo.Param(
         model.precincts,
-        initialize=distance_df[
-            [DISTANCE_ID_DEST, RESULT_NEW_LOCATION]
-        ].drop_duplicates().set_index([DISTANCE_ID_DEST]),
+        initialize=dict(zip(new_locations_df[DISTANCE_ID_DEST], new_locations_df[RESULT_NEW_LOCATION].tolist())),
     )
 
     ####define model variables####
@@ -406,23 +494,13 @@ def polling_model_factory(
     #residences in precint radius
     model.within_residence_radius = pyo.Set(
         model.residences,
-        initialize={
-            res: [
-                prec for prec in model.precincts
-                if model.distance[(res, prec)] <= max_min
-            ] for res in model.residences
-        },
+        initialize=adjacency.within_residence_radius(),
     )
 
     #precinct in residence radius
     model.within_precinct_radius = pyo.Set(
         model.precincts,
-        initialize={
-            prec: [
-                res for res in model.residences
-                if model.distance[(res, prec)] <= max_min
-            ] for prec in model.precincts
-        },
+        initialize=adjacency.within_precinct_radius(),
     )
 
     # Set the objective function
@@ -440,11 +518,9 @@ def polling_model_factory(
         penalty_rule = build_penalty_rule(alpha, config.beta, site_penalty)
         model.penalty_constraint = pyo.Constraint(rule=penalty_rule)
 
-        num_penalized_sites = len(model.penalized_sites)
-        linearization_points = [
-            -alpha * config.beta * i * site_penalty
-            for i in range(num_penalized_sites + 1)
-        ]
+        linearization_points = get_linearization_points(
+            alpha, config.beta, site_penalty, len(model.penalized_sites),
+        )
         penalty_approximation_rule = build_penalty_approximation_rule()
         model.penalty_approximation_constraint = pyo.Constraint(
             linearization_points, rule=penalty_approximation_rule,
@@ -12,13 +12,19 @@ import math
 
 from .model_config import PollingModelConfig
 
-from .model_factory import PollingModel, polling_model_factory
+from .array_model import ArrayModel, get_model_factory
+from .model_factory import PollingModel
 from .model_results import (
     incorporate_result,
     compute_kp_score,
 )
-from .model_solver import solve_model
+from .model_solver import config_solver_settings, solve_model
+from .persistent_solver import PersistentSolver
 from .run_setup import RunSetup
+from .speculative_model import SpeculativeModel2
+from .warm_start import WarmStart, repair_warm_start, set_warm_start, solution_warm_start
+
+from python.utils.spans import span
 
 from .constants import (
     DISTANCE_LOCATION_TYPE, DISTANCE_ID_DEST, SOLVER_MODEL2, SOLVER_MODEL3, SOLVER_PENALTY, UTF8
@@ -43,12 +49,24 @@ class PenalizeModel:
     _run_setup: RunSetup
     _result_df: pd.DataFrame
 
+    _persistent_solver: PersistentSolver | None
+    _speculative_model2: SpeculativeModel2 | None
+
     log: bool = False
 
-    def __init__(self, run_setup: RunSetup, result_df: pd.DataFrame, log=False):
+    def __init__(
+        self,
+        run_setup: RunSetup,
+        result_df: pd.DataFrame,
+        log=False,
+        persistent_solver: PersistentSolver=None,
+        speculative_model2: SpeculativeModel2=None,
+    ):
         self._run_setup = run_setup
         self._result_df = result_df
         self.log = log
+        self._persistent_solver = persistent_solver
+        self._speculative_model2 = speculative_model2
 
 
     @functools.cached_property
@@ -98,9 +116,22 @@ class PenalizeModel:
 
     @functools.cached_property
     def _ea_model_exclusions_obj_value(self) -> float:
+        if self._speculative_model2 is not None:
+            # Waits for Model 2 to finish solving in its own process
+            with span('model2'):
+                return self._speculative_model2.result().obj_value
+
         return pyo.value(self.ea_model_exclusions.obj)
 
 
+    @functools.cached_property
+    def _ea_model_exclusions_warm_start(self) -> WarmStart:
+        if self._speculative_model2 is not None:
+            return self._speculative_model2.result().warm_start
+
+        return solution_warm_start(self.ea_model_exclusions)
+
+
     @functools.cached_property
     def kp2(self) -> float:
         '''
@@ -121,27 +152,38 @@ class PenalizeModel:
 
 
     @functools.cached_property
-    def ea_model_exclusions(self) -> PollingModel:
+    def ea_model_exclusions(self) -> PollingModel | ArrayModel:
         ''' Optimal solution excluding penalized sites (model 2) '''
-        result = polling_model_factory(
-            distance_df=self._run_setup.dist_df,
-            alpha=self._run_setup.alpha,
-            config=self._run_setup.config,
-            exclude_penalized_sites=True,
-        )
-        if self.log:
-            print(f'Model 2 (excludes penalized sites) built for {self._run_setup.run_prefix}')
-
-        solve_model(
-            model=result,
-            time_limit=self._run_setup.config.time_limit,
-            limits_gap=self._run_setup.config.limits_gap,
-            log=self.log,
-            log_file_path=get_log_path(self._run_setup.config, SOLVER_MODEL2),
-        )
-
-        if self.log:
-            print(f'Model 2 solved for {self._run_setup.run_prefix}.')
+        with span('model2'):
+            with span('model_build'):
+                result = get_model_factory(self._run_setup.config)(
+                    distance_df=self._run_setup.dist_df,
+                    alpha=self._run_setup.alpha,
+                    config=self._run_setup.config,
+                    exclude_penalized_sites=True,
+                    adjacency=self._run_setup.adjacency,
+                )
+            if self.log:
+                print(f'Model 2 (excludes penalized sites) built for {self._run_setup.run_prefix}')
+
+            warm_started = self._set_warm_start(
+                result, [solution_warm_start(self._run_setup.ea_model)], exclude_penalized_sites=True,
+            )
+
+            with span('solve'):
+                solve_model(
+                    model=result,
+                    time_limit=self._run_setup.config.time_limit,
+                    limits_gap=self._run_setup.config.limits_gap,
+                    log=self.log,
+                    log_file_path=get_log_path(self._run_setup.config, SOLVER_MODEL2),
+                    **config_solver_settings(self._run_setup.config),
+                    persistent_solver=self._persistent_solver,
+                    warm_start=warm_started,
+                )
+
+            if self.log:
+                print(f'Model 2 solved for {self._run_setup.run_prefix}.')
 
         return result
 
@@ -162,31 +204,101 @@ class PenalizeModel:
 
 
     @functools.cached_property
-    def ea_model_penalized(self) -> PollingModel:
-        result = polling_model_factory(
-            distance_df=self._run_setup.dist_df,
-            alpha=self._run_setup.alpha,
-            config=self._run_setup.config,
-            exclude_penalized_sites=False,
-            site_penalty=self.penalty,
-            kp_penalty_parameter=self.kp1,
-        )
+    def ea_model_penalized(self) -> PollingModel | ArrayModel:
+        # Model 2 is solved for the penalty first
+        penalty = self.penalty
+
+        with span('model3'):
+            with span('model_build'):
+                result = get_model_factory(self._run_setup.config)(
+                    distance_df=self._run_setup.dist_df,
+                    alpha=self._run_setup.alpha,
+                    config=self._run_setup.config,
+                    exclude_penalized_sites=False,
+                    site_penalty=penalty,
+                    kp_penalty_parameter=self.kp1,
+                    adjacency=self._run_setup.adjacency,
+                )
+
+            if self.log:
+                print(f'Model 3 (penalized model) built for {self._run_setup.run_prefix}.')
+
+            # Model 1 and Model 2 both solve Model 3, start from whichever it scores better
+            warm_started = self._set_warm_start(
+                result,
+                [solution_warm_start(self._run_setup.ea_model), self._ea_model_exclusions_warm_start],
+                site_penalty=penalty,
+            )
+
+            with span('solve'):
+                solve_model(
+                    model=result,
+                    time_limit=self._run_setup.config.time_limit,
+                    limits_gap=self._run_setup.config.limits_gap,
+                    log=self.log,
+                    log_file_path=get_log_path(self._run_setup.config, SOLVER_MODEL3),
+                    **config_solver_settings(self._run_setup.config),
+                    persistent_solver=self._persistent_solver,
+                    warm_start=warm_started,
+                )
+
+            if self.log:
+                print(f'Model 3 solved for {self._run_setup.run_prefix}.')
 
-        if self.log:
-            print(f'Model 3 (penalized model) built for {self._run_setup.run_prefix}.')
-
-        solve_model(
-            model=result,
-            time_limit=self._run_setup.config.time_limit,
-            limits_gap=self._run_setup.config.limits_gap,
-            log=self.log,
-            log_file_path=get_log_path(self._run_setup.config, SOLVER_MODEL3),
-        )
+        return result
 
+    def _set_warm_start(
+        self,
+        model: PollingModel | ArrayModel,
+        warm_starts: list[WarmStart],
+        *,
+        exclude_penalized_sites: bool=False,
+        site_penalty: float=0,
+    ) -> bool:
+        '''
+        Repairs each of the warm_starts into a solution of the model and sets the one with the best
+        objective on it. Returns False, leaving the model to be solved cold, if warm starts are turned
+        off in the config or none of them could be repaired.
+        '''
+        config = self._run_setup.config
+        if not config.warm_start:
+            return False
+
+        best = None
+        best_objective = None
+        for warm_start in warm_starts:
+            repaired = repair_warm_start(
+                warm_start, self._run_setup.dist_df, config, self._run_setup.adjacency,
+                exclude_penalized_sites=exclude_penalized_sites,
+            )
+            if repaired is None:
+                continue
+
+            set_warm_start(
+                model, repaired, self._run_setup.alpha, config,
+                site_penalty=site_penalty, penalized_sites=self.penalized_sites,
+            )
+            if isinstance(model, ArrayModel):
+                objective = float(model.objective @ model.start) + model.objective_offset
+            else:
+                objective = pyo.value(model.obj)
+
+            if best_objective is None or objective < best_objective:
+                best, best_objective = repaired, objective
+
+        if best_objective is None:
+            if self.log:
+                print(f'No warm start found for {self._run_setup.run_prefix}.')
+            return False
+
+        set_warm_start(
+            model, best, self._run_setup.alpha, config,
+            site_penalty=site_penalty, penalized_sites=self.penalized_sites,
+        )
         if self.log:
-            print(f'Model 3 solved for {self._run_setup.run_prefix}.')
+            print(f'Warm start with objective {best_objective:.4f} set for {self._run_setup.run_prefix}.')
 
-        return result
+        return True
 
     @functools.cached_property
     def _ea_model_penalized_obj_value(self) -> float:
@@ -196,12 +308,15 @@ class PenalizeModel:
     @functools.cached_property
     def penalized_result_df(self) -> pd.DataFrame:
         ''' Optimal solution including penalized sites applying calculate penalty (model 3) '''
+        ea_model_penalized = self.ea_model_penalized
 
-        result = incorporate_result(
-            dist_df=self._run_setup.dist_df,
-            model=self.ea_model_penalized,
-            log_distance=self._run_setup.config.log_distance,
-        )
+        with span('result_extraction'):
+            result = incorporate_result(
+                dist_df=self._run_setup.dist_df,
+                model=ea_model_penalized,
+                log_distance=self._run_setup.config.log_distance,
+                distance_matrix=self._run_setup.distance_matrix,
+            )
 
         return result
 
@@ -282,6 +397,30 @@ class PenalizeModel:
             del self._penalty_log_file
 
 
+    @property
+    def is_model2_solved(self) -> bool:
+        ''' True once Model 2 has been solved, here or by the speculative Model 2 '''
+        return 'ea_model_exclusions' in vars(self) or (
+            self._speculative_model2 is not None and '_ea_model_exclusions_obj_value' in vars(self)
+        )
+
+
+    @property
+    def is_model3_solved(self) -> bool:
+        ''' True once Model 3 has been solved '''
+        return 'ea_model_penalized' in vars(self)
+
+
+    def solved_models(self) -> list[str]:
+        ''' The penalty models solved so far, SOLVER_MODEL2 and SOLVER_MODEL3 '''
+        results = []
+        if self.is_model2_solved:
+            results.append(SOLVER_MODEL2)
+        if self.is_model3_solved:
+            results.append(SOLVER_MODEL3)
+
+        return results
+
     def run(self) -> pd.DataFrame:
         ''' Computes the new results incorporating penalties '''
 
@@ -301,4 +440,7 @@ class PenalizeModel:
             return self.penalized_result_df
 
         finally:
+            if self._speculative_model2 is not None:
+                # Stops Model 2 if it turned out not to be needed
+                self._speculative_model2.cancel()
             self._close_log()
@@ -2,6 +2,7 @@
 Various utility methods to process the output of a model run
 '''
 
+import itertools
 import math
 import os
 import threading
@@ -10,6 +11,7 @@ import numpy as np
 import pandas as pd
 
 import pyomo.environ as pyo
+from scipy.special import logsumexp
 
 from python.database import imports
 from python.database.query import Query
@@ -20,47 +22,130 @@ from python.utils import (
   build_results_file_path,
   build_precinct_summary_file_path,
   build_residence_summary_file_path,
-  build_y_ede_summary_file_path
+  build_y_ede_summary_file_path,
+  build_solver_metrics_file_path,
+  build_solver_trajectory_file_path,
 )
 
 # pylint: disable-next=wildcard-import,unused-wildcard-import
 from .constants import *
 
+from .array_model import ArrayModel
+from .distance_matrix import DistanceMatrix
 from .model_config import PollingModelConfig
+from .scip_log import ScipLogMetrics, model_run_solver_columns, solver_metrics_df, solver_trajectory_df
 
 
 lock = threading.Lock()
 
-@timer
-def incorporate_result(dist_df: pd.DataFrame, model: pyo.ConcreteModel, log_distance: bool):
-    '''Input: dist_df--the main data frame containing the data for model
-              model -- the solved model
-              model.matching -- pyo boolean variable for when a residence is matched to a precinct (res, prec):bool
-    output: dataframe containing only the matched residences and precincts'''
+def matched_pairs(model: pyo.ConcreteModel) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    The id_orig and id_dest of each pair matched in the solution of model, either a pyomo model or an
+    ArrayModel. The matching doesn't always give an integer value, a pair is matched if its value
+    rounds to 1.
+    '''
+    if isinstance(model, ArrayModel):
+        return model.matched_pairs()
+
+    #read all the values at once, a value of None (nan here) is a variable the solver gave no value
+    values = np.array([var.value for var in model.matching.values()], dtype=np.float64)
+    if np.isnan(values).all():
+        raise ValueError('The model has no matched precincts')
+    if np.isnan(values).any():
+        raise ValueError('The model has some unmatched precincts')
 
-    #turn matched solution into df
-    matching_list = [(key[0], key[1], model.matching[key].value) for key in model.matching]
-    matching_df = pd.DataFrame(matching_list, columns = [DISTANCE_ID_ORIG, DISTANCE_ID_DEST, RESULT_MATCHING])
+    #only the keys of the matched pairs are kept
+    keys = list(itertools.compress(model.matching.keys(), values >= 0.5))
 
-    #the matching doesn't always give an integer value. Replace the value with the integer it would round to   
-    matching_df[RESULT_MATCHING].mask(matching_df[RESULT_MATCHING] >= 0.5, 1, inplace=True)
-    matching_df[RESULT_MATCHING].mask(matching_df[RESULT_MATCHING] < 0.5, 0, inplace=True)
+    return (
+        np.array([key[0] for key in keys], dtype=object),
+        np.array([key[1] for key in keys], dtype=object),
+    )
 
-    #merge with dist_df
-    result_df = pd.merge(dist_df, matching_df, on=[DISTANCE_ID_ORIG, DISTANCE_ID_DEST])
 
-    #keep only pairs that have been matched
-    #if no matches, raise error
-    if all(result_df[RESULT_MATCHING].isnull()):
-        raise ValueError('The model has no matched precincts')
-    if any(result_df[RESULT_MATCHING].isnull()):
-        raise ValueError('The model has some unmatched precincts')
-    result_df = result_df.loc[result_df[RESULT_MATCHING] == 1]
+def result_rows_df(
+    dist_df: pd.DataFrame,
+    rows: np.ndarray,
+    log_distance: bool,
+    distance_matrix: DistanceMatrix=None,
+) -> pd.DataFrame:
+    '''
+    The rows of dist_df at the positions of the matched pairs, marked as matched and indexed by their
+    positions, with the distances exponentiated back if they are log distances. If dist_df was built
+    from distance_matrix with only some of its columns (see model_distance_df), the rows are expanded
+    to all of them from distance_matrix.
+    '''
+    result_df = dist_df.iloc[rows].set_axis(pd.Index(rows), axis=0)
+    if distance_matrix is not None:
+        result_df = distance_matrix.expand_pairs(result_df)
+    result_df[RESULT_MATCHING] = 1.0
     if log_distance:
         result_df[DISTANCE_DISTANCE_M] = math.e**result_df[DISTANCE_DISTANCE_M]
 
     return result_df
 
+
+@timer
+def incorporate_result(
+    dist_df: pd.DataFrame,
+    model: pyo.ConcreteModel,
+    log_distance: bool,
+    distance_matrix: DistanceMatrix=None,
+):
+    '''Input: dist_df--the main data frame containing the data for model
+              model -- the solved model, either a pyomo model or an ArrayModel
+              model.matching -- pyo boolean variable for when a residence is matched to a precinct (res, prec):bool
+              distance_matrix -- if given, the DistanceMatrix dist_df was built from, see result_rows_df
+    output: dataframe containing only the matched residences and precincts, indexed by their
+        positions in dist_df'''
+
+    orig_ids, dest_ids = matched_pairs(model)
+    if len(orig_ids) == 0:
+        raise ValueError('The model has no matched precincts')
+
+    #each residence is matched to one precinct, so a row of dist_df is matched if its precinct is the
+    #one its residence is matched to. Find those rows by position instead of merging on the ids.
+    matched_residences = pd.Index(orig_ids)
+    if not matched_residences.is_unique:
+        raise ValueError('The model matches a residence to more than one precinct')
+    residence_positions = matched_residences.get_indexer(dist_df[DISTANCE_ID_ORIG])
+    rows = np.flatnonzero(residence_positions >= 0)
+    rows = rows[dist_df[DISTANCE_ID_DEST].to_numpy()[rows] == dest_ids[residence_positions[rows]]]
+
+    return result_rows_df(dist_df, rows, log_distance, distance_matrix)
+
+DEMOGRAPHIC_GROUPS = sorted([
+    DISTANCE_TOTAL_POPULATION, DISTANCE_WHITE, DISTANCE_BLACK, DISTANCE_NATIVE, DISTANCE_ASIAN, DISTANCE_HISPANIC,
+])
+''' The population columns summarized for each demographic group, in the order of the summaries '''
+
+
+def demographic_sums(result_df: pd.DataFrame, domain: str) -> pd.DataFrame:
+    '''
+    The population and the distance weighted by population of every demographic group summed by
+    domain, indexed by domain and demographic.
+
+    The populations of the groups are the columns of a matrix and the distances a vector, so both sums
+    are taken for all of the groups in one groupby of the rows, rather than over a copy of the rows
+    for each group. The rows of each group are summed in the same order, so the sums are the same.
+    '''
+    population = result_df[DEMOGRAPHIC_GROUPS]
+    weighted_dist = population.mul(result_df[DISTANCE_DISTANCE_M], axis=0)
+
+    sums = pd.concat(
+        {DOMAIN_WEIGHTED_DIST: weighted_dist, RESULT_DEMO_POP: population}, axis=1,
+    ).groupby(result_df[domain]).agg(PD_SUM)
+
+    #one row per domain and group, the groups of each domain in turn
+    return pd.DataFrame(
+        {
+            DOMAIN_WEIGHTED_DIST: sums[DOMAIN_WEIGHTED_DIST].to_numpy().ravel(),
+            RESULT_DEMO_POP: sums[RESULT_DEMO_POP].to_numpy().ravel(),
+        },
+        index=pd.MultiIndex.from_product([sums.index, DEMOGRAPHIC_GROUPS], names=[domain, RESULT_DEMOGRAPHIC]),
+    )
+
+
 @timer
 def demographic_domain_summary(result_df: pd.DataFrame, domain: str):
     '''Input: result_df-- the distance an demographic population data for the matched residences and precincts
@@ -72,32 +157,9 @@ def demographic_domain_summary(result_df: pd.DataFrame, domain: str):
         raise ValueError('domain much be in [id_dest, id_orig]')
     #extract unique source value for later
     source_value = result_df[DISTANCE_SOURCE].unique()
-    #Transform to get distance and population by demographic, destination pairs for each origin
-    demographic_all = pd.melt(
-        result_df[[
-            domain, DISTANCE_DISTANCE_M, DISTANCE_TOTAL_POPULATION, DISTANCE_WHITE, DISTANCE_BLACK, DISTANCE_NATIVE, DISTANCE_ASIAN, DISTANCE_HISPANIC,
-        ]],
-        id_vars=[domain, DISTANCE_DISTANCE_M],
-        value_vars=[DISTANCE_TOTAL_POPULATION, DISTANCE_WHITE, DISTANCE_BLACK, DISTANCE_NATIVE, DISTANCE_ASIAN, DISTANCE_HISPANIC],
-        var_name=RESULT_DEMOGRAPHIC,
-        value_name=RESULT_DEMO_POP,
-    )
 
-    #create a weighted distance column for people of each demographic
-    demographic_all[DOMAIN_WEIGHTED_DIST] = demographic_all[RESULT_DEMO_POP] * demographic_all[DISTANCE_DISTANCE_M]
-
-    #calculate the total population of each demographic sent to each precinct
-    demographic_pop = demographic_all[
-        [domain, RESULT_DEMOGRAPHIC, RESULT_DEMO_POP]
-    ].groupby([domain, RESULT_DEMOGRAPHIC]).agg(PD_SUM)
-
-    #calculate the total distance traveled by each demographic group
-    demographic_dist = demographic_all[
-        [domain, RESULT_DEMOGRAPHIC, DOMAIN_WEIGHTED_DIST]
-    ].groupby([domain, RESULT_DEMOGRAPHIC]).agg(PD_SUM)
-
-    #merge the demographic_pop and demographic_dist
-    demographic_prec = pd.concat([demographic_dist, demographic_pop], axis=1)
+    #the total population and distance traveled by each demographic group in each domain
+    demographic_prec = demographic_sums(result_df, domain)
 
     #calculate the average distance
     demographic_prec[RESULT_AVG_DIST] = demographic_prec[DOMAIN_WEIGHTED_DIST] / demographic_prec[RESULT_DEMO_POP]
@@ -117,41 +179,28 @@ def demographic_summary(demographic_df: pd.DataFrame, result_df: pd.DataFrame, b
     #extract unique source value for later
     source_value = result_df[DISTANCE_SOURCE].unique()
 
-    #calculate the total distance traveled by each demographic group
-    demographic_dist = demographic_df[DOMAIN_WEIGHTED_DIST].groupby(RESULT_DEMOGRAPHIC).agg(PD_SUM)
-
-    #calculate the total population of each demographic sent to each precinct
-    demographic_population = demographic_df[RESULT_DEMO_POP].groupby(RESULT_DEMOGRAPHIC).agg(PD_SUM)
-
-    #merge the datasets
-    result = pd.concat([demographic_dist, demographic_population], axis=1)
+    #calculate the total distance traveled and population of each demographic group
+    result = demographic_df[[DOMAIN_WEIGHTED_DIST, RESULT_DEMO_POP]].groupby(RESULT_DEMOGRAPHIC).agg(PD_SUM)
 
     #for base line comparison, or if config.beta ==0
     result[RESULT_AVG_DIST] = result[DOMAIN_WEIGHTED_DIST] / result[RESULT_DEMO_POP]
 
     if beta !=0:
-        #add the distance_m column back in from dist_df
-        #1) first make demographics a column, not an index
-        demographic_by_res = demographic_df.reset_index([RESULT_DEMOGRAPHIC])
-        #2) set index for results to ID_ORIG
-        distances = result_df[[DISTANCE_ID_ORIG, DISTANCE_DISTANCE_M]].set_index(DISTANCE_ID_ORIG)
-        #3) merge on id_orig (index for both)
-        demographics = demographic_by_res.merge(
-            distances,
-            left_index=True,
-            right_index=True,
-            how=PD_OUTER,
-        )
-
-        #add in a KP factor column
-        demographics[RESULT_KP_FACTOR] = math.e ** (-beta * alpha * demographics[DISTANCE_DISTANCE_M])
-        #calculate the summand for the objective function
-        demographics[RESULT_DEMO_RES_OBJ_SUMMAND] = demographics[RESULT_DEMO_POP] * demographics[RESULT_KP_FACTOR]
+        #the distance of the residence of each row, looked up once per residence and taken by position
+        #instead of merging the rows with the distances
+        residence_ids = demographic_df.index.levels[0]
+        residence_distances = result_df.set_index(DISTANCE_ID_ORIG)[DISTANCE_DISTANCE_M].reindex(residence_ids)
+        distances = residence_distances.to_numpy()[demographic_df.index.codes[0]]
+
+        #the summand of the objective function, the population weighted by its KP factor
+        kp_factor = math.e ** (-beta * alpha * distances)
+        demographics = pd.DataFrame({
+            RESULT_DEMO_RES_OBJ_SUMMAND: demographic_df[RESULT_DEMO_POP].to_numpy() * kp_factor,
+            RESULT_DEMO_POP: demographic_df[RESULT_DEMO_POP].to_numpy(),
+        }, index=demographic_df.index)
 
         #compute the ede for each demographic group
-        demographic_ede = demographics[
-            [RESULT_DEMOGRAPHIC, RESULT_DEMO_RES_OBJ_SUMMAND, RESULT_DEMO_POP]
-        ].groupby(RESULT_DEMOGRAPHIC).agg(PD_SUM)
+        demographic_ede = demographics.groupby(RESULT_DEMOGRAPHIC).agg(PD_SUM)
         demographic_ede[RESULT_AVG_KP_WEIGHT] = (
             demographic_ede.demo_res_obj_summand / demographic_ede.demo_pop
         )
@@ -174,8 +223,14 @@ def write_results_csv(
     demographic_prec: pd.DataFrame,
     demographic_res: pd.DataFrame,
     demographic_ede: pd.DataFrame,
-):
-    '''Write result, demographic_prec, demographic_res and demographic_ede to local CSV file'''
+    solver_metrics: dict[str, ScipLogMetrics]=None,
+) -> list[str]:
+    '''
+    Write result, demographic_prec, demographic_res and demographic_ede to local CSV file, and the
+    solver metrics and bound trajectories of each model if there are any. Each file is written under a
+    temporary name and then renamed, so no file is ever left half written. Returns the paths of the
+    files written.
+    '''
 
     # Create result_path as needed
     if not os.path.exists(result_folder):
@@ -186,10 +241,24 @@ def write_results_csv(
     residence_summary_file = build_residence_summary_file_path(result_folder, file_prefix)
     y_ede_summary_file = build_y_ede_summary_file_path(result_folder, file_prefix)
 
-    result_df.to_csv(result_file, index=True)
-    demographic_prec.to_csv(precinct_summary_file, index=True)
-    demographic_res.to_csv(residence_summary_file, index=True)
-    demographic_ede.to_csv(y_ede_summary_file, index=True)
+    outputs = [
+        (result_df, result_file),
+        (demographic_prec, precinct_summary_file),
+        (demographic_res, residence_summary_file),
+        (demographic_ede, y_ede_summary_file),
+    ]
+    if solver_metrics:
+        outputs += [
+            (solver_metrics_df(solver_metrics), build_solver_metrics_file_path(result_folder, file_prefix)),
+            (solver_trajectory_df(solver_metrics), build_solver_trajectory_file_path(result_folder, file_prefix)),
+        ]
+
+    for df, path in outputs:
+        tmp_path = f'{path}.tmp'
+        df.to_csv(tmp_path, index=True)
+        os.replace(tmp_path, path)
+
+    return [path for _, path in outputs]
 
 
 @timer
@@ -202,8 +271,13 @@ def write_results_bigquery(
     demographic_res: pd.DataFrame,
     demographic_ede: pd.DataFrame,
     log: bool=False,
-):
-    '''Write result, demographic_prec, demographic_res and demographic_ede to BigQuery SQL tables'''
+    solver_metrics: dict[str, ScipLogMetrics]=None,
+) -> str | None:
+    '''
+    Write result, demographic_prec, demographic_res and demographic_ede to BigQuery SQL tables, with
+    the solver metrics of each model, if there are any, on the model run. Returns the id of the model
+    run written, or None if any of the tables failed to be written.
+    '''
 
     environment = config.environment
 
@@ -240,6 +314,7 @@ def write_results_bigquery(
             username='',
             commit_hash='',
             created_at=current_time_utc(),
+            solver_metrics=model_run_solver_columns(solver_metrics),
         )
 
         # Import each DF for this run
@@ -283,13 +358,49 @@ def write_results_bigquery(
 
         if not success:
             print(f'\nERROR: results for config set {config_set}, config {config_name} failed to write to db.')
+            return None
+
+        return model_run.id
+
+
+def _compute_kp_alpha(populations: np.ndarray, distances: np.ndarray) -> float:
+    return float((populations @ distances) / (populations @ (distances * distances)))
+
+
+def compute_kp_scores(
+    populations: np.ndarray,
+    distances: np.ndarray,
+    betas: np.ndarray | float,
+    alpha: float,
+) -> np.ndarray:
+    '''
+    The KP scores of many assignments of the same residences, for many values of beta, in one call.
+
+    populations -- the population of each matched row
+    distances -- the distance traveled from each row, a vector for one assignment or a matrix with a
+        row of distances for each assignment
+    betas -- a value of beta, or a vector of them
+    alpha -- the data derived normalization factor
+
+    Returns the scores with the shape of betas followed by one score per assignment. For beta 0 the
+    score is the population weighted average distance. Otherwise the weighted sum of exponentials is
+    taken as a log-sum-exp, so very negative kappa * distance does not overflow.
+    '''
+    populations = np.asarray(populations, dtype=np.float64)
+    distances = np.asarray(distances, dtype=np.float64)
+    betas = np.asarray(betas, dtype=np.float64)
 
+    # kappa broadcast over the assignments and rows
+    kappa = alpha * betas.reshape(betas.shape + (1,) * distances.ndim)
+    total_population = populations.sum(axis=-1)
 
-def _compute_kp_alpha(df: pd.DataFrame):
-    num = sum(x * y for x, y in zip(df[DISTANCE_TOTAL_POPULATION], df[DISTANCE_DISTANCE_M]))
-    den = sum(x * y * y for x, y in zip(df[DISTANCE_TOTAL_POPULATION], df[DISTANCE_DISTANCE_M]))
+    average_distance = (distances @ populations) / total_population
+    # beta 0 rows are replaced by the average below, give them any non zero kappa meanwhile
+    safe_kappa = np.where(kappa == 0, 1.0, kappa)
+    log_mean = logsumexp(-safe_kappa * distances, axis=-1, b=populations) - np.log(total_population)
+    scores = -log_mean / safe_kappa[..., 0]
 
-    return num / den
+    return np.where(kappa[..., 0] == 0, average_distance, scores)
 
 
 def compute_kp_score(
@@ -299,15 +410,12 @@ def compute_kp_score(
     population_column_name: str=DISTANCE_TOTAL_POPULATION,
     distance_column_name: str=DISTANCE_DISTANCE_M
 ):
-    distance_df = df[[population_column_name, distance_column_name]].copy()
-    distance_df.columns = [DISTANCE_TOTAL_POPULATION, DISTANCE_DISTANCE_M]
+    populations = df[population_column_name].to_numpy(dtype=np.float64)
+    distances = df[distance_column_name].to_numpy(dtype=np.float64)
 
     if beta == 0:
-        return (df.population*df.distance_m).sum() / df.population.sum()
+        return float(populations @ distances / populations.sum())
 
-    alpha = _compute_kp_alpha(distance_df) if not alpha else alpha
-    kappa = alpha * beta
-    funky_sum = sum(x * math.exp(-kappa*y) for x, y in zip(df[DISTANCE_TOTAL_POPULATION], df[DISTANCE_DISTANCE_M]))
-    tot_pop = distance_df.population.sum()
+    alpha = _compute_kp_alpha(populations, distances) if not alpha else alpha
 
-    return -math.log(funky_sum / tot_pop) / kappa
+    return float(compute_kp_scores(populations, distances, beta, alpha))
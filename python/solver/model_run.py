@@ -2,31 +2,51 @@
 This file sets up a pyomo/scip run based on a config instance
 '''
 
+import contextlib
+import gc
+import multiprocessing
 import os
 import warnings
 import functools
+from dataclasses import dataclass, field
+from typing import Iterator
 
 import pandas as pd
 
-from .model_solver import solve_model
+from .model_solver import config_persistent_solver, config_solver_settings, solve_model
+from .persistent_solver import PersistentSolver
+from .run_manifest import run_hash
+from .scip_log import ScipLogMetrics, read_scip_log
+from .speculative_model import SpeculativeModel2
+from .warm_start import WarmStart, repair_warm_start, set_warm_start
 
 from python.database.query import Query
-from python.utils import build_distance_file_path
+from python.utils import build_distance_file_path, DISTANCE_FILE_FORMAT_PARQUET
 from python.utils.directory_constants import RESULTS_BASE_DIR
+from python.utils.spans import span
 
-from .constants import DISTANCE_ID_DEST, DISTANCE_ID_ORIG, DATA_SOURCE_CSV
+from .constants import (
+    DISTANCE_ID_DEST, DISTANCE_ID_ORIG, DATA_SOURCE_CSV, SOLVER_BACKEND_SCIP, SOLVER_MODEL1, SOLVER_MODEL2,
+)
 
 from .run_setup import RunSetup
 
 from .model_config import PollingModelConfig
 from .model_data import (
+    PRELOADED_DISTANCE_DATA,
+    DistanceData,
     alpha_min,
     build_distance_data,
-    filter_distance_data,
+    distance_data_key,
+    distance_matrix_data,
+    filter_distance_matrix,
     get_distance_data,
+    model_distance_df,
+    preload_distance_data,
 )
-from .model_factory import PollingModel, polling_model_factory
-from .model_penalties import PenalizeModel
+from .array_model import ArrayModel, get_model_factory
+from .model_factory import PollingModel, build_pair_adjacency
+from .model_penalties import PenalizeModel, get_log_path
 from .model_results import (
     incorporate_result,
     demographic_domain_summary,
@@ -48,9 +68,26 @@ class ModelRun():
     _config: PollingModelConfig
     _log: bool
 
-    def __init__(self, config: PollingModelConfig, log: bool=False):
+    def __init__(
+        self,
+        config: PollingModelConfig,
+        log: bool=False,
+        run_setup: RunSetup=None,
+        persistent_solver: PersistentSolver=None,
+        warm_start: WarmStart=None,
+    ):
+        '''
+        run_setup and persistent_solver, if given, are used instead of building them from the config,
+        as a ModelSweep does to share them between runs. If warm_start is given, and warm starts are
+        on in the config, Model 1 starts from it, repaired to be feasible for the model.
+        '''
         self._config = config
         self._log = log
+        self._warm_start = warm_start
+        if run_setup is not None:
+            self.run_setup = run_setup
+        if persistent_solver is not None:
+            self._persistent_solver = persistent_solver
 
 
     @functools.cached_property
@@ -60,22 +97,89 @@ class ModelRun():
 
 
     @functools.cached_property
-    def _solved_ea_model(self) -> PollingModel:
+    def _persistent_solver(self) -> PersistentSolver | None:
+        ''' The in-memory solver shared by all the models of this run, None unless the config asks for one '''
+        return config_persistent_solver(self._config, self._log)
+
+
+    @functools.cached_property
+    def _speculative_model2(self) -> SpeculativeModel2 | None:
+        '''
+        Model 2 of the penalty workflow, started in a separate process if the config asks for it to be
+        solved speculatively, otherwise None.
+        '''
+        if not (self._config.speculative_penalty and self._config.penalized_sites):
+            return None
+
+        return SpeculativeModel2.start(
+            dist_df=self.run_setup.dist_df,
+            alpha=self.run_setup.alpha,
+            config=self._config,
+            adjacency=self.run_setup.adjacency,
+            run_prefix=self.run_setup.run_prefix,
+            log_file_path=get_log_path(self._config, SOLVER_MODEL2),
+            log=self._log,
+        )
+
+
+    @functools.cached_property
+    def _solved_ea_model(self) -> PollingModel | ArrayModel:
         '''
         The solved ea_model.
 
         This cached property builds and solves the model, returning the solved PollingModel instance.
         '''
 
-        solve_model(
-            model=self.run_setup.ea_model,
-            time_limit=self._config.time_limit,
-            limits_gap=self._config.limits_gap,
-            log=self._log,
-            log_file_path=self._config.log_file_path,
-        )
+        # Build the model, and start Model 2 so that it solves alongside it, before timing the solve
+        ea_model = self.run_setup.ea_model
+        speculative_model2 = self._speculative_model2
+
+        try:
+            self._solve_ea_model(ea_model)
+        except BaseException:
+            # Model 2 is of no use if Model 1 can not be solved, stop it rather than leave it running.
+            # It is started again if the model is solved again.
+            if speculative_model2 is not None:
+                speculative_model2.cancel()
+                del self._speculative_model2
+            raise
+
+        return ea_model
+
 
-        return self.run_setup.ea_model
+    @property
+    def is_solved(self) -> bool:
+        ''' True once the model of this run has been solved (see result_df) '''
+        return '_solved_ea_model' in vars(self)
+
+
+    def _solve_ea_model(self, ea_model: PollingModel | ArrayModel):
+        ''' Solves ea_model, warm started if the config asks for it and there is a warm start '''
+        warm_started = False
+        if self._warm_start is not None and self._config.warm_start:
+            with span('warm_start'):
+                repaired = repair_warm_start(
+                    self._warm_start, self.run_setup.dist_df, self._config, self.run_setup.adjacency,
+                )
+            if repaired is not None:
+                set_warm_start(ea_model, repaired, self.run_setup.alpha, self._config)
+                warm_started = True
+                if self._log:
+                    print(f'Warm start from the previous sweep point set for {self.run_setup.run_prefix}.')
+            elif self._log:
+                print(f'No warm start found for {self.run_setup.run_prefix}.')
+
+        with span('solve'):
+            solve_model(
+                model=ea_model,
+                time_limit=self._config.time_limit,
+                limits_gap=self._config.limits_gap,
+                log=self._log,
+                log_file_path=self._config.log_file_path,
+                **config_solver_settings(self._config),
+                persistent_solver=self._persistent_solver,
+                warm_start=warm_started,
+            )
 
 
     @functools.cached_property
@@ -84,12 +188,15 @@ class ModelRun():
         The raw result DataFrame from the solved model containing only the matched residences
         and precinct, before penalties are applied.
         '''
+        solved_ea_model = self._solved_ea_model
 
-        return incorporate_result(
-            dist_df=self.run_setup.dist_df,
-            model=self._solved_ea_model,
-            log_distance=self._config.log_distance,
-        )
+        with span('result_extraction'):
+            return incorporate_result(
+                dist_df=self.run_setup.dist_df,
+                model=solved_ea_model,
+                log_distance=self._config.log_distance,
+                distance_matrix=self.run_setup.distance_matrix,
+            )
 
     @functools.cached_property
     def _penalize_model(self) -> PenalizeModel:
@@ -97,13 +204,42 @@ class ModelRun():
             run_setup=self.run_setup,
             result_df=self._initial_result_df,
             log=self._log,
+            persistent_solver=self._persistent_solver,
+            speculative_model2=self._speculative_model2,
         )
         return penalize
 
     @functools.cached_property
     def result_df(self) -> pd.DataFrame:
         ''' The final result DataFrame from the solved model after penalties are applied. '''
-        return self._penalize_model.run()
+        penalize_model = self._penalize_model
+
+        with span('penalty'):
+            return penalize_model.run()
+
+    @functools.cached_property
+    def solver_metrics(self) -> dict[str, ScipLogMetrics]:
+        '''
+        The metrics read from the scip log of each model solved for this run, by model. Empty unless
+        the run is solved with scip and logs to files.
+        '''
+        if self._config.solver != SOLVER_BACKEND_SCIP or not self._config.log_file_path:
+            return {}
+
+        # Solve all the models first
+        _ = self.result_df
+
+        log_paths = {SOLVER_MODEL1: self._config.log_file_path}
+        for model in self._penalize_model.solved_models():
+            log_paths[model] = get_log_path(self._config, model)
+
+        results = {}
+        for model, log_path in log_paths.items():
+            metrics = read_scip_log(log_path)
+            if metrics is not None:
+                results[model] = metrics
+
+        return results
 
     @functools.cached_property
     def _alpha_new(self) -> float:
@@ -134,6 +270,73 @@ class ModelRun():
         )
 
 
+    @functools.cached_property
+    def distance_data(self) -> DistanceData:
+        '''
+        The distance data of the config's location as a DistanceMatrix (see distance_matrix_data),
+        built first if the config uses local files that do not exist yet.
+        '''
+        distance_data = self.load_distance_data()
+
+        with span('distance_matrix'):
+            return distance_matrix_data(distance_data)
+
+
+    def load_distance_data(self, columns: list[str]=None) -> DistanceData:
+        '''
+        Loads the distance data of the config's location as distance_data does. If columns is given
+        only those columns are loaded. Not cached, see distance_data.
+        '''
+        with span('data_load'):
+            source_path = build_distance_file_path(
+                self._config.census_year,
+                self._config.location,
+                self._config.driving,
+                self._config.log_distance,
+            )
+
+            # Default to query being None to avoid unnecessary opening database connections
+            query: Query=None
+
+            # If we are using local files, build the source data if it doesn't already exist
+            if self._config.data_source == DATA_SOURCE_CSV:
+                # Check if the local source file or its parquet cache exists for the call get_distance_data below,
+                # if neither does then build it
+                cache_path = build_distance_file_path(
+                    self._config.census_year,
+                    self._config.location,
+                    self._config.driving,
+                    self._config.log_distance,
+                    file_format=DISTANCE_FILE_FORMAT_PARQUET,
+                )
+                if not os.path.exists(source_path) and not os.path.exists(cache_path):
+                    warnings.warn(f'File {source_path} not found. Creating it.')
+                    build_distance_data(
+                        data_source=DATA_SOURCE_CSV,
+                        census_year=self._config.census_year,
+                        location=self._config.location,
+                        driving=self._config.driving,
+                        log_distance=self._config.log_distance,
+                        map_source_date=self._config.map_source_date,
+                        log=self._log,
+                    )
+            else:
+                # Force evaluates _query to create a Query instance in order to get the polling locations
+                # from the database
+                query = self._query
+
+            return get_distance_data(
+                data_source=self._config.data_source,
+                census_year=self._config.census_year,
+                location=self._config.location,
+                log_distance=self._config.log_distance,
+                driving=self._config.driving,
+                query=query,
+                log=self._log,
+                columns=columns,
+            )
+
+
     @functools.cached_property
     def run_setup(self) -> RunSetup:
         '''
@@ -143,97 +346,206 @@ class ModelRun():
 
         run_prefix = f'{self._config.config_set}/{self._config.config_name}'
 
-        source_path = build_distance_file_path(
-            self._config.census_year,
-            self._config.location,
-            self._config.driving,
-            self._config.log_distance,
-        )
-
-        # Default to query being None to avoid unnecessary opening database connections
-        query: Query=None
-
-        # If we are using local files, build the source data if it doesn't already exist
-        if self._config.data_source == DATA_SOURCE_CSV:
-            # Check if the local source file exists for the call get_distance_data below, if it doesn't then build it
-            if not os.path.exists(source_path):
-                warnings.warn(f'File {source_path} not found. Creating it.')
-                build_distance_data(
-                    data_source=DATA_SOURCE_CSV,
-                    census_year=self._config.census_year,
-                    location=self._config.location,
-                    driving=self._config.driving,
-                    log_distance=self._config.log_distance,
-                    map_source_date=self._config.map_source_date,
-                    log=self._log,
-                )
-        else:
-            # Force evaluates _query to create a Query instance in order to get the polling locations from the database
-            query = self._query
-
-        distance_data = get_distance_data(
-            data_source=self._config.data_source,
-            census_year=self._config.census_year,
-            location=self._config.location,
-            log_distance=self._config.log_distance,
-            driving=self._config.driving,
-            query=query,
-            log=self._log,
-        )
+        distance_data = self.distance_data
 
         distance_data_set_id = distance_data.distance_data_set_id
-        distance_df = distance_data.distance_df
 
-        # get main data frame
-        dist_df = filter_distance_data(self._config, distance_df, False, self._log)
+        with span('filter'):
+            # get main data, and its long form with only the columns the models use
+            distance_matrix = filter_distance_matrix(self._config, distance_data.distance_matrix, False, self._log)
+            dist_df = model_distance_df(distance_matrix)
 
         # get alpha
-        alpha_df = filter_distance_data(self._config, distance_df, True, self._log)
-        alpha = alpha_min(alpha_df)
+        with span('alpha'):
+            alpha = alpha_min(filter_distance_matrix(self._config, distance_data.distance_matrix, True, self._log))
+
+        # the pairs within the max_min radius, shared by every model built from dist_df
+        with span('adjacency'):
+            adjacency = build_pair_adjacency(self._config, dist_df)
 
         # build model
-        ea_model = polling_model_factory(dist_df, alpha, self._config)
+        with span('model_build'):
+            ea_model = get_model_factory(self._config)(dist_df, alpha, self._config, adjacency=adjacency)
         if self._log:
             print(f'model built for {run_prefix}.')
 
         return RunSetup(
-            distance_df=distance_df,
             distance_data_set_id=distance_data_set_id,
+            distance_matrix=distance_matrix,
             dist_df=dist_df,
             alpha=alpha,
-            alpha_df=alpha_df,
+            adjacency=adjacency,
             ea_model=ea_model,
             run_prefix=run_prefix,
             config=self._config,
         )
 
 
-    def write_results_db(self):
-        ''' Writes the model run results to the database configured in the environment specified in the config. '''
-        write_results_bigquery(
-            config=self._config,
-            query=self._query,
-            distance_data_set_id=self.run_setup.distance_data_set_id,
-            result_df=self.result_df,
-            demographic_prec=self.demographic_prec,
-            demographic_res=self.demographic_res,
-            demographic_ede=self.demographic_ede,
-            log=self._log,
-        )
+    def _summarize(self):
+        ''' Computes the demographic summaries of the results, once the results are computed '''
+        with span('summaries'):
+            _ = self.demographic_prec
+            _ = self.demographic_ede
 
 
-    def write_results_csv(self):
-        ''' Writes the model run results to CSV files in the results directory. '''
+    def write_results_db(self) -> str | None:
+        '''
+        Writes the model run results to the database configured in the environment specified in the config.
+        Returns the id of the model run written, or None if writing failed.
+        '''
+        result_df = self.result_df
+        self._summarize()
+
+        with span('write'):
+            return write_results_bigquery(
+                config=self._config,
+                query=self._query,
+                distance_data_set_id=self.run_setup.distance_data_set_id,
+                result_df=result_df,
+                demographic_prec=self.demographic_prec,
+                demographic_res=self.demographic_res,
+                demographic_ede=self.demographic_ede,
+                log=self._log,
+                solver_metrics=self.solver_metrics,
+            )
+
+
+    def run_hash(self, outtype: str) -> str:
+        ''' The hash that identifies the results of this run written to outtype, see RunManifest '''
+        query = self._query if self._config.data_source != DATA_SOURCE_CSV else None
+        return run_hash(self._config, outtype, query)
+
+
+    def write_results_csv(self) -> list[str]:
+        ''' Writes the model run results to CSV files in the results directory, returning their paths. '''
         result_folder = os.path.join(RESULTS_BASE_DIR, f'{self._config.location}_results')
 
         file_prefix = f'{self._config.config_set}.{self._config.config_name}'
 
-        write_results_csv(
-            result_folder=result_folder,
-            file_prefix=file_prefix,
-            result_df=self.result_df,
-            demographic_prec=self.demographic_prec,
-            demographic_res=self.demographic_res,
-            demographic_ede=self.demographic_ede,
+        result_df = self.result_df
+        self._summarize()
+
+        with span('write'):
+            return write_results_csv(
+                result_folder=result_folder,
+                file_prefix=file_prefix,
+                result_df=result_df,
+                demographic_prec=self.demographic_prec,
+                demographic_res=self.demographic_res,
+                demographic_ede=self.demographic_ede,
+                solver_metrics=self.solver_metrics,
+            )
+
+
+@dataclass
+class SharedData:
+    ''' The distance data shared with the processes of a multiprocessing context '''
+
+    context: multiprocessing.context.BaseContext
+    ''' The multiprocessing context to start the processes in '''
+    memory: int
+    ''' The memory in bytes of the distance data loaded to share with them '''
+    keys: list[tuple] = field(default_factory=list)
+    ''' The keys in PRELOADED_DISTANCE_DATA of the data loaded, released by release_shared_data '''
+
+
+def work_configs(item: PollingModelConfig | list[PollingModelConfig]) -> list[PollingModelConfig]:
+    ''' The configs of an item of work: a config, or the configs of a sweep '''
+    return item if isinstance(item, list) else [item]
+
+
+def location_work_groups(work: list) -> list[list]:
+    '''
+    The items of work (configs or sweeps) grouped by the distance data they run on, in the order
+    each location first appears
+    '''
+    groups: dict[tuple, list] = {}
+    for item in work:
+        config = work_configs(item)[0]
+        key = distance_data_key(config.census_year, config.location, config.log_distance, config.driving)
+        groups.setdefault(key, []).append(item)
+
+    return list(groups.values())
+
+
+def preload_configs_distance_data(configs: list[PollingModelConfig], log: bool=False) -> list[tuple]:
+    '''
+    Loads the distance data of the configs with preload_distance_data, once per location. Returns the
+    keys of the data loaded here, not counting those already preloaded.
+    '''
+    keys = []
+    for config in configs:
+        key = distance_data_key(config.census_year, config.location, config.log_distance, config.driving)
+        if key in PRELOADED_DISTANCE_DATA:
+            continue
+
+        preload_distance_data(
+            ModelRun(config, log).distance_data,
+            census_year=config.census_year,
+            location=config.location,
+            log_distance=config.log_distance,
+            driving=config.driving,
         )
+        keys.append(key)
+
+    return keys
 
+
+def shared_data_mp_context() -> multiprocessing.context.BaseContext:
+    '''
+    The multiprocessing context whose processes share the distance data loaded by load_shared_data:
+    forked processes where the platform has them, otherwise the default context, whose processes each
+    load their own data as before.
+    '''
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+
+    return multiprocessing.get_context()
+
+
+def load_shared_data(configs: list[PollingModelConfig], log: bool=False) -> SharedData:
+    '''
+    Loads the distance data of the configs to share with the processes of shared_data_mp_context,
+    which are forked after it is loaded and so read it copy-on-write instead of each loading a private
+    copy of the same location. The data of several locations can be loaded at once, each until its
+    release_shared_data. Where processes can not be forked nothing is loaded.
+    '''
+    context = shared_data_mp_context()
+    if context.get_start_method() != 'fork':
+        return SharedData(context=context, memory=0)
+
+    keys = preload_configs_distance_data(configs, log)
+    # Keep the garbage collector of the forked processes from writing to, and so copying, the pages
+    # of the loaded data. Reading the strings of object columns still copies the pages holding them.
+    gc.freeze()
+    return SharedData(
+        context=context,
+        memory=sum(PRELOADED_DISTANCE_DATA[key].nbytes for key in keys),
+        keys=keys,
+    )
+
+
+def release_shared_data(shared_data: SharedData):
+    ''' Releases the distance data loaded by load_shared_data, keeping the data of other locations shared '''
+    if not shared_data.keys:
+        return
+
+    gc.unfreeze()
+    for key in shared_data.keys:
+        del PRELOADED_DISTANCE_DATA[key]
+    gc.collect()
+    if PRELOADED_DISTANCE_DATA:
+        gc.freeze()
+
+
+@contextlib.contextmanager
+def shared_data_context(configs: list[PollingModelConfig], log: bool=False) -> Iterator[SharedData]:
+    '''
+    The distance data of the configs loaded by load_shared_data, with the multiprocessing context to
+    run the configs in that shares it. It is released on exit.
+    '''
+    shared_data = load_shared_data(configs, log)
+    try:
+        yield shared_data
+    finally:
+        release_shared_data(shared_data)
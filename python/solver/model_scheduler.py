@@ -0,0 +1,193 @@
+'''
+Runs model runs in separate processes within a memory budget.
+
+A Pool runs a fixed number of runs at a time whatever their size, so a batch either leaves a large
+machine idle on small counties or runs out of memory when several large ones meet. A
+MemoryScheduler instead starts a run when its estimated peak memory (see model_estimate) fits in
+what the runs in progress leave of the budget, up to a maximum number of processes. The largest runs
+that fit start first and smaller ones fill the memory left over. A run larger than the whole budget
+runs on its own.
+
+Every run gets a new process that exits when it finishes, so the memory of a run, including a heap
+fragmented by building and solving its models, is returned before the next one starts.
+
+Runs that share data, such as the distance data of a location, come in JobGroups. A group's data is
+loaded once every run of the groups before it has started and a process is free, so the runs of the
+next location start while the last runs of the one before are finishing, and is released when its
+last run finishes. The data counts against the budget while it is held.
+'''
+
+import multiprocessing
+from dataclasses import dataclass
+from multiprocessing.connection import wait
+from typing import Callable, Iterable, Iterator
+
+
+@dataclass
+class ScheduledJob:
+    ''' A run for the MemoryScheduler '''
+
+    name: str
+    ''' The name of the run in messages '''
+    args: tuple
+    ''' The arguments to call the scheduler's function with '''
+    memory: int
+    ''' The estimated peak memory of the run in bytes '''
+
+
+@dataclass
+class JobGroup:
+    ''' Jobs that share data loaded for them, see MemoryScheduler.run_groups '''
+
+    jobs: list[ScheduledJob]
+    ''' The jobs of the group '''
+    memory: int = 0
+    ''' The memory in bytes of the data loaded for the jobs, held until the last of them finishes '''
+    release: Callable[[], None] = None
+    ''' Releases the data of the group once the last of its jobs has finished '''
+
+
+class MemoryScheduler:
+    ''' Runs jobs in new processes while their estimated memory fits in a budget '''
+
+    def __init__(
+        self,
+        memory_budget: int,
+        max_processes: int,
+        context: multiprocessing.context.BaseContext=None,
+        log: bool=False,
+        reserved_memory: int=0,
+    ):
+        if memory_budget is not None and memory_budget <= 0:
+            raise ValueError(f'The memory budget must be positive, not {memory_budget}')
+        if max_processes < 1:
+            raise ValueError(f'At least one process is needed, not {max_processes}')
+
+        self.memory_budget = memory_budget
+        ''' The memory in bytes that the jobs running at the same time may use together, unlimited if None '''
+        self.max_processes = max_processes
+        ''' The largest number of jobs run at the same time '''
+        self.reserved_memory = reserved_memory
+        ''' The memory in bytes of the budget that is already in use, such as the data shared with the jobs '''
+        self._context = context or multiprocessing.get_context()
+        self._log = log
+
+    def next_job(self, pending: list[ScheduledJob], running_memory: int, num_running: int) -> ScheduledJob | None:
+        '''
+        The job of pending, which is sorted largest first, to start next while num_running jobs using
+        running_memory bytes are in progress: the largest job that fits in what they leave of the
+        budget, a job larger than the whole budget if none are running, otherwise None.
+        '''
+        if not pending or num_running >= self.max_processes:
+            return None
+        for job in pending:
+            if self.memory_budget is None or running_memory + job.memory <= self.memory_budget:
+                return job
+        # A job larger than the whole budget runs on its own
+        if num_running == 0:
+            return pending[0]
+
+        return None
+
+    def run(self, func: Callable, jobs: list[ScheduledJob]) -> Iterator[ScheduledJob]:
+        '''
+        Calls func with the args of each job in a new process, yielding each job as it finishes. The
+        jobs left keep running if one fails. A ValueError naming the failed jobs is raised once all
+        of them have finished.
+        '''
+        return self.run_groups(func, [JobGroup(jobs)])
+
+    def run_groups(self, func: Callable, groups: Iterable[JobGroup]) -> Iterator[ScheduledJob]:
+        '''
+        Runs the jobs of groups as run does, raising for the failed jobs of every group at the end. The
+        next group is taken from groups, which may load its data, once every job of the groups taken so
+        far has started, a process is free and the budget is not used up. Its data is released once its
+        last job has finished, or if the jobs stop.
+        '''
+        groups = iter(groups)
+        pending: list[ScheduledJob] = []
+        running: dict[int, tuple[multiprocessing.process.BaseProcess, ScheduledJob]] = {}
+        running_memory = self.reserved_memory
+        # The groups taken whose data is held and the number of their jobs left to finish, by group id
+        held: dict[int, JobGroup] = {}
+        jobs_left: dict[int, int] = {}
+        job_groups: dict[int, JobGroup] = {}
+        num_jobs = 0
+        failed: list[ScheduledJob] = []
+
+        try:
+            while True:
+                # Start the jobs that fit, taking the next group once those taken so far have all started
+                while True:
+                    job = self.next_job(pending, running_memory, len(running))
+                    if job is not None:
+                        pending.remove(job)
+                        running_memory += self._start(func, job, running, running_memory)
+                        continue
+                    if pending or len(running) >= self.max_processes or (
+                        self.memory_budget is not None and running_memory >= self.memory_budget
+                    ):
+                        break
+                    group = next(groups, None)
+                    if group is None:
+                        break
+                    num_jobs += len(group.jobs)
+                    running_memory += group.memory
+                    held[id(group)] = group
+                    jobs_left[id(group)] = len(group.jobs)
+                    job_groups.update((id(job), group) for job in group.jobs)
+                    pending = sorted(group.jobs, key=lambda job: job.memory, reverse=True)
+                    if not group.jobs:
+                        running_memory -= self._release(held, group)
+
+                if not running:
+                    break
+
+                for sentinel in wait(list(running)):
+                    process, job = running.pop(sentinel)
+                    process.join()
+                    running_memory -= job.memory
+                    if process.exitcode != 0:
+                        print(f'{job.name} failed with exit code {process.exitcode}')
+                        failed.append(job)
+                    process.close()
+
+                    group = job_groups.pop(id(job))
+                    jobs_left[id(group)] -= 1
+                    if jobs_left[id(group)] == 0:
+                        running_memory -= self._release(held, group)
+                    yield job
+        finally:
+            for group in list(held.values()):
+                self._release(held, group)
+
+        if failed:
+            raise ValueError(f'{len(failed)} of {num_jobs} runs failed: {", ".join(job.name for job in failed)}')
+
+    def _start(
+        self,
+        func: Callable,
+        job: ScheduledJob,
+        running: dict[int, tuple[multiprocessing.process.BaseProcess, ScheduledJob]],
+        running_memory: int,
+    ) -> int:
+        # Starts a job in a new process, returning its memory
+        process = self._context.Process(target=func, args=job.args, name=job.name)
+        process.start()
+        running[process.sentinel] = (process, job)
+        if self._log:
+            budget = 'unlimited' if self.memory_budget is None else f'{self.memory_budget / 1024**3:.1f}'
+            print(
+                f'Started {job.name} (estimated {job.memory / 1024**3:.1f} GB, '
+                f'{(running_memory + job.memory) / 1024**3:.1f} of {budget} GB in use)'
+            )
+
+        return job.memory
+
+    @staticmethod
+    def _release(held: dict[int, JobGroup], group: JobGroup) -> int:
+        # Releases the data of a held group, returning its memory
+        del held[id(group)]
+        if group.release is not None:
+            group.release()
+        return group.memory
@@ -7,21 +7,103 @@
 
 ''' Functions to solve models '''
 
-import pyomo.environ as pyo
+import os
+import tempfile
+
+from .array_model import ArrayModel, MPS_FILE_NAME
+from .constants import SOLVER_BACKEND_SCIP
+from .model_config import PollingModelConfig
+from .persistent_solver import PersistentSolver, get_persistent_solver
+from .solver_backends import SolverBackend, get_solver_backend
+
+from python.utils.spans import span
 
 DEFAULT_LIMITS_GAP = 0.02
 
-SOLVER_NAME = 'scip'
-LP_THREADS = 1
+SOLVER_NAME = SOLVER_BACKEND_SCIP
+''' The default solver backend '''
+
+def solve_model(
+    model,
+    time_limit: int,
+    limits_gap: float,
+    log: bool=False,
+    log_file_path=None,
+    *,
+    solver: str=SOLVER_NAME,
+    threads: int=None,
+    presolve: bool=None,
+    emphasis: str=None,
+    persistent_solver: PersistentSolver=None,
+    warm_start: bool=False,
+):
+    '''
+    This funciton will execute the solver, scip unless another solver backend is given. ArrayModels
+    are solved directly by backends that can, such as the heuristic, otherwise by the
+    persistent_solver if one is given, otherwise through an MPS file. With
+    warm_start the solver starts from the solution set on the model by set_warm_start.
+    '''
+    backend = get_solver_backend(solver)
+    options = backend.options(time_limit, limits_gap, threads, presolve, emphasis)
+
+    if isinstance(model, ArrayModel) and backend.solves_arrays:
+        return backend.solve_array(model, options, log, log_file_path, warm_start)
+
+    if isinstance(model, ArrayModel) and persistent_solver is not None:
+        return persistent_solver.solve(model, options, log_file_path, warm_start)
+
+    if isinstance(model, ArrayModel):
+        return solve_array_model(model, backend, options, log, log_file_path, warm_start)
+
+    return backend.solve(model, options, log, log_file_path, warm_start)
+
+
+def solve_array_model(
+    model: ArrayModel,
+    backend: SolverBackend,
+    options: dict,
+    log: bool=False,
+    log_file_path=None,
+    warm_start: bool=False,
+):
+    '''
+    Writes the model to an MPS file, solves it with the backend and sets the solution on the model.
+    With warm_start the solver starts from the start of the model, if it has one.
+    '''
+    start = model.start_by_name() if warm_start and model.start is not None else None
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        mps_path = os.path.join(tmp_dir, MPS_FILE_NAME)
+        model.write_mps(mps_path)
+
+        with span('solve_mps'):
+            status, names, values = backend.solve_mps(mps_path, options, log, log_file_path, start)
+
+    if not names:
+        raise ValueError(f'{backend.name} found no solution for the model (status {status})')
+
+    model.set_solution_from_names(names, values)
+
+    return status
 
-def solve_model(model, time_limit: int, limits_gap: float, log: bool=False, log_file_path=None):
-    ''' This funciton will execute scip '''
-    #define solver
 
-    solver = pyo.SolverFactory(SOLVER_NAME)
-    solver.options ={ 'limits/time': time_limit, 'limits/gap': limits_gap, 'lp/threads': LP_THREADS }
+def config_solver_settings(config: PollingModelConfig) -> dict:
+    ''' The solver settings of the config, as keyword arguments for solve_model '''
+    return {
+        'solver': config.solver,
+        'threads': config.solver_threads,
+        'presolve': config.solver_presolve,
+        'emphasis': config.solver_emphasis,
+    }
 
-    results = solver.solve(model, tee=log, logfile=log_file_path)
 
-    return results
+def config_persistent_solver(config: PollingModelConfig, log: bool=False) -> PersistentSolver | None:
+    '''
+    A new persistent solver for the solver of the config if it asks for an in-memory solver,
+    otherwise None, as for solvers that solve ArrayModels directly. Share it between the solves of a
+    run so it can keep the model loaded.
+    '''
+    if not config.solver_in_memory or get_solver_backend(config.solver).solves_arrays:
+        return None
 
+    return get_persistent_solver(config.solver, log)
@@ -0,0 +1,189 @@
+'''
+Runs sets of configs that only differ in their model parameters from data loaded once.
+
+auto_generate_config makes config sets that vary one field, such as precincts_open, capacity, beta
+or max_min_mult, over the same location and data. Run one at a time, every config of such a set loads
+and filters the same distance data, computes the same alpha and builds the same pair adjacency before
+building its model. A ModelSweep groups the configs that share their data, does that work once per
+group and builds only the model for each config, reusing the adjacency while max_min_mult does not
+change.
+
+The configs of a group run in order of the fields that vary between them, each one starting the
+solver from the solution of its neighbor, repaired to be feasible for it.
+
+By default a sweep runs its configs as ArrayModels solved in memory (array_model and
+solver_in_memory) whenever their solver has an in-memory mode, as scip and highs do. The runs of a
+group then share one solver, which updates the loaded model in place instead of loading it again
+when a config only changes its right hand sides or objective, as precincts_open, capacity,
+maxpctnew, minpctold and beta do. Building the arrays of a model is cheap next to building the pyomo
+model, which is otherwise built again through the model factory for every config.
+'''
+
+import dataclasses
+from typing import Iterator
+
+from .array_model import get_model_factory
+from .model_config import PollingModelConfig
+from .model_factory import build_pair_adjacency, get_max_min
+from .model_run import ModelRun
+from .model_solver import config_persistent_solver
+from .persistent_solver import PERSISTENT_SOLVERS
+from .run_setup import RunSetup
+from .warm_start import solution_warm_start
+
+from python.utils.spans import span
+
+SWEEP_DATA_FIELDS = [
+    'data_source', 'census_year', 'location', 'driving', 'log_distance', 'map_source_date', 'year',
+    'bad_types', 'environment',
+]
+''' The PollingModelConfig fields that the data of a model run depends on '''
+
+SWEEP_MODEL_FIELDS = [
+    'max_min_mult', 'precincts_open', 'maxpctnew', 'minpctold', 'capacity', 'fixed_capacity_site_number',
+    'beta', 'penalized_sites',
+]
+''' The PollingModelConfig fields that a sweep is ordered by, configs that share a max_min_mult first '''
+
+
+def sweep_data_key(config: PollingModelConfig) -> tuple:
+    ''' The configs with the same key can share the data of a model run '''
+    key = []
+    for field in SWEEP_DATA_FIELDS:
+        value = getattr(config, field)
+        if isinstance(value, list):
+            value = tuple(value)
+        elif field == 'environment':
+            value = repr(value)
+        key.append(value)
+
+    return tuple(key)
+
+
+def _sweep_order_key(config: PollingModelConfig) -> tuple:
+    # None sorts before any value, lists by their contents
+    return tuple(
+        (value is not None, tuple(value) if isinstance(value, list) else value or 0)
+        for value in (getattr(config, field) for field in SWEEP_MODEL_FIELDS)
+    )
+
+
+def group_sweep_configs(configs: list[PollingModelConfig]) -> list[list[PollingModelConfig]]:
+    '''
+    The configs grouped by the data they share, in the order each group is first seen, with the
+    configs of each group ordered by their model fields so that neighbors are next to each other.
+    '''
+    groups: dict[tuple, list[PollingModelConfig]] = {}
+    for config in configs:
+        groups.setdefault(sweep_data_key(config), []).append(config)
+
+    return [sorted(group, key=_sweep_order_key) for group in groups.values()]
+
+
+def in_memory_config(config: PollingModelConfig) -> PollingModelConfig:
+    '''
+    config run as an ArrayModel by an in-memory solver, as sweeps run by default, if its solver has
+    an in-memory mode. Otherwise config itself.
+    '''
+    if config.solver not in PERSISTENT_SOLVERS:
+        return config
+
+    return dataclasses.replace(config, array_model=True, solver_in_memory=True)
+
+
+def sweep_run_setup(run_setup: RunSetup, config: PollingModelConfig, log: bool=False) -> RunSetup:
+    '''
+    The RunSetup of config built from the data of run_setup, the RunSetup of a config with the same
+    data. Only the model is built again, and the adjacency if max_min_mult changed.
+    '''
+    if sweep_data_key(config) != sweep_data_key(run_setup.config):
+        raise ValueError(
+            f'{config.config_set}/{config.config_name} does not share the data of {run_setup.run_prefix}'
+        )
+
+    run_prefix = f'{config.config_set}/{config.config_name}'
+
+    # The model factories add the model's columns to dist_df, which depend on beta
+    dist_df = run_setup.dist_df.copy(deep=False)
+
+    adjacency = run_setup.adjacency
+    if get_max_min(config, dist_df) != adjacency.max_min:
+        with span('adjacency'):
+            adjacency = build_pair_adjacency(config, dist_df)
+
+    with span('model_build'):
+        ea_model = get_model_factory(config)(dist_df, run_setup.alpha, config, adjacency=adjacency)
+    if log:
+        print(f'model built for {run_prefix} from the data of {run_setup.run_prefix}.')
+
+    return dataclasses.replace(
+        run_setup,
+        dist_df=dist_df,
+        adjacency=adjacency,
+        ea_model=ea_model,
+        run_prefix=run_prefix,
+        config=config,
+    )
+
+
+class ModelSweep:
+    '''
+    Runs configs that share their data, such as a config set generated by auto_generate_config, as a
+    sweep. All the configs must share their data, see group_sweep_configs.
+    '''
+
+    def __init__(self, configs: list[PollingModelConfig], log: bool=False, in_memory: bool=True):
+        '''
+        If in_memory, the configs are run as ArrayModels by an in-memory solver where their solver has
+        one (see in_memory_config), otherwise as they are.
+        '''
+        if not configs:
+            raise ValueError('A sweep needs at least one config')
+        if len({sweep_data_key(config) for config in configs}) > 1:
+            raise ValueError('The configs of a sweep must share their data, see group_sweep_configs')
+
+        if in_memory:
+            configs = [in_memory_config(config) for config in configs]
+
+        self._configs = sorted(configs, key=_sweep_order_key)
+        self._log = log
+
+    @property
+    def configs(self) -> list[PollingModelConfig]:
+        ''' The configs of the sweep in the order they run '''
+        return self._configs
+
+    def _shares_solver(self) -> bool:
+        # Only share one solver if every config would have one of the same kind
+        return all(config.solver_in_memory for config in self._configs) and (
+            len({config.solver for config in self._configs}) == 1
+        )
+
+    def model_runs(self) -> Iterator[ModelRun]:
+        '''
+        The ModelRun of each config in turn. Each one is built from the data of the one before, and
+        warm started from its solution if it was solved, so it should be finished with before the next
+        is taken.
+        '''
+        persistent_solver = config_persistent_solver(self._configs[0], self._log) if self._shares_solver() else None
+
+        previous: ModelRun = None
+        for config in self._configs:
+            if previous is None:
+                model_run = ModelRun(config, self._log, persistent_solver=persistent_solver)
+            else:
+                warm_start = None
+                # Only warm start from a neighbor that was solved
+                if previous.is_solved:
+                    warm_start = solution_warm_start(previous.run_setup.ea_model)
+
+                model_run = ModelRun(
+                    config,
+                    self._log,
+                    run_setup=sweep_run_setup(previous.run_setup, config, self._log),
+                    persistent_solver=persistent_solver,
+                    warm_start=warm_start,
+                )
+
+            yield model_run
+            previous = model_run
@@ -0,0 +1,127 @@
+'''
+The residence/precinct pairs within the model's max_min radius, held as a sparse adjacency matrix.
+
+Only pairs within the radius can ever be matched by the model. PairAdjacency computes them once, from
+the distance data in a single vectorized comparison, and then hands out the neighborhoods of every
+residence and precinct, or the list of pairs, for the model factory and any later analysis.
+'''
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+from .constants import DISTANCE_ID_ORIG, DISTANCE_ID_DEST, DISTANCE_DISTANCE_M
+from .distance_matrix import DistanceMatrix
+
+
+class PairAdjacency:
+    '''
+    A residences x precincts boolean CSR matrix marking the pairs within max_min of each other, with
+    the ids of its rows and columns.
+    '''
+
+    matrix: csr_matrix
+    ''' residences x precincts boolean matrix, True for the pairs within max_min '''
+    residence_ids: pd.Index
+    ''' The id_orig of each row of matrix '''
+    precinct_ids: pd.Index
+    ''' The id_dest of each column of matrix '''
+    max_min: float
+    ''' The radius used to build this adjacency '''
+
+    def __init__(self, matrix: csr_matrix, residence_ids: pd.Index, precinct_ids: pd.Index, max_min: float):
+        if matrix.shape != (len(residence_ids), len(precinct_ids)):
+            raise ValueError(
+                # pylint: disable-next=line-too-long
+                f'Adjacency shape {matrix.shape} does not match {len(residence_ids)} residences and {len(precinct_ids)} precincts',
+            )
+
+        self.matrix = matrix
+        self.residence_ids = residence_ids
+        self.precinct_ids = precinct_ids
+        self.max_min = max_min
+
+    @classmethod
+    def from_distance_df(cls, distance_df: pd.DataFrame, max_min: float) -> 'PairAdjacency':
+        ''' Builds the adjacency from long form distance data with one row per (id_orig, id_dest) pair '''
+        residence_codes, residence_ids = pd.factorize(distance_df[DISTANCE_ID_ORIG])
+        precinct_codes, precinct_ids = pd.factorize(distance_df[DISTANCE_ID_DEST])
+
+        within = distance_df[DISTANCE_DISTANCE_M].to_numpy() <= max_min
+
+        return cls._from_positions(
+            residence_codes[within],
+            precinct_codes[within],
+            pd.Index(residence_ids, name=DISTANCE_ID_ORIG),
+            pd.Index(precinct_ids, name=DISTANCE_ID_DEST),
+            max_min,
+        )
+
+    @classmethod
+    def from_distance_matrix(cls, distance_matrix: DistanceMatrix, max_min: float) -> 'PairAdjacency':
+        ''' Builds the adjacency from a DistanceMatrix. Missing distances are never within max_min. '''
+        with np.errstate(invalid='ignore'):
+            residence_positions, precinct_positions = np.nonzero(distance_matrix.distances <= max_min)
+
+        return cls._from_positions(
+            residence_positions,
+            precinct_positions,
+            distance_matrix.origin_ids,
+            distance_matrix.destination_ids,
+            max_min,
+        )
+
+    @classmethod
+    def _from_positions(
+        cls,
+        residence_positions: np.ndarray,
+        precinct_positions: np.ndarray,
+        residence_ids: pd.Index,
+        precinct_ids: pd.Index,
+        max_min: float,
+    ) -> 'PairAdjacency':
+        matrix = csr_matrix(
+            (np.ones(len(residence_positions), dtype=bool), (residence_positions, precinct_positions)),
+            shape=(len(residence_ids), len(precinct_ids)),
+        )
+        # Duplicate pairs are summed, which for booleans leaves a single True
+        matrix.sum_duplicates()
+        matrix.sort_indices()
+
+        return cls(matrix, residence_ids, precinct_ids, max_min)
+
+    @property
+    def num_pairs(self) -> int:
+        ''' The number of pairs within max_min '''
+        return self.matrix.nnz
+
+    def pair_positions(self) -> tuple[np.ndarray, np.ndarray]:
+        ''' The row (residence) and column (precinct) positions of the pairs, ordered by residence '''
+        residence_positions = np.repeat(np.arange(len(self.residence_ids)), np.diff(self.matrix.indptr))
+
+        return residence_positions, self.matrix.indices
+
+    def pairs(self) -> list[tuple]:
+        ''' The (id_orig, id_dest) pairs within max_min, ordered by residence '''
+        residence_positions, precinct_positions = self.pair_positions()
+
+        return list(zip(
+            self.residence_ids.to_numpy()[residence_positions],
+            self.precinct_ids.to_numpy()[precinct_positions],
+        ))
+
+    def within_residence_radius(self) -> dict:
+        ''' The id_dests of the precincts within max_min of each residence, keyed by id_orig '''
+        return self._neighborhoods(self.matrix, self.residence_ids, self.precinct_ids)
+
+    def within_precinct_radius(self) -> dict:
+        ''' The id_origs of the residences within max_min of each precinct, keyed by id_dest '''
+        return self._neighborhoods(self.matrix.tocsc(), self.precinct_ids, self.residence_ids)
+
+    @staticmethod
+    def _neighborhoods(matrix, keys: pd.Index, neighbors: pd.Index) -> dict:
+        # The indices of a compressed matrix are the neighbors of each key stored back to back, split
+        # at the pointers between keys
+        neighbor_lists = np.split(neighbors.to_numpy()[matrix.indices], matrix.indptr[1:-1])
+
+        return {key: neighbor_list.tolist() for key, neighbor_list in zip(keys, neighbor_lists)}
@@ -0,0 +1,250 @@
+'''
+In-process solvers that keep an ArrayModel loaded between solves.
+
+solve_model otherwise hands every model to the solver through a file: an NL file and a scip
+subprocess for pyomo models, or an MPS file for ArrayModels. A PersistentSolver instead passes the
+arrays of the model straight to the solver library in this process and reads the solution back from
+it. HiGHS takes the sparse matrix of the model directly; scip reads it once from a temporary MPS
+file, its fastest way in.
+
+The penalty workflow solves several models built from the same data. When a model only differs from
+the one already loaded in its bounds, constraint right hand sides or objective coefficients (as
+Model 2, which closes the penalized sites, differs from Model 1) only those are updated in the loaded
+model instead of loading it again.
+'''
+
+import os
+import tempfile
+from abc import ABC, abstractmethod
+
+import numpy as np
+import pyscipopt
+
+from .array_model import ArrayModel, SENSE_EQUAL, SENSE_LESS, SENSE_GREATER, MPS_FILE_NAME
+from .constants import SOLVER_BACKEND_SCIP, SOLVER_BACKEND_HIGHS
+from .solver_backends import (
+    add_scip_start, reset_highs_threads, set_highs_options, set_highs_start, set_scip_params,
+)
+
+
+class PersistentSolver(ABC):
+    ''' A solver library that keeps the last ArrayModel it solved loaded '''
+
+    name: str
+    ''' The name of the solver backend '''
+    log: bool
+    ''' Whether the solver prints its log '''
+
+    def __init__(self, log: bool=False):
+        self.log = log
+        self._model: ArrayModel = None
+        self.num_loads = 0
+        ''' The number of times a model was loaded in full rather than updated '''
+        self.num_updates = 0
+        ''' The number of times the loaded model was updated in place '''
+
+    def solve(self, model: ArrayModel, options: dict, log_file_path: str=None, warm_start: bool=False) -> str:
+        '''
+        Solves the model with the given solver options and sets the solution on the model. With
+        warm_start the solver starts from the start of the model, if it has one.
+        '''
+        if self._model is not None and self._model.same_constraints(model):
+            self._update(self._model, model)
+            self.num_updates += 1
+        else:
+            self._load(model)
+            self.num_loads += 1
+        self._model = model
+
+        status, values = self._optimize(options, log_file_path, model.start if warm_start else None)
+        if values is None:
+            raise ValueError(f'{self.name} found no solution for the model (status {status})')
+
+        model.set_solution(values)
+
+        return status
+
+    @abstractmethod
+    def _load(self, model: ArrayModel):
+        ''' Loads model into the solver in full '''
+
+    @abstractmethod
+    def _update(self, loaded: ArrayModel, model: ArrayModel):
+        ''' Updates the loaded model, with the same constraints as model, to model '''
+
+    @abstractmethod
+    def _optimize(self, options: dict, log_file_path: str=None, start: np.ndarray=None) -> tuple[str, np.ndarray]:
+        '''
+        Solves the loaded model with the given options, starting from start if given
+
+        Returns
+        The solver status, and the values of the variables in the best solution, None if there is none
+        '''
+
+
+class HighsPersistentSolver(PersistentSolver):
+    ''' Passes ArrayModels to HiGHS as its own column wise sparse matrix '''
+
+    name = SOLVER_BACKEND_HIGHS
+
+    def __init__(self, log: bool=False):
+        super().__init__(log)
+        # pylint: disable-next=import-outside-toplevel
+        import highspy
+
+        self._highspy = highspy
+        self._highs = highspy.Highs()
+        self._highs.setOptionValue('output_flag', log)
+
+    def _load(self, model: ArrayModel):
+        highspy = self._highspy
+        row_lower, row_upper = model.row_bounds()
+
+        lp = highspy.HighsLp()
+        lp.num_col_ = model.num_variables
+        lp.num_row_ = model.num_constraints
+        lp.col_cost_ = model.objective
+        lp.col_lower_ = np.zeros(model.num_variables)
+        lp.col_upper_ = model.upper_bounds
+        lp.row_lower_ = row_lower
+        lp.row_upper_ = row_upper
+        lp.offset_ = model.objective_offset
+        lp.a_matrix_.format_ = highspy.MatrixFormat.kColwise
+        lp.a_matrix_.start_ = model.constraints.indptr
+        lp.a_matrix_.index_ = model.constraints.indices
+        lp.a_matrix_.value_ = model.constraints.data
+        lp.integrality_ = [
+            highspy.HighsVarType.kInteger if integer else highspy.HighsVarType.kContinuous
+            for integer in model.integer
+        ]
+
+        self._highs.passModel(lp)
+
+    def _update(self, loaded: ArrayModel, model: ArrayModel):
+        objective_changed = np.flatnonzero(loaded.objective != model.objective)
+        if len(objective_changed):
+            self._highs.changeColsCost(
+                len(objective_changed), objective_changed, model.objective[objective_changed],
+            )
+
+        bounds_changed = np.flatnonzero(loaded.upper_bounds != model.upper_bounds)
+        if len(bounds_changed):
+            self._highs.changeColsBounds(
+                len(bounds_changed), bounds_changed, np.zeros(len(bounds_changed)),
+                model.upper_bounds[bounds_changed],
+            )
+
+        rhs_changed = np.flatnonzero(loaded.rhs != model.rhs)
+        if len(rhs_changed):
+            row_lower, row_upper = model.row_bounds()
+            self._highs.changeRowsBounds(
+                len(rhs_changed), rhs_changed, row_lower[rhs_changed], row_upper[rhs_changed],
+            )
+
+        if loaded.objective_offset != model.objective_offset:
+            self._highs.changeObjectiveOffset(model.objective_offset)
+
+    def _optimize(self, options: dict, log_file_path: str=None, start: np.ndarray=None) -> tuple[str, np.ndarray]:
+        reset_highs_threads(options)
+        set_highs_options(self._highs, options, self.log, log_file_path)
+        if start is not None:
+            set_highs_start(self._highs, start.tolist())
+
+        self._highs.run()
+
+        status = self._highs.modelStatusToString(self._highs.getModelStatus())
+        if self._highs.getInfo().primal_solution_status == 0:
+            return status, None
+
+        return status, np.asarray(self._highs.getSolution().col_value)
+
+
+class ScipPersistentSolver(PersistentSolver):
+    '''
+    Keeps ArrayModels loaded in a pyscipopt model. pyscipopt can only build a model one variable and
+    one constraint at a time, which for large models is slower than scip's own MPS reader, so models
+    are loaded through a temporary MPS file. Updates, solves and solutions then stay in memory.
+    '''
+
+    name = SOLVER_BACKEND_SCIP
+
+    def __init__(self, log: bool=False):
+        super().__init__(log)
+        self._scip: pyscipopt.Model = None
+        self._variables = []
+        self._constraints = []
+
+    def _load(self, model: ArrayModel):
+        scip = pyscipopt.Model()
+        if not self.log:
+            scip.hideOutput()
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            mps_path = os.path.join(tmp_dir, MPS_FILE_NAME)
+            model.write_mps(mps_path)
+            scip.readProblem(mps_path)
+
+        # Order the variables and constraints as the columns and rows of the model
+        variables = {variable.name: variable for variable in scip.getVars()}
+        self._variables = [variables[name] for name in model.column_names()]
+        constraints = {constraint.name: constraint for constraint in scip.getConss()}
+        self._constraints = [constraints[name] for name in model.row_names()]
+
+        self._scip = scip
+
+    def _update(self, loaded: ArrayModel, model: ArrayModel):
+        scip = self._scip
+        # The solved problem has to be freed before the original problem can be changed
+        scip.freeTransform()
+
+        for column in np.flatnonzero(loaded.objective != model.objective).tolist():
+            scip.chgVarObj(self._variables[column], model.objective[column])
+
+        for column in np.flatnonzero(loaded.upper_bounds != model.upper_bounds).tolist():
+            upper = model.upper_bounds[column]
+            scip.chgVarUb(self._variables[column], None if np.isinf(upper) else upper)
+
+        for row in np.flatnonzero(loaded.rhs != model.rhs).tolist():
+            constraint = self._constraints[row]
+            sense = model.row_senses[row]
+            if sense in (SENSE_EQUAL, SENSE_GREATER):
+                scip.chgLhs(constraint, model.rhs[row])
+            if sense in (SENSE_EQUAL, SENSE_LESS):
+                scip.chgRhs(constraint, model.rhs[row])
+
+        if loaded.objective_offset != model.objective_offset:
+            scip.addObjoffset(model.objective_offset - loaded.objective_offset)
+
+    def _optimize(self, options: dict, log_file_path: str=None, start: np.ndarray=None) -> tuple[str, np.ndarray]:
+        scip = self._scip
+        if log_file_path:
+            scip.setLogfile(log_file_path)
+        set_scip_params(scip, options)
+        if start is not None:
+            columns = np.flatnonzero(start)
+            add_scip_start(scip, [self._variables[column] for column in columns], start[columns].tolist())
+
+        scip.optimize()
+
+        status = scip.getStatus()
+        if scip.getNSols() == 0:
+            return status, None
+
+        solution = scip.getBestSol()
+
+        return status, np.array([scip.getSolVal(solution, variable) for variable in self._variables])
+
+
+PERSISTENT_SOLVERS = {
+    SOLVER_BACKEND_HIGHS: HighsPersistentSolver,
+    SOLVER_BACKEND_SCIP: ScipPersistentSolver,
+}
+''' The persistent solver class of each solver backend that has one '''
+
+
+def get_persistent_solver(name: str, log: bool=False) -> PersistentSolver:
+    ''' A new persistent solver for the solver backend called name '''
+    if name not in PERSISTENT_SOLVERS:
+        raise ValueError(f'The {name} solver has no in-memory mode, expected one of {list(PERSISTENT_SOLVERS)}')
+
+    return PERSISTENT_SOLVERS[name](log)
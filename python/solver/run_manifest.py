@@ -0,0 +1,151 @@
+'''
+A record of the model runs whose results were written completely, so that a batch can be resumed.
+
+Each run is identified by a hash of what its results depend on: the config, hashed from the same
+fields as ModelConfig.generate_id, the distance data it was run on and where its results go. Once
+all of a run's results are written, a marker file named by that hash is written to the manifest
+directory, atomically, so a run that stopped part way through never has one. A resumed batch skips
+the runs with a marker whose result files are all still there and unchanged, by size and
+modification time.
+'''
+
+import hashlib
+import json
+import os
+import tempfile
+
+from python.database import models
+from python.database.query import Query
+from python.utils import (
+    build_distance_file_path, current_time_utc, DISTANCE_FILE_FORMAT_CSV, DISTANCE_FILE_FORMAT_PARQUET,
+)
+
+from .constants import DATA_SOURCE_DB
+from .model_config import PollingModelConfig
+
+MARKER_SUFFIX = '.json'
+''' The extension of the marker files '''
+
+
+def config_id(config: PollingModelConfig) -> str:
+    ''' The id of the config as a ModelConfig in the database, a hash of its column values '''
+    column_data = {
+        column.name: getattr(config, column.name)
+        for column in models.ModelConfig.__table__.columns
+        if column.name not in ['id', 'created_at']
+    }
+
+    return models.ModelConfig(**column_data).generate_id()
+
+
+def distance_data_identity(config: PollingModelConfig, query: Query=None) -> str:
+    '''
+    Identifies the distance data the config is run on: the local CSV file, or its parquet cache if
+    there is only the cache, by path, size and modification time, or otherwise the distance data set
+    in the database.
+    '''
+    for file_format in [DISTANCE_FILE_FORMAT_CSV, DISTANCE_FILE_FORMAT_PARQUET]:
+        path = build_distance_file_path(
+            config.census_year, config.location, config.driving, config.log_distance, file_format=file_format,
+        )
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            return f'{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}'
+
+    if config.data_source == DATA_SOURCE_DB and query is not None:
+        distance_data_set = query.get_distance_data_set(
+            config.census_year, config.location, config.log_distance, config.driving,
+        )
+        if distance_data_set:
+            return f'distance_data_set:{distance_data_set.id}'
+
+    raise ValueError(f'No distance data found for {config.config_set}/{config.config_name}')
+
+
+def run_hash(config: PollingModelConfig, outtype: str, query: Query=None) -> str:
+    ''' The hash that identifies the results of running config on its current distance data '''
+    serialized_data = json.dumps({
+        'config_id': config_id(config),
+        'distance_data': distance_data_identity(config, query),
+        'outtype': outtype,
+    }, sort_keys=True)
+
+    return hashlib.sha1(serialized_data.encode()).hexdigest()
+
+
+def _file_record(path: str) -> dict:
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+class RunManifest:
+    ''' The marker files of the completed runs in a directory '''
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        ''' The directory the marker files are written to '''
+
+    def _marker_path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}{MARKER_SUFFIX}')
+
+    def is_complete(self, key: str) -> bool:
+        '''
+        True if the run with the hash key was completed and its result files still have the size and
+        modification time they were recorded with
+        '''
+        try:
+            with open(self._marker_path(key), encoding='utf-8') as marker_file:
+                marker = json.load(marker_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False
+
+        # A result file rewritten since, even to the same size, is no longer the one recorded
+        for record in marker['files']:
+            if not os.path.isfile(record['path']) or _file_record(record['path']) != record:
+                return False
+
+        return True
+
+    def mark_complete(
+        self,
+        key: str,
+        config: PollingModelConfig,
+        outtype: str,
+        files: list[str]=(),
+        model_run_id: str=None,
+    ):
+        '''
+        Records that the run with the hash key wrote all of its results, the given result files or the
+        database model run with model_run_id.
+        '''
+        os.makedirs(self.directory, exist_ok=True)
+
+        marker = {
+            'config_set': config.config_set,
+            'config_name': config.config_name,
+            'outtype': outtype,
+            'model_run_id': model_run_id,
+            'files': [_file_record(path) for path in files],
+            'completed_at': current_time_utc().isoformat(),
+        }
+
+        # Write to a temporary file first so that the marker is never seen half written
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as tmp_file:
+            json.dump(marker, tmp_file, indent=2)
+        os.replace(tmp_path, self._marker_path(key))
+
+    def incomplete_configs(
+        self, configs: list[PollingModelConfig], outtype: str, log: bool=False,
+    ) -> list[PollingModelConfig]:
+        ''' The configs whose runs with results going to outtype have not been completed '''
+        results = []
+        for config in configs:
+            query = Query(config.environment) if config.data_source == DATA_SOURCE_DB else None
+            if self.is_complete(run_hash(config, outtype, query)):
+                if log:
+                    print(f'Skipping {config.config_set}/{config.config_name}, its results are complete')
+                continue
+            results.append(config)
+
+        return results
@@ -4,17 +4,20 @@ from dataclasses import dataclass
 
 import pandas as pd
 
+from .array_model import ArrayModel
+from .distance_matrix import DistanceMatrix
 from .model_config import PollingModelConfig
 from .model_factory import PollingModel
+from .pair_adjacency import PairAdjacency
 
 @dataclass
 class RunSetup:
     distance_data_set_id: str
-    distance_df: pd.DataFrame
+    distance_matrix: DistanceMatrix
     dist_df: pd.DataFrame
     alpha: float
-    alpha_df: pd.DataFrame
-    ea_model: PollingModel
+    adjacency: PairAdjacency
+    ea_model: PollingModel | ArrayModel
     run_prefix: str
     config: PollingModelConfig
 
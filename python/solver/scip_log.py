@@ -0,0 +1,297 @@
+'''
+Reads the logs scip writes for each solve into structured solver metrics.
+
+solve_model passes every model's log file to the solver, the Model 1 log at the config's
+log_file_path and the Model 2 and Model 3 logs next to it (see get_log_path). scip writes the same
+log whether it runs as the scip binary through pyomo or through pyscipopt: the presolve reductions,
+a table of the node count and the primal and dual bounds as the solve goes on, and a summary of the
+status, nodes, bounds and gap once it stops. parse_scip_log reads those back so that the time limits
+and gaps of the configs can be tuned from the runs, and runs that stopped at the time limit with a
+poor gap can be found.
+
+A log file may hold several solves, as the solver of an in-memory run appends to it, so only the
+last solve in the file is read.
+'''
+
+from dataclasses import dataclass, field
+import math
+import re
+
+import pandas as pd
+
+from .constants import SOLVER_MODEL1
+
+SCIP_STATUS_TIME_LIMIT = 'time limit reached'
+''' The status of a solve stopped by limits/time '''
+
+STATUS_PREFIX = 'SCIP Status'
+''' The start of the first line of the summary scip writes once a solve stops '''
+
+GAP_PREFIX = 'Gap'
+''' The start of the last line of the summary scip writes once a solve stops '''
+
+_TIME_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+_PROBLEM_SIZE = re.compile(r'problem has (\d+) variables .* and (\d+) constraints')
+_PRESOLVE_ROUNDS = re.compile(r'^presolving \((\d+) rounds')
+_PRESOLVE_REDUCTION = re.compile(
+    r'(\d+) (deleted vars|deleted constraints|tightened bounds|changed sides|changed coefficients)'
+)
+_HEURISTIC_SOLUTION = re.compile(r'feasible solution found by .* after ([\d.]+) seconds')
+_SUMMARY_LINE = re.compile(r'^([A-Za-z ()]+?)\s*:\s*(.*)$')
+_NUMBER = re.compile(r'^[+-]?(\d+\.?\d*(e[+-]?\d+)?|inf(inity)?)', re.IGNORECASE)
+
+_PRESOLVE_FIELDS = {
+    'deleted vars': 'presolve_deleted_vars',
+    'deleted constraints': 'presolve_deleted_conss',
+    'tightened bounds': 'presolve_tightened_bounds',
+    'changed sides': 'presolve_changed_sides',
+    'changed coefficients': 'presolve_changed_coefs',
+}
+
+
+@dataclass
+class BoundPoint:
+    ''' A row of the table scip logs as it solves '''
+
+    time: float
+    ''' The solving time in seconds '''
+    nodes: int | None
+    ''' The number of nodes processed so far '''
+    dual_bound: float | None
+    ''' The dual bound, None if there is none yet '''
+    primal_bound: float | None
+    ''' The objective of the best solution so far, None if there is none yet '''
+    gap: float | None
+    ''' The relative gap between the bounds, inf while it is infinite, None if there is none yet '''
+
+
+@dataclass
+class ScipLogMetrics:
+    ''' The metrics of a scip solve read from its log '''
+
+    status: str | None = None
+    ''' Why scip stopped, such as "optimal solution found" or "time limit reached" '''
+    solving_time: float | None = None
+    ''' The time in seconds scip took, including presolving '''
+    presolving_time: float | None = None
+    ''' The time in seconds scip spent presolving '''
+    nodes: int | None = None
+    ''' The number of branch and bound nodes solved, over all restarts '''
+    primal_bound: float | None = None
+    ''' The objective of the best solution found, None if none was found '''
+    dual_bound: float | None = None
+    ''' The final dual bound '''
+    gap: float | None = None
+    ''' The final relative gap, 0.02 for 2%, inf if it is infinite '''
+    num_solutions: int | None = None
+    ''' The number of solutions found '''
+    first_incumbent_time: float | None = None
+    ''' The time in seconds at which the first solution was found, 0 if scip was given one '''
+    original_vars: int | None = None
+    ''' The number of variables of the model '''
+    original_conss: int | None = None
+    ''' The number of constraints of the model '''
+    presolved_vars: int | None = None
+    ''' The number of variables left after presolving '''
+    presolved_conss: int | None = None
+    ''' The number of constraints left after presolving '''
+    presolve_rounds: int | None = None
+    ''' The number of presolving rounds '''
+    presolve_deleted_vars: int | None = None
+    ''' The number of variables presolving removed '''
+    presolve_deleted_conss: int | None = None
+    ''' The number of constraints presolving removed '''
+    presolve_tightened_bounds: int | None = None
+    ''' The number of variable bounds presolving tightened '''
+    presolve_changed_sides: int | None = None
+    ''' The number of constraint sides presolving changed '''
+    presolve_changed_coefs: int | None = None
+    ''' The number of coefficients presolving changed '''
+    trajectory: list[BoundPoint] = field(default_factory=list)
+    ''' The rows of the table scip logged as it solved, in order '''
+
+    @property
+    def hit_time_limit(self) -> bool:
+        ''' True if the solve stopped at the time limit '''
+        return self.status == SCIP_STATUS_TIME_LIMIT
+
+    def summary(self) -> dict:
+        ''' The metrics other than the trajectory, by name '''
+        return {name: value for name, value in vars(self).items() if name != 'trajectory'}
+
+
+def _parse_number(text: str) -> float | None:
+    text = text.strip()
+    match = _NUMBER.match(text)
+    if not match:
+        return None
+
+    return float(match.group(0))
+
+
+def _parse_time(text: str) -> float | None:
+    # The table shows times as 4.6s, 123s, 35m or 2.1h
+    text = text.strip()
+    if not text or text[-1] not in _TIME_UNITS:
+        return None
+    value = _parse_number(text[:-1])
+
+    return None if value is None else value * _TIME_UNITS[text[-1]]
+
+
+def _parse_gap(text: str) -> float | None:
+    text = text.strip()
+    if text.lower() in ['inf', 'infinite']:
+        return math.inf
+    value = _parse_number(text.rstrip('%').strip())
+
+    return None if value is None else value / 100
+
+
+def _last_solve(lines: list[str]) -> list[str]:
+    # The last solve starts after the summary of the solve before it
+    statuses = [index for index, line in enumerate(lines) if line.startswith(STATUS_PREFIX)]
+    if len(statuses) < 2:
+        return lines
+
+    start = statuses[-2] + 1
+    while start < statuses[-1] and not lines[start - 1].startswith(GAP_PREFIX):
+        start += 1
+
+    return lines[start:]
+
+
+def _parse_table_row(columns: dict[str, int], cells: list[str]) -> BoundPoint | None:
+    # The first cell starts with the character of the heuristic that found a new solution, if one did
+    time = _parse_time(cells[columns['time']][1:])
+    if time is None:
+        return None
+
+    nodes = _parse_number(cells[columns['node']]) if 'node' in columns else None
+
+    return BoundPoint(
+        time=time,
+        nodes=None if nodes is None else int(nodes),
+        dual_bound=_parse_number(cells[columns['dualbound']]),
+        primal_bound=_parse_number(cells[columns['primalbound']]),
+        gap=_parse_gap(cells[columns['gap']]),
+    )
+
+
+def parse_scip_log(text: str) -> ScipLogMetrics | None:
+    ''' The metrics of the last solve in the scip log text, or None if it has no finished solve '''
+    result = ScipLogMetrics()
+    columns: dict[str, int] = None
+    incumbent_times = []
+    finished = False
+
+    for line in _last_solve(text.splitlines()):
+        stripped = line.strip()
+
+        if line.startswith('original problem has') and (match := _PROBLEM_SIZE.search(line)):
+            result.original_vars, result.original_conss = int(match.group(1)), int(match.group(2))
+        elif line.startswith('presolved problem has') and (match := _PROBLEM_SIZE.search(line)):
+            result.presolved_vars, result.presolved_conss = int(match.group(1)), int(match.group(2))
+        elif match := _PRESOLVE_ROUNDS.match(line):
+            result.presolve_rounds = int(match.group(1))
+        elif 'deleted vars' in line and 'deleted constraints' in line and not line.startswith('('):
+            for count, name in _PRESOLVE_REDUCTION.findall(line):
+                setattr(result, _PRESOLVE_FIELDS[name], int(count))
+        elif match := _HEURISTIC_SOLUTION.search(line):
+            incumbent_times.append(float(match.group(1)))
+        elif 'feasible solution given by solution candidate storage' in line:
+            # A warm start, given before the solve started
+            incumbent_times.append(0.0)
+        elif '|' in line:
+            cells = line.split('|')
+            names = [cell.strip() for cell in cells]
+            if 'time' in names and 'primalbound' in names:
+                columns = {name: index for index, name in enumerate(names)}
+            elif columns is not None and len(cells) >= len(columns):
+                point = _parse_table_row(columns, cells)
+                if point is not None:
+                    result.trajectory.append(point)
+                    if point.primal_bound is not None:
+                        incumbent_times.append(point.time)
+        elif match := _SUMMARY_LINE.match(stripped):
+            name, value = match.group(1).strip(), match.group(2).strip()
+            if name == STATUS_PREFIX:
+                finished = True
+                status = re.search(r'\[(.*)\]', value)
+                result.status = status.group(1) if status else value
+            elif name == 'Solving Time (sec)':
+                result.solving_time = _parse_number(value)
+            elif name == 'Presolving Time':
+                result.presolving_time = _parse_number(value)
+            elif name == 'Solving Nodes':
+                total = re.search(r'total of (\d+) nodes', value)
+                result.nodes = int(total.group(1)) if total else int(_parse_number(value) or 0)
+            elif name == 'Primal Bound':
+                solutions = re.search(r'\((\d+) solutions?\)', value)
+                result.num_solutions = int(solutions.group(1)) if solutions else 0
+                result.primal_bound = _parse_number(value) if result.num_solutions else None
+            elif name == 'Dual Bound':
+                result.dual_bound = _parse_number(value)
+            elif name == GAP_PREFIX:
+                result.gap = _parse_gap(value)
+
+    if not finished:
+        return None
+
+    if incumbent_times and result.num_solutions != 0:
+        result.first_incumbent_time = min(incumbent_times)
+
+    return result
+
+
+def read_scip_log(path: str) -> ScipLogMetrics | None:
+    ''' The metrics of the last solve in the scip log file at path, None if there is none '''
+    try:
+        with open(path, encoding='utf-8', errors='replace') as log_file:
+            return parse_scip_log(log_file.read())
+    except FileNotFoundError:
+        return None
+
+
+def model_run_solver_columns(metrics: dict[str, ScipLogMetrics]) -> dict:
+    '''
+    The solver metrics columns of a database ModelRun from the metrics of each model of the run, by
+    model: the totals over the models, the worst gap, and the status and presolve of Model 1.
+    '''
+    if not metrics:
+        return {}
+
+    gaps = [model_metrics.gap for model_metrics in metrics.values() if model_metrics.gap is not None]
+    model1 = metrics.get(SOLVER_MODEL1, ScipLogMetrics())
+
+    return {
+        'solver_status': model1.status,
+        'solver_time': sum(model_metrics.solving_time or 0 for model_metrics in metrics.values()),
+        'solver_nodes': sum(model_metrics.nodes or 0 for model_metrics in metrics.values()),
+        'solver_gap': max(gaps) if gaps else None,
+        'solver_hit_time_limit': any(model_metrics.hit_time_limit for model_metrics in metrics.values()),
+        'solver_first_incumbent_time': model1.first_incumbent_time,
+        'presolve_deleted_vars': model1.presolve_deleted_vars,
+        'presolve_deleted_conss': model1.presolve_deleted_conss,
+    }
+
+
+def solver_metrics_df(metrics: dict[str, ScipLogMetrics]) -> pd.DataFrame:
+    ''' The summaries of the metrics of each model of a run, indexed by model '''
+    return pd.DataFrame.from_dict(
+        {model: model_metrics.summary() for model, model_metrics in metrics.items()},
+        orient='index',
+    ).rename_axis('model')
+
+
+def solver_trajectory_df(metrics: dict[str, ScipLogMetrics]) -> pd.DataFrame:
+    ''' The bound trajectories of each model of a run, one row per row of the scip table '''
+    return pd.DataFrame(
+        [
+            {'model': model, **vars(point)}
+            for model, model_metrics in metrics.items()
+            for point in model_metrics.trajectory
+        ],
+        columns=['model'] + list(BoundPoint.__dataclass_fields__),
+    )
@@ -0,0 +1,245 @@
+'''
+Evaluates a fixed set of open sites without solving the full model.
+
+Many questions fix the open sites, such as the historical polling locations or a planner's
+proposal, and only ask for the assignment of the residences to them and the resulting equity.
+With the sites fixed the model is only an assignment problem: each residence goes to one open site
+within the max_min radius, the sites' populations within their capacity, at the least total cost of
+the same objective as the model (population weighted distance, or population weighted KP factor if
+beta is not 0).
+
+If every residence can go to its cheapest open site without any site going over capacity that is the
+optimal assignment, found directly. Otherwise the assignment is solved as a transportation problem
+with integer matching by HiGHS, through scipy, which for this structure is nearly always as quick as
+its linear relaxation.
+
+The new and old location limits of the config are not checked, the sites are taken as given. The
+capacity of each site is that of the model with precincts_open set to the number of open sites.
+'''
+
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import Bounds, LinearConstraint, milp
+from scipy.sparse import csr_matrix
+
+from .constants import (
+    DISTANCE_ID_ORIG, DISTANCE_ID_DEST, DISTANCE_DISTANCE_M, DISTANCE_TOTAL_POPULATION, DISTANCE_WEIGHTED_DIST,
+    PD_MEAN, RESULT_KP_FACTOR,
+)
+from .distance_matrix import DistanceMatrix
+from .model_config import PollingModelConfig
+from .model_factory import add_pair_columns, get_max_min, get_max_population, get_total_pop
+from .model_results import result_rows_df
+
+CAPACITY_TOLERANCE = 1e-9
+''' The relative amount a site may go over its capacity, for rounding in the populations '''
+
+
+@dataclass
+class SiteAssignment:
+    ''' The optimal assignment of the residences to a set of open sites '''
+
+    open_sites: list
+    ''' The id_dests of the open sites '''
+    rows: np.ndarray
+    ''' The positions in dist_df of the rows of the matched pairs, in order '''
+    objective: float
+    ''' The objective of the model for this assignment '''
+    capacity_binding: bool
+    ''' True if some site could not take every residence for which it is the cheapest '''
+
+
+def solve_transportation(
+    pairs: np.ndarray,
+    pair_residences: np.ndarray,
+    pair_sites: np.ndarray,
+    pair_costs: np.ndarray,
+    population: np.ndarray,
+    num_sites: int,
+    max_population: float | np.ndarray,
+    time_limit: float=None,
+    mip_gap: float=0.0,
+) -> np.ndarray:
+    '''
+    The pairs, of the given positions in pair_residences, pair_sites and pair_costs, of the least cost
+    assignment of each residence to one site with each site's population within max_population, the
+    capacity of every site or of each site
+    '''
+    # One variable per pair, each residence assigned once, each site within capacity
+    num_pairs = len(pairs)
+    columns = np.arange(num_pairs)
+    assigned = csr_matrix(
+        (np.ones(num_pairs), (pair_residences[pairs], columns)),
+        shape=(len(population), num_pairs),
+    )
+    capacity = csr_matrix(
+        (population[pair_residences[pairs]], (pair_sites[pairs], columns)),
+        shape=(num_sites, num_pairs),
+    )
+    options = {'mip_rel_gap': mip_gap}
+    if time_limit is not None:
+        options['time_limit'] = time_limit
+
+    result = milp(
+        c=pair_costs[pairs],
+        integrality=np.ones(num_pairs),
+        bounds=Bounds(0, 1),
+        constraints=[
+            LinearConstraint(assigned, 1, 1),
+            LinearConstraint(capacity, -np.inf, max_population),
+        ],
+        options=options,
+    )
+    if result.x is None:
+        raise ValueError(f'No assignment to the open sites respects their capacity ({result.message})')
+
+    return pairs[result.x >= 0.5]
+
+
+class SiteEvaluator:
+    '''
+    Finds the optimal assignment of the residences of dist_df to any set of open sites. The pairs
+    within max_min and their costs are found once, so that many sets of sites can be compared.
+    '''
+
+    def __init__(
+        self,
+        dist_df: pd.DataFrame,
+        alpha: float,
+        config: PollingModelConfig,
+        time_limit: float=None,
+        mip_gap: float=0.0,
+        distance_matrix: DistanceMatrix=None,
+    ):
+        '''
+        dist_df is the filtered distance data a model of config would be built from, and alpha its
+        normalization factor. time_limit is the limit in seconds of each assignment solved as a
+        transportation problem, None for no limit, and mip_gap the relative gap it is solved to.
+        distance_matrix is the DistanceMatrix dist_df was built from, if it was (see result_rows_df).
+        '''
+        self.dist_df = dist_df
+        ''' The distance data of the residences and sites '''
+        self.distance_matrix = distance_matrix
+        ''' The DistanceMatrix dist_df was built from, or None '''
+        self.config = config
+        ''' The config whose objective and capacity the assignments follow '''
+        self.time_limit = time_limit
+        ''' The limit in seconds of each transportation problem solved '''
+        self.mip_gap = mip_gap
+        ''' The relative gap each transportation problem is solved to '''
+
+        #KP factor and new location marker, as the models add them, so results have the same columns
+        if RESULT_KP_FACTOR not in dist_df.columns:
+            add_pair_columns(config, alpha, dist_df)
+
+        self.total_pop = get_total_pop(dist_df)
+        ''' The total population of the residences '''
+
+        residence_codes, self.residence_ids = pd.factorize(dist_df[DISTANCE_ID_ORIG])
+        site_codes, self.site_ids = pd.factorize(dist_df[DISTANCE_ID_DEST])
+
+        population = dist_df.groupby(DISTANCE_ID_ORIG)[DISTANCE_TOTAL_POPULATION].agg(PD_MEAN)
+        self.population = population.reindex(self.residence_ids).to_numpy(dtype=np.float64)
+        ''' The population of each residence, in the order of residence_ids '''
+
+        #the pairs that can be matched, i.e. within the max_min radius
+        self.pair_rows = np.flatnonzero(dist_df[DISTANCE_DISTANCE_M].to_numpy() <= get_max_min(config, dist_df))
+        ''' The position in dist_df of each pair '''
+        self.pair_residences = residence_codes[self.pair_rows]
+        ''' The residence position of each pair '''
+        self.pair_sites = site_codes[self.pair_rows]
+        ''' The site position of each pair '''
+
+        #the objective coefficient of each pair, as in the model
+        if config.beta:
+            self.pair_costs = (
+                self.population[self.pair_residences]
+                * dist_df[RESULT_KP_FACTOR].to_numpy(dtype=np.float64)[self.pair_rows]
+            )
+        else:
+            self.pair_costs = dist_df[DISTANCE_WEIGHTED_DIST].to_numpy(dtype=np.float64)[self.pair_rows]
+
+    def site_positions(self, open_sites: list) -> np.ndarray:
+        ''' The positions of the open sites in site_ids '''
+        positions = self.site_ids.get_indexer(list(open_sites))
+        if (positions < 0).any():
+            unknown = [site for site, position in zip(open_sites, positions) if position < 0]
+            raise ValueError(f'{len(unknown)} open site(s) are not in the distance data: {unknown}')
+
+        return positions
+
+    def max_population(self, num_open: int) -> float:
+        ''' The population each site can take with num_open sites open '''
+        return get_max_population(self.config, self.total_pop, num_open)
+
+    def _open_pairs(self, is_open: np.ndarray) -> np.ndarray:
+        pairs = np.flatnonzero(is_open[self.pair_sites])
+        unserved = len(self.residence_ids) - len(np.unique(self.pair_residences[pairs]))
+        if unserved:
+            raise ValueError(f'{unserved} residence(s) have no open site within the max_min radius')
+
+        return pairs
+
+    def _cheapest_pairs(self, pairs: np.ndarray) -> np.ndarray:
+        # The cheapest of each residence's pairs comes first once sorted by residence, then cost
+        order = np.lexsort((self.pair_costs[pairs], self.pair_residences[pairs]))
+        pairs = pairs[order]
+        _, first = np.unique(self.pair_residences[pairs], return_index=True)
+
+        return pairs[first]
+
+    def _site_loads(self, pairs: np.ndarray) -> np.ndarray:
+        return np.bincount(
+            self.pair_sites[pairs],
+            weights=self.population[self.pair_residences[pairs]],
+            minlength=len(self.site_ids),
+        )
+
+    def _transportation_pairs(self, pairs: np.ndarray, max_population: float) -> np.ndarray:
+        return solve_transportation(
+            pairs, self.pair_residences, self.pair_sites, self.pair_costs, self.population,
+            len(self.site_ids), max_population, self.time_limit, self.mip_gap,
+        )
+
+    def assign(self, open_sites: list) -> SiteAssignment:
+        ''' The optimal assignment of the residences to the open sites '''
+        is_open = np.zeros(len(self.site_ids), dtype=bool)
+        is_open[self.site_positions(open_sites)] = True
+        max_population = self.max_population(int(is_open.sum()))
+
+        pairs = self._open_pairs(is_open)
+        matched = self._cheapest_pairs(pairs)
+        capacity_binding = bool(
+            (self._site_loads(matched) > max_population * (1 + CAPACITY_TOLERANCE)).any()
+        )
+        if capacity_binding:
+            matched = np.sort(self._transportation_pairs(pairs, max_population))
+
+        return SiteAssignment(
+            open_sites=list(open_sites),
+            rows=np.sort(self.pair_rows[matched]),
+            objective=float(self.pair_costs[matched].sum() / self.total_pop),
+            capacity_binding=capacity_binding,
+        )
+
+    def result_df(self, open_sites: list) -> pd.DataFrame:
+        ''' The matched rows of dist_df for the open sites, in the form of incorporate_result '''
+        return result_rows_df(
+            self.dist_df, self.assign(open_sites).rows, self.config.log_distance, self.distance_matrix,
+        )
+
+
+def evaluate_open_sites(
+    open_sites: list,
+    dist_df: pd.DataFrame,
+    alpha: float,
+    config: PollingModelConfig,
+    distance_matrix: DistanceMatrix=None,
+) -> pd.DataFrame:
+    '''
+    The result of assigning the residences of dist_df optimally to the open sites, the matched rows of
+    dist_df in the form of incorporate_result, so it can be summarized and written like a model's.
+    '''
+    return SiteEvaluator(dist_df, alpha, config, distance_matrix=distance_matrix).result_df(open_sites)
@@ -0,0 +1,441 @@
+'''
+The solvers that models can be solved with, and how the solver settings of a PollingModelConfig
+map onto each solver's own options.
+
+Every backend is a locally installable open source MIP solver:
+    scip  -- the default, run through pyomo's NL interface, or pyscipopt for ArrayModels
+    highs -- run through pyomo's appsi interface, or highspy for ArrayModels
+    cbc   -- run through pyomo's shell interface, pyomo models only
+
+and, for quick answers rather than optimal ones,
+    heuristic -- greedy site selection and swap local search, ArrayModels only (see heuristic)
+
+The common settings are the time limit and optimality gap from the config, plus the optional
+number of threads, whether to presolve and an emphasis of either feasibility (find good solutions
+quickly) or optimality (prove the optimum quickly). Settings left as None keep the solver default.
+
+A solve can be warm started from a known solution: the variable values of a pyomo model, or the
+start values of the columns of an MPS file.
+'''
+
+from abc import ABC, abstractmethod
+
+import pyomo.environ as pyo
+import pyscipopt
+
+from .constants import (
+    SOLVER_BACKEND_SCIP, SOLVER_BACKEND_HIGHS, SOLVER_BACKEND_CBC, SOLVER_BACKEND_HEURISTIC,
+    SOLVER_EMPHASIS_FEASIBILITY, SOLVER_EMPHASIS_OPTIMALITY,
+)
+
+SCIP_LP_THREADS = 1
+''' The number of LP threads scip uses unless the number of threads is set '''
+
+SOLVER_EMPHASES = [SOLVER_EMPHASIS_FEASIBILITY, SOLVER_EMPHASIS_OPTIMALITY]
+
+SOLVER_PRESOLVE_ON = 'on'
+SOLVER_PRESOLVE_OFF = 'off'
+
+
+class SolverBackend(ABC):
+    ''' A solver and the mapping of the common solver settings to its options '''
+
+    name: str
+    ''' The name used to select this backend in configs and on the command line '''
+    pyomo_name: str
+    ''' The name of the solver in pyomo's SolverFactory '''
+    solves_arrays: bool = False
+    ''' True if the backend solves ArrayModels directly with solve_array, rather than through an MPS file '''
+
+    @abstractmethod
+    def options(
+        self,
+        time_limit: int,
+        limits_gap: float,
+        threads: int=None,
+        presolve: bool=None,
+        emphasis: str=None,
+    ) -> dict:
+        ''' The solver options for the given settings '''
+
+    def available(self) -> bool:
+        ''' True if the solver is installed '''
+        return bool(pyo.SolverFactory(self.pyomo_name).available(exception_flag=False))
+
+    def solve(
+        self,
+        model: pyo.ConcreteModel,
+        options: dict,
+        log: bool=False,
+        log_file_path: str=None,
+        warm_start: bool=False,
+    ):
+        '''
+        Solves a pyomo model with the given options, loading the solution into the model. With
+        warm_start the solver starts from the values already set on the model's variables.
+        '''
+        solver = pyo.SolverFactory(self.pyomo_name)
+        solver.options = options
+
+        # Solvers run through NL files, such as scip, are always given the variable values as their
+        # initial guess and take no warmstart argument
+        kwargs = {'warmstart': True} if warm_start and solver.warm_start_capable() else {}
+
+        return solver.solve(model, tee=log, logfile=log_file_path, **kwargs)
+
+    def solve_mps(
+        self,
+        mps_path: str,
+        options: dict,
+        log: bool=False,
+        log_file_path: str=None,
+        start: dict=None,
+    ):
+        '''
+        Solves the model in an MPS file with the given options, starting from the values of the
+        columns named in start if given. Columns missing from start start at 0.
+
+        Returns
+        The solver status, and the names and values of the columns in the best solution
+        '''
+        raise ValueError(f'The {self.name} solver backend can not solve MPS files')
+
+    def solve_array(
+        self,
+        model,
+        options: dict,
+        log: bool=False,
+        log_file_path: str=None,
+        warm_start: bool=False,
+    ):
+        '''
+        Solves an ArrayModel with the given options and sets the solution on the model, for backends
+        with solves_arrays. With warm_start the solver starts from the start of the model.
+        '''
+        raise ValueError(f'The {self.name} solver backend can not solve ArrayModels directly')
+
+    @staticmethod
+    def _check_emphasis(emphasis: str):
+        if emphasis is not None and emphasis not in SOLVER_EMPHASES:
+            raise ValueError(f'Unknown solver emphasis {emphasis}, expected one of {SOLVER_EMPHASES}')
+
+
+class ScipBackend(SolverBackend):
+    ''' SCIP, the solver the models were written for '''
+
+    name = SOLVER_BACKEND_SCIP
+    pyomo_name = 'scip'
+
+    def options(
+        self,
+        time_limit: int,
+        limits_gap: float,
+        threads: int=None,
+        presolve: bool=None,
+        emphasis: str=None,
+    ) -> dict:
+        self._check_emphasis(emphasis)
+
+        result = {
+            'limits/time': time_limit,
+            'limits/gap': limits_gap,
+            'lp/threads': SCIP_LP_THREADS if threads is None else threads,
+        }
+        if presolve is False:
+            result['presolving/maxrounds'] = 0
+        if emphasis is not None:
+            result.update(self._emphasis_params(emphasis))
+
+        return result
+
+    @staticmethod
+    def _emphasis_params(emphasis: str) -> dict:
+        # scip sets emphasis as a group of parameters, not a parameter of its own. Take the group from
+        # pyscipopt as the parameters that differ from the defaults once the emphasis is set.
+        defaults = pyscipopt.Model().getParams()
+
+        scip = pyscipopt.Model()
+        if emphasis == SOLVER_EMPHASIS_FEASIBILITY:
+            scip.setEmphasis(pyscipopt.SCIP_PARAMEMPHASIS.FEASIBILITY)
+        else:
+            scip.setEmphasis(pyscipopt.SCIP_PARAMEMPHASIS.OPTIMALITY)
+
+        return {
+            name: ('TRUE' if value else 'FALSE') if isinstance(value, bool) else value
+            for name, value in scip.getParams().items()
+            if value != defaults[name]
+        }
+
+    def solve_mps(
+        self,
+        mps_path: str,
+        options: dict,
+        log: bool=False,
+        log_file_path: str=None,
+        start: dict=None,
+    ):
+        scip = pyscipopt.Model()
+        if not log:
+            scip.hideOutput()
+        if log_file_path:
+            scip.setLogfile(log_file_path)
+
+        scip.readProblem(mps_path)
+        set_scip_params(scip, options)
+        if start:
+            variables = {variable.name: variable for variable in scip.getVars()}
+            add_scip_start(scip, [variables[name] for name in start], list(start.values()))
+
+        scip.optimize()
+
+        status = scip.getStatus()
+        if scip.getNSols() == 0:
+            return status, [], []
+
+        solution = scip.getBestSol()
+        variables = scip.getVars()
+
+        return (
+            status,
+            [variable.name for variable in variables],
+            [scip.getSolVal(solution, variable) for variable in variables],
+        )
+
+
+class HighsBackend(SolverBackend):
+    ''' HiGHS, whose branch and bound can use several threads '''
+
+    name = SOLVER_BACKEND_HIGHS
+    pyomo_name = 'appsi_highs'
+
+    HEURISTIC_EFFORT = {
+        SOLVER_EMPHASIS_FEASIBILITY: 0.3,
+        SOLVER_EMPHASIS_OPTIMALITY: 0.01,
+    }
+    ''' HiGHS has no emphasis setting, the nearest is the share of effort spent on primal heuristics '''
+
+    def options(
+        self,
+        time_limit: int,
+        limits_gap: float,
+        threads: int=None,
+        presolve: bool=None,
+        emphasis: str=None,
+    ) -> dict:
+        self._check_emphasis(emphasis)
+
+        result = {
+            'time_limit': float(time_limit),
+            'mip_rel_gap': float(limits_gap),
+        }
+        if threads is not None:
+            result['threads'] = threads
+        if presolve is not None:
+            result['presolve'] = SOLVER_PRESOLVE_ON if presolve else SOLVER_PRESOLVE_OFF
+        if emphasis is not None:
+            result['mip_heuristic_effort'] = self.HEURISTIC_EFFORT[emphasis]
+
+        return result
+
+    def solve(
+        self,
+        model: pyo.ConcreteModel,
+        options: dict,
+        log: bool=False,
+        log_file_path: str=None,
+        warm_start: bool=False,
+    ):
+        reset_highs_threads(options)
+
+        # The appsi interface takes the log file as an option rather than an argument to solve
+        if log_file_path:
+            options = {**options, 'log_file': log_file_path}
+
+        return super().solve(model, options, log, warm_start=warm_start)
+
+    def solve_mps(
+        self,
+        mps_path: str,
+        options: dict,
+        log: bool=False,
+        log_file_path: str=None,
+        start: dict=None,
+    ):
+        # pylint: disable-next=import-outside-toplevel
+        import highspy
+
+        reset_highs_threads(options)
+
+        highs = highspy.Highs()
+        set_highs_options(highs, options, log, log_file_path)
+
+        highs.readModel(mps_path)
+        if start:
+            values = dict.fromkeys(highs.getLp().col_names_, 0.0)
+            values.update(start)
+            set_highs_start(highs, list(values.values()))
+        highs.run()
+
+        status = highs.modelStatusToString(highs.getModelStatus())
+        if highs.getInfo().primal_solution_status == 0:
+            return status, [], []
+
+        lp = highs.getLp()
+
+        return status, list(lp.col_names_), list(highs.getSolution().col_value)
+
+
+class CbcBackend(SolverBackend):
+    ''' COIN-OR CBC '''
+
+    name = SOLVER_BACKEND_CBC
+    pyomo_name = 'cbc'
+
+    STRATEGY = {
+        SOLVER_EMPHASIS_FEASIBILITY: 2,
+        SOLVER_EMPHASIS_OPTIMALITY: 1,
+    }
+    ''' CBC has no emphasis setting, the nearest is its strategy: 2 adds aggressive heuristics '''
+
+    def options(
+        self,
+        time_limit: int,
+        limits_gap: float,
+        threads: int=None,
+        presolve: bool=None,
+        emphasis: str=None,
+    ) -> dict:
+        self._check_emphasis(emphasis)
+
+        result = {
+            'seconds': time_limit,
+            'ratioGap': limits_gap,
+        }
+        if threads is not None:
+            result['threads'] = threads
+        if presolve is not None:
+            result['presolve'] = SOLVER_PRESOLVE_ON if presolve else SOLVER_PRESOLVE_OFF
+        if emphasis is not None:
+            result['strategy'] = self.STRATEGY[emphasis]
+
+        return result
+
+
+class HeuristicBackend(SolverBackend):
+    '''
+    Greedy site selection and swap local search, for quick answers on large counties. Its solutions
+    are not proven optimal, only compared with the bound of the LP relaxation.
+    '''
+
+    name = SOLVER_BACKEND_HEURISTIC
+    pyomo_name = None
+    solves_arrays = True
+
+    def options(
+        self,
+        time_limit: int,
+        limits_gap: float,
+        threads: int=None,
+        presolve: bool=None,
+        emphasis: str=None,
+    ) -> dict:
+        self._check_emphasis(emphasis)
+
+        # With the feasibility emphasis skip the LP relaxation, only the solution is wanted
+        return {
+            'time_limit': float(time_limit),
+            'limits_gap': float(limits_gap),
+            'bound': emphasis != SOLVER_EMPHASIS_FEASIBILITY,
+        }
+
+    def available(self) -> bool:
+        return True
+
+    def solve(
+        self,
+        model: pyo.ConcreteModel,
+        options: dict,
+        log: bool=False,
+        log_file_path: str=None,
+        warm_start: bool=False,
+    ):
+        raise ValueError(f'The {self.name} solver only solves ArrayModels, set array_model in the config')
+
+    def solve_array(
+        self,
+        model,
+        options: dict,
+        log: bool=False,
+        log_file_path: str=None,
+        warm_start: bool=False,
+    ):
+        # The heuristic builds on the result modules, which import the solver backends
+        # pylint: disable-next=import-outside-toplevel
+        from .heuristic import solve_heuristic
+
+        return solve_heuristic(model, **options, log=log, log_file_path=log_file_path, warm_start=warm_start)
+
+
+def set_scip_params(scip: pyscipopt.Model, options: dict):
+    ''' Sets scip options on a pyscipopt model '''
+    for name, value in options.items():
+        # Boolean parameters are written as TRUE or FALSE for the scip executable
+        if value in ('TRUE', 'FALSE'):
+            value = value == 'TRUE'
+        scip.setParam(name, value)
+
+
+def add_scip_start(scip: pyscipopt.Model, variables: list, values: list):
+    ''' Gives scip the values of the variables, the others 0, as a solution to start from '''
+    solution = scip.createSol()
+    for variable, value in zip(variables, values):
+        scip.setSolVal(solution, variable, value)
+    scip.addSol(solution)
+
+
+def set_highs_start(highs, values: list):
+    ''' Gives a highspy.Highs instance the value of every column as a solution to start from '''
+    # pylint: disable-next=import-outside-toplevel
+    import highspy
+
+    solution = highspy.HighsSolution()
+    solution.col_value = values
+    solution.value_valid = True
+    highs.setSolution(solution)
+
+
+def set_highs_options(highs, options: dict, log: bool=False, log_file_path: str=None):
+    ''' Sets HiGHS options, and where it logs to, on a highspy.Highs instance '''
+    highs.setOptionValue('output_flag', log)
+    if log_file_path:
+        highs.setOptionValue('log_file', log_file_path)
+    for name, value in options.items():
+        highs.setOptionValue(name, value)
+
+
+def reset_highs_threads(options: dict):
+    '''
+    HiGHS keeps the threads of the first solve in a process for every later solve unless its
+    scheduler is reset first, so reset it whenever the options set the threads.
+    '''
+    if 'threads' in options:
+        # highspy is only needed when solving with HiGHS
+        # pylint: disable-next=import-outside-toplevel
+        import highspy
+
+        highspy.Highs.resetGlobalScheduler(True)
+
+
+SOLVER_BACKENDS = {
+    backend.name: backend
+    for backend in [ScipBackend(), HighsBackend(), CbcBackend(), HeuristicBackend()]
+}
+''' The solver backends by name '''
+
+
+def get_solver_backend(name: str) -> SolverBackend:
+    ''' The solver backend called name '''
+    if name not in SOLVER_BACKENDS:
+        raise ValueError(f'Unknown solver {name}, expected one of {list(SOLVER_BACKENDS)}')
+
+    return SOLVER_BACKENDS[name]
@@ -0,0 +1,139 @@
+'''
+A spatial index over destination coordinates used to find candidate origin/destination pairs
+without computing the distance of every pair.
+
+Coordinates are placed on the unit sphere so that a KD-tree over their (x, y, z) positions can answer
+great circle radius and nearest neighbor queries: the straight line (chord) distance between two
+points on a sphere increases with their great circle distance, so ranking and radius limits carry over
+exactly.
+'''
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from .constants import HAVERSINE_EARTH_RADIUS_KM
+
+EARTH_RADIUS_M = HAVERSINE_EARTH_RADIUS_KM * 1000
+''' Mean earth radius in meters '''
+
+DEFAULT_NEAREST_K = 1
+''' The default number of nearest destinations of each group kept for every origin '''
+
+
+def to_unit_sphere(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    ''' Converts latitudes and longitudes in degrees to an n x 3 array of points on the unit sphere '''
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    cos_lat = np.cos(lat)
+
+    return np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)))
+
+
+def great_circle_to_chord(distance_m: float) -> float:
+    ''' The unit sphere chord length of a great circle distance in meters '''
+    return 2 * np.sin(min(distance_m / EARTH_RADIUS_M, np.pi) / 2)
+
+
+class SpatialIndex:
+    ''' A KD-tree over a set of destination coordinates (in degrees) '''
+
+    def __init__(self, dest_lat: np.ndarray, dest_lon: np.ndarray):
+        self.num_destinations = len(dest_lat)
+        self._tree = cKDTree(to_unit_sphere(dest_lat, dest_lon))
+
+    def query_radius(
+        self, orig_lat: np.ndarray, orig_lon: np.ndarray, radius_m: float,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Finds every (origin, destination) pair within radius_m meters of each other.
+
+        Returns
+        The origin and destination positions of the pairs as two equal length arrays, ordered by origin
+        '''
+        if radius_m < 0:
+            raise ValueError(f'Invalid radius {radius_m}')
+
+        neighbors = self._tree.query_ball_point(
+            to_unit_sphere(orig_lat, orig_lon), great_circle_to_chord(radius_m), return_sorted=True,
+        )
+        counts = np.fromiter((len(dests) for dests in neighbors), dtype=np.int64, count=len(neighbors))
+
+        orig_positions = np.repeat(np.arange(len(neighbors)), counts)
+        if counts.sum():
+            dest_positions = np.concatenate([np.asarray(dests, dtype=np.int64) for dests in neighbors])
+        else:
+            dest_positions = np.empty(0, dtype=np.int64)
+
+        return orig_positions, dest_positions
+
+    def query_nearest(
+        self, orig_lat: np.ndarray, orig_lon: np.ndarray, k: int,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Finds the k nearest destinations of every origin (all of them if there are fewer than k).
+
+        Returns
+        The origin and destination positions of the pairs as two equal length arrays, ordered by origin
+        '''
+        k = min(k, self.num_destinations)
+        num_origins = len(orig_lat)
+        if k <= 0 or num_origins == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+        _, dest_positions = self._tree.query(to_unit_sphere(orig_lat, orig_lon), k=k)
+        dest_positions = np.asarray(dest_positions, dtype=np.int64).reshape(num_origins, k)
+
+        return np.repeat(np.arange(num_origins), k), dest_positions.ravel()
+
+
+def candidate_pairs(
+    orig_lat: np.ndarray,
+    orig_lon: np.ndarray,
+    dest_lat: np.ndarray,
+    dest_lon: np.ndarray,
+    dest_groups: np.ndarray=None,
+    max_distance_m: float=None,
+    nearest_k: int=DEFAULT_NEAREST_K,
+) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Selects the origin/destination pairs worth computing distances for: every pair within
+    max_distance_m of each other, plus the nearest_k destinations of each origin within every group of
+    dest_groups (e.g. the location_type of each destination).
+
+    Keeping the nearest destinations of every group guarantees that, whatever groups are later
+    filtered out, each origin still has its closest remaining destination, so minimum distance based
+    values such as alpha and the model's max_min distance are the same as for the full cross join.
+
+    Returns
+    The origin and destination positions of the selected pairs as two equal length arrays, without
+    duplicates and ordered by origin then destination
+    '''
+    num_dests = len(dest_lat)
+    dest_lat = np.asarray(dest_lat, dtype=np.float64)
+    dest_lon = np.asarray(dest_lon, dtype=np.float64)
+
+    pair_codes = []
+
+    if max_distance_m is not None:
+        orig_positions, dest_positions = SpatialIndex(dest_lat, dest_lon).query_radius(
+            orig_lat, orig_lon, max_distance_m,
+        )
+        pair_codes.append(orig_positions * num_dests + dest_positions)
+
+    if dest_groups is None:
+        dest_groups = np.zeros(num_dests, dtype=np.int64)
+    dest_groups = np.asarray(dest_groups)
+
+    for group in np.unique(dest_groups):
+        group_positions = np.flatnonzero(dest_groups == group)
+        orig_positions, dest_positions = SpatialIndex(
+            dest_lat[group_positions], dest_lon[group_positions],
+        ).query_nearest(orig_lat, orig_lon, nearest_k)
+        pair_codes.append(orig_positions * num_dests + group_positions[dest_positions])
+
+    if not pair_codes:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    pair_codes = np.unique(np.concatenate(pair_codes))
+
+    return pair_codes // num_dests, pair_codes % num_dests
@@ -0,0 +1,167 @@
+'''
+Speculative solving of Model 2 of the penalty workflow.
+
+Model 2 (the model excluding the penalized sites) only depends on Model 1 through whether it is needed
+at all: it is only used if Model 1 selects a penalized site. SpeculativeModel2 builds and solves it in
+a separate process while Model 1 solves, so that on machines with spare cores the penalty workflow
+does not have to wait for the two in turn. If Model 1 selects no penalized sites the worker is
+cancelled.
+
+Workers are not forked from this process, as its solver libraries may hold threads that do not
+survive a fork. They come from a forkserver that has already imported the solver, or are spawned
+where the platform has no forkserver. Each runs in its own process group where the platform has
+them, so that cancelling it also stops a solver it started as a subprocess. A speculative Model 2 is solved cold,
+as Model 1's solution is not known when it starts.
+'''
+
+import multiprocessing
+import os
+import signal
+import warnings
+from dataclasses import dataclass
+from multiprocessing.connection import Connection
+
+import pandas as pd
+import pyomo.environ as pyo
+
+from .array_model import get_model_factory
+from .model_config import PollingModelConfig
+from .model_solver import config_persistent_solver, config_solver_settings, solve_model
+from .pair_adjacency import PairAdjacency
+from .warm_start import WarmStart, solution_warm_start
+
+# The multiprocessing context of the worker processes
+if 'forkserver' in multiprocessing.get_all_start_methods():
+    MP_CONTEXT = multiprocessing.get_context('forkserver')
+    MP_CONTEXT.set_forkserver_preload([__name__])
+else:
+    MP_CONTEXT = multiprocessing.get_context('spawn')
+
+
+@dataclass
+class Model2Result:
+    ''' What the penalty workflow uses from a solved Model 2 '''
+
+    obj_value: float
+    ''' The objective value of Model 2 '''
+    warm_start: WarmStart
+    ''' The open sites and matching of Model 2 '''
+
+
+def solve_model2(
+    dist_df: pd.DataFrame,
+    alpha: float,
+    config: PollingModelConfig,
+    adjacency: PairAdjacency,
+    log_file_path: str=None,
+    log: bool=False,
+) -> Model2Result:
+    ''' Builds and solves Model 2, the model excluding the penalized sites '''
+    model = get_model_factory(config)(
+        distance_df=dist_df,
+        alpha=alpha,
+        config=config,
+        exclude_penalized_sites=True,
+        adjacency=adjacency,
+    )
+
+    solve_model(
+        model=model,
+        time_limit=config.time_limit,
+        limits_gap=config.limits_gap,
+        log=log,
+        log_file_path=log_file_path,
+        **config_solver_settings(config),
+        persistent_solver=config_persistent_solver(config, log),
+    )
+
+    return Model2Result(obj_value=pyo.value(model.obj), warm_start=solution_warm_start(model))
+
+
+def _worker(connection: Connection, *args):
+    if hasattr(os, 'setpgrp'):
+        os.setpgrp()
+
+    try:
+        connection.send(solve_model2(*args))
+    # pylint: disable-next=broad-exception-caught
+    except Exception as e:
+        connection.send(e)
+    finally:
+        connection.close()
+
+
+class SpeculativeModel2:
+    ''' Model 2 being solved in a separate process '''
+
+    def __init__(self, process: MP_CONTEXT.Process, connection: Connection, run_prefix: str):
+        self._process = process
+        self._connection = connection
+        self._run_prefix = run_prefix
+        self._result: Model2Result = None
+
+    @classmethod
+    def start(
+        cls,
+        dist_df: pd.DataFrame,
+        alpha: float,
+        config: PollingModelConfig,
+        adjacency: PairAdjacency,
+        run_prefix: str,
+        log_file_path: str=None,
+        log: bool=False,
+    ) -> 'SpeculativeModel2 | None':
+        '''
+        Starts solving Model 2 in a new process. Returns None, leaving Model 2 to be solved when it is
+        needed, if this process can not start one: the processes of a multiprocessing Pool, as used by
+        the run CLIs with --concurrent, are not allowed children.
+        '''
+        if multiprocessing.current_process().daemon:
+            warnings.warn(f'Can not solve Model 2 speculatively for {run_prefix} in a daemon process')
+            return None
+
+        receiver, sender = MP_CONTEXT.Pipe(duplex=False)
+        process = MP_CONTEXT.Process(
+            target=_worker,
+            args=(sender, dist_df, alpha, config, adjacency, log_file_path, log),
+            name=f'model2 {run_prefix}',
+        )
+        process.start()
+        # Only the worker writes, so that reading sees the end of the pipe if the worker dies
+        sender.close()
+
+        if log:
+            print(f'Model 2 (excludes penalized sites) started speculatively for {run_prefix}.')
+
+        return cls(process, receiver, run_prefix)
+
+    def result(self) -> Model2Result:
+        ''' Waits for Model 2 to be solved and returns its result '''
+        if self._result is None:
+            try:
+                result = self._connection.recv()
+            except EOFError as e:
+                raise ValueError(f'The Model 2 worker for {self._run_prefix} exited without a result') from e
+            finally:
+                self._connection.close()
+                self._process.join()
+
+            if isinstance(result, Exception):
+                raise result
+            self._result = result
+
+        return self._result
+
+    def cancel(self):
+        ''' Stops the worker, and any solver it started, if it is still running '''
+        if self._process.is_alive():
+            if hasattr(os, 'killpg'):
+                try:
+                    os.killpg(self._process.pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+            # In case the worker had not yet started its own process group
+            self._process.terminate()
+
+        self._process.join()
+        self._connection.close()
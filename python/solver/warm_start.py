@@ -0,0 +1,247 @@
+'''
+Warm starts for models built from the same data as an already solved model.
+
+Model 2 (penalized sites excluded) and Model 3 (penalized sites charged a penalty) of the penalty
+workflow are built from the same data as Model 1, as are the neighboring points of a parameter sweep,
+and their optimal solutions usually open most of the same sites. A WarmStart takes the open sites and
+matching of a solved model, repairs them into a feasible solution of the next model and sets it on
+that model, so the solver starts from a good incumbent instead of searching for a first one.
+
+Repairing drops the matches outside the max_min radius of the next model, closes the excluded
+sites, and the least used sites while more sites, or more new sites, are open than the next model
+allows. It then opens replacement sites up to the number of precincts to open within the new and
+old location limits, and greedily moves the unmatched residences to the nearest open site within
+the max_min radius that has capacity left. If the repair can not find a feasible solution there is
+no warm start and the solver starts cold.
+'''
+
+import math
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from .array_model import ArrayModel
+from .constants import (
+    DISTANCE_ID_ORIG, DISTANCE_ID_DEST, DISTANCE_DISTANCE_M, DISTANCE_TOTAL_POPULATION, DISTANCE_DEST_TYPE,
+    DISTANCE_DEST_TYPE_POLLING, PD_MEAN,
+)
+from .model_config import PollingModelConfig
+from .model_factory import (
+    PollingModel, get_max_population, get_old_polls, get_penalized_sites, get_precincts_open, get_total_pop,
+)
+from .pair_adjacency import PairAdjacency
+
+
+@dataclass
+class WarmStart:
+    ''' A solution of the model as the sites it opens and the site each residence is matched to '''
+
+    open_sites: set
+    ''' The id_dests of the open sites '''
+    matching: dict
+    ''' The id_dest each id_orig is matched to '''
+
+
+def solution_warm_start(model: PollingModel | ArrayModel) -> WarmStart:
+    ''' The open sites and matching of a solved model '''
+    if isinstance(model, ArrayModel):
+        return WarmStart(
+            open_sites=model.open_precincts(),
+            matching=dict(zip(*model.matched_pairs())),
+        )
+
+    return WarmStart(
+        open_sites={precinct for precinct in model.open if (model.open[precinct].value or 0) >= 0.5},
+        matching={
+            residence: precinct
+            for (residence, precinct) in model.matching
+            if (model.matching[residence, precinct].value or 0) >= 0.5
+        },
+    )
+
+
+def repair_warm_start(
+    warm_start: WarmStart,
+    distance_df: pd.DataFrame,
+    config: PollingModelConfig,
+    adjacency: PairAdjacency,
+    *,
+    exclude_penalized_sites: bool=False,
+) -> WarmStart | None:
+    '''
+    A feasible solution of the model built from distance_df with the given exclude_penalized_sites,
+    as close to warm_start as the greedy repair gets, or None if it finds none.
+    '''
+    precinct_ids = adjacency.precinct_ids
+    residence_ids = adjacency.residence_ids
+
+    old_polls = get_old_polls(distance_df)
+    precincts_open = get_precincts_open(config, distance_df, old_polls, exclude_penalized_sites)
+    max_population = get_max_population(config, get_total_pop(distance_df), precincts_open)
+
+    excluded = set(get_penalized_sites(config, distance_df)) if exclude_penalized_sites else set()
+    new_sites = set(distance_df.loc[distance_df[DISTANCE_DEST_TYPE] != DISTANCE_DEST_TYPE_POLLING, DISTANCE_ID_DEST])
+
+    population = distance_df.groupby(DISTANCE_ID_ORIG)[DISTANCE_TOTAL_POPULATION].agg(PD_MEAN)
+    population = population.reindex(residence_ids).to_numpy(dtype=np.float64)
+
+    # The pairs within max_min, as residence x precinct positions with their distances
+    pair_df = distance_df[distance_df[DISTANCE_DISTANCE_M] <= adjacency.max_min]
+    pair_residences = residence_ids.get_indexer(pair_df[DISTANCE_ID_ORIG])
+    pair_precincts = precinct_ids.get_indexer(pair_df[DISTANCE_ID_DEST])
+    pair_distances = pair_df[DISTANCE_DISTANCE_M].to_numpy(dtype=np.float64)
+
+    matched = pd.Series(warm_start.matching).reindex(residence_ids)
+    matched = precinct_ids.get_indexer(matched.to_numpy())
+    # Drop the matches outside max_min, as a sweep neighbor with a larger max_min_mult can have
+    in_radius = np.isin(
+        np.arange(len(residence_ids)) * len(precinct_ids) + matched,
+        pair_residences * len(precinct_ids) + pair_precincts,
+    )
+    matched = np.where(in_radius, matched, -1)
+    loads = np.bincount(matched[matched >= 0], weights=population[matched >= 0], minlength=len(precinct_ids))
+
+    is_open = precinct_ids.isin(list(warm_start.open_sites - excluded))
+    is_excluded = precinct_ids.isin(list(excluded))
+    is_new = precinct_ids.isin(list(new_sites))
+
+    population_nearby = np.bincount(pair_precincts, weights=population[pair_residences], minlength=len(precinct_ids))
+
+    max_new = config.maxpctnew * precincts_open
+    min_old = config.minpctold * old_polls
+
+    # Close the least used sites if there are too many open, or the least used new sites if there are
+    # too many new ones
+    while np.count_nonzero(is_open) > precincts_open or np.count_nonzero(is_open & is_new) > max_new:
+        closable = is_open & is_new if np.count_nonzero(is_open & is_new) > max_new else is_open
+        is_open[np.flatnonzero(closable)[np.argmin(loads[closable])]] = False
+
+    # Open replacement sites, preferring those near the most residences left without an open site
+    while np.count_nonzero(is_open) < precincts_open:
+        orphaned = (matched < 0) | ~is_open[np.maximum(matched, 0)]
+        candidates = ~is_open & ~is_excluded
+        if np.count_nonzero(is_open & is_new) + 1 > max_new:
+            candidates &= ~is_new
+        if np.count_nonzero(is_open & ~is_new) < min_old:
+            candidates &= ~is_new
+        if not candidates.any():
+            return None
+
+        orphaned_nearby = np.bincount(
+            pair_precincts, weights=population[pair_residences] * orphaned[pair_residences],
+            minlength=len(precinct_ids),
+        )
+        candidate_positions = np.flatnonzero(candidates)
+        best = np.lexsort((population_nearby[candidate_positions], orphaned_nearby[candidate_positions]))[-1]
+        is_open[candidate_positions[best]] = True
+
+    if np.count_nonzero(is_open & ~is_new) < min_old:
+        return None
+
+    # The open sites within max_min of each residence, nearest first, stored back to back by residence
+    open_pairs = is_open[pair_precincts]
+    pair_order = np.lexsort((pair_distances[open_pairs], pair_residences[open_pairs]))
+    choices = pair_precincts[open_pairs][pair_order]
+    choice_starts = np.searchsorted(pair_residences[open_pairs][pair_order], np.arange(len(residence_ids) + 1))
+
+    # Keep the residences whose site is still open and move the rest. If that leaves a residence with
+    # no open site with room, reassign all of them.
+    orphaned = (matched < 0) | ~is_open[np.maximum(matched, 0)]
+    matched = np.where(orphaned, -1, matched)
+    loads = np.bincount(matched[matched >= 0], weights=population[matched >= 0], minlength=len(precinct_ids))
+    if not _assign_greedily(
+        np.flatnonzero(orphaned), matched, loads, population, choices, choice_starts, max_population,
+    ):
+        matched = np.full(len(residence_ids), -1)
+        loads = np.zeros(len(precinct_ids))
+        if not _assign_greedily(
+            np.arange(len(residence_ids)), matched, loads, population, choices, choice_starts, max_population,
+        ):
+            return None
+
+    return WarmStart(
+        open_sites=set(precinct_ids[is_open]),
+        matching=dict(zip(residence_ids, precinct_ids.to_numpy()[matched])),
+    )
+
+
+def _assign_greedily(
+    residences: np.ndarray,
+    matched: np.ndarray,
+    loads: np.ndarray,
+    population: np.ndarray,
+    choices: np.ndarray,
+    choice_starts: np.ndarray,
+    max_population: float,
+) -> bool:
+    '''
+    Matches the residences to the nearest of their choices whose population stays within
+    max_population, updating matched and the population loads of the precincts in place. The
+    residences with the fewest choices go first, then the largest. Returns False if a residence is
+    left with no choice with room.
+    '''
+    num_choices = np.diff(choice_starts)
+
+    for residence in sorted(residences.tolist(), key=lambda position: (num_choices[position], -population[position])):
+        for precinct in choices[choice_starts[residence]:choice_starts[residence + 1]]:
+            if loads[precinct] + population[residence] <= max_population:
+                matched[residence] = precinct
+                loads[precinct] += population[residence]
+                break
+        else:
+            return False
+
+    return True
+
+
+def penalty_values(warm_start: WarmStart, alpha: float, beta: float, site_penalty: float, penalized_sites) -> tuple:
+    '''
+    The values of the penalty and penalty_exp variables of a penalized model for the open sites of
+    warm_start. penalty is always one of the linearization points, where exp(penalty) meets the
+    linearization of penalty_exp.
+    '''
+    penalty = -alpha * beta * site_penalty * len(warm_start.open_sites & set(penalized_sites))
+
+    return penalty, math.exp(penalty)
+
+
+def set_warm_start(
+    model: PollingModel | ArrayModel,
+    warm_start: WarmStart,
+    alpha: float,
+    config: PollingModelConfig,
+    *,
+    site_penalty: float=0,
+    penalized_sites=(),
+):
+    '''
+    Sets warm_start as the starting solution of the model, the variable values of a pyomo model or
+    the start of an ArrayModel, for solve_model with warm_start. site_penalty and penalized_sites are
+    those the model was built with.
+    '''
+    if isinstance(model, ArrayModel):
+        matched = pd.Series(warm_start.matching).reindex(model.residence_ids)
+        matched = model.precinct_ids.get_indexer(matched.to_numpy())
+
+        start = np.zeros(model.num_variables)
+        start[:model.num_pairs] = model.pair_precincts == matched[model.pair_residences]
+        start[model.open_positions] = model.precinct_ids.isin(list(warm_start.open_sites))
+        if model.num_variables > model.open_positions.stop:
+            penalty, penalty_exp = penalty_values(warm_start, alpha, config.beta, site_penalty, penalized_sites)
+            start[model.open_positions.stop:] = [penalty_exp, penalty]
+
+        model.start = start
+        return
+
+    model.open.set_values({
+        precinct: int(precinct in warm_start.open_sites) for precinct in model.precincts
+    })
+    model.matching.set_values({
+        (residence, precinct): int(warm_start.matching.get(residence) == precinct)
+        for (residence, precinct) in model.matching
+    })
+    if hasattr(model, 'penalty'):
+        penalty, penalty_exp = penalty_values(warm_start, alpha, config.beta, site_penalty, penalized_sites)
+        model.penalty.set_value(penalty)
+        model.penalty_exp.set_value(penalty_exp)
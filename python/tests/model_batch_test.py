@@ -0,0 +1,31 @@
+''' Tests for model_batch. '''
+
+import dataclasses
+from functools import partial
+import os
+import sys
+
+import pytest
+
+from python.solver import model_batch
+from python.solver.model_run import SharedData
+
+
+def _run_or_fail(config, directory: str):
+    with open(os.path.join(directory, config.config_name), 'w', encoding='utf-8'):
+        pass
+    sys.exit(int(config.location == 'Failing_Location'))
+
+
+def test_run_scheduled_failures(monkeypatch, tmp_path, testing_config_base):
+    #a failed run does not stop the locations after it, and every failure is reported once at the end
+    monkeypatch.setattr(model_batch, 'load_shared_data', lambda *args: SharedData(context=None, memory=0))
+    monkeypatch.setattr(model_batch, 'estimate_peak_memory', lambda item: 1)
+
+    work = [
+        dataclasses.replace(testing_config_base, location=location, config_name=f'{location}_{i}')
+        for i, location in enumerate(['Failing_Location', 'Other_Location', 'Failing_Location'])
+    ]
+    with pytest.raises(ValueError, match='2 of 3 runs failed'):
+        model_batch.run_scheduled(partial(_run_or_fail, directory=str(tmp_path)), work, 1, 2)
+    assert sorted(os.listdir(tmp_path)) == sorted(config.config_name for config in work)
@@ -4,10 +4,13 @@
 
 from itertools import product
 
+from haversine import haversine
+import numpy as np
 import pandas as pd
 import pytest
 
 from python.solver import model_data
+from python.solver.distance_matrix import DistanceMatrix, ORIGIN_COLS, DESTINATION_COLS
 
 from .constants import TESTING_POTENTIAL_LOCATIONS_PATH, TESTING_DRIVING_DISTANCES_PATH, TEST_LOCATION, MAP_SOURCE_DATE
 
@@ -162,3 +165,134 @@ def test_clean_data(testing_config_driving, location_df_with_driving):
     cleaned_data_with_alpha_dest_types = cleaned_data_with_alpha_df['dest_type'].unique().tolist()
     assert cleaned_data_with_alpha_dest_types == ['polling']
 
+
+
+def test_haversine_distances():
+    ''' Checks the vectorized haversine distances against the haversine package, with and without chunking. '''
+    rng = np.random.default_rng(0)
+    orig_lat = rng.uniform(30, 36, 1000)
+    orig_lon = rng.uniform(-86, -80, 1000)
+    dest_lat = rng.uniform(30, 36, 1000)
+    dest_lon = rng.uniform(-86, -80, 1000)
+
+    expected = np.array([
+        haversine((o_lat, o_lon), (d_lat, d_lon)) * 1000
+        for o_lat, o_lon, d_lat, d_lon in zip(orig_lat, orig_lon, dest_lat, dest_lon)
+    ])
+
+    actual = model_data.haversine_distances(orig_lat, orig_lon, dest_lat, dest_lon)
+    chunked = model_data.haversine_distances(orig_lat, orig_lon, dest_lat, dest_lon, chunk_size=77)
+
+    np.testing.assert_allclose(actual, expected, rtol=1e-12)
+    np.testing.assert_array_equal(actual, chunked)
+
+
+def test_haversine_matrix():
+    ''' Checks that haversine_matrix matches haversine_distances on the cross join of origins and destinations. '''
+    rng = np.random.default_rng(1)
+    orig_lat = rng.uniform(30, 36, 40)
+    orig_lon = rng.uniform(-86, -80, 40)
+    dest_lat = rng.uniform(30, 36, 7)
+    dest_lon = rng.uniform(-86, -80, 7)
+
+    expected = model_data.haversine_distances(
+        np.repeat(orig_lat, 7), np.repeat(orig_lon, 7), np.tile(dest_lat, 40), np.tile(dest_lon, 40),
+    ).reshape(40, 7)
+
+    np.testing.assert_array_equal(model_data.haversine_matrix(orig_lat, orig_lon, dest_lat, dest_lon), expected)
+    np.testing.assert_array_equal(model_data.haversine_matrix(orig_lat, orig_lon, dest_lat, dest_lon, chunk_size=20), expected)
+
+
+def test_distance_matrix(testing_config_base, polling_locations_df):
+    ''' Checks that the DistanceMatrix holds the same data and gives the same alpha as the long form distance data. '''
+    distance_matrix = DistanceMatrix.from_distance_df(polling_locations_df, dtype=np.float64)
+
+    expected_df = polling_locations_df.sort_values(['id_orig', 'id_dest']).reset_index(drop=True)
+    pd.testing.assert_frame_equal(distance_matrix.to_distance_df(), expected_df, check_dtype=False)
+
+    alpha_df = model_data.filter_distance_data(testing_config_base, polling_locations_df, True, False)
+    alpha_matrix = DistanceMatrix.from_distance_df(alpha_df, dtype=np.float64)
+    assert model_data.alpha_min(alpha_matrix) == model_data.alpha_min(alpha_df)
+
+    chunked_df = pd.concat(distance_matrix.iter_distance_df(7, include_missing=True))
+    pd.testing.assert_frame_equal(chunked_df, distance_matrix.to_distance_df(include_missing=True))
+
+
+def test_filter_distance_matrix(testing_config_base, polling_locations_df):
+    ''' Checks that the DistanceMatrix a model is run on holds the same data as filter_distance_data returns. '''
+    distance_matrix = model_data.distance_matrix_data(
+        model_data.DistanceData(distance_df=polling_locations_df),
+    ).distance_matrix
+    pd.testing.assert_frame_equal(distance_matrix.to_distance_df(), polling_locations_df.reset_index(drop=True))
+
+    clean_df = model_data.filter_distance_data(testing_config_base, polling_locations_df, False, False)
+    clean_df = clean_df.reset_index(drop=True)
+    clean_matrix = model_data.filter_distance_matrix(testing_config_base, distance_matrix, False, False)
+    dist_df = model_data.model_distance_df(clean_matrix)
+    pd.testing.assert_frame_equal(dist_df, clean_df[dist_df.columns])
+    pd.testing.assert_frame_equal(clean_matrix.expand_pairs(dist_df), clean_df)
+
+    alpha_df = model_data.filter_distance_data(testing_config_base, polling_locations_df, True, False)
+    alpha_matrix = model_data.filter_distance_matrix(testing_config_base, distance_matrix, True, False)
+    assert model_data.alpha_min(alpha_matrix) == model_data.alpha_min(alpha_df)
+
+
+def test_distance_data_parquet(tmp_path, polling_locations_df):
+    ''' Checks that distance data written to the parquet cache reads back unchanged, and with column projection. '''
+    parquet_path = tmp_path / 'distances.parquet'
+    model_data.write_distance_data_parquet(polling_locations_df, parquet_path)
+
+    pd.testing.assert_frame_equal(model_data.load_distance_data_parquet(parquet_path), polling_locations_df)
+
+    columns = ['id_orig', 'id_dest', 'distance_m']
+    pd.testing.assert_frame_equal(
+        model_data.load_distance_data_parquet(parquet_path, columns=columns),
+        polling_locations_df[columns],
+    )
+
+
+def test_preload_distance_data(monkeypatch, testing_config_base, polling_locations_df):
+    ''' Checks that preloaded distance data is returned without loading it again, and is not changed by filtering. '''
+    monkeypatch.setattr(model_data, 'PRELOADED_DISTANCE_DATA', {})
+    config = testing_config_base
+    original_df = polling_locations_df.copy()
+
+    model_data.preload_distance_data(
+        model_data.DistanceData(distance_df=polling_locations_df),
+        census_year='not_a_census_year', location=config.location, log_distance=False, driving=False,
+    )
+    distance_data = model_data.get_distance_data(
+        data_source='csv', census_year='not_a_census_year', location=config.location, log_distance=False, driving=False,
+    )
+    assert distance_data.distance_df is polling_locations_df
+
+    columns = ['id_orig', 'id_dest', 'distance_m']
+    projected = model_data.get_distance_data(
+        data_source='csv', census_year='not_a_census_year', location=config.location, log_distance=False, driving=False,
+        columns=columns,
+    )
+    pd.testing.assert_frame_equal(projected.distance_df, polling_locations_df[columns])
+
+    model_data.filter_distance_data(config, distance_data.distance_df, False, False)
+    model_data.filter_distance_data(config, distance_data.distance_df, True, False)
+    pd.testing.assert_frame_equal(polling_locations_df, original_df)
+
+
+def test_build_candidate_distance_df(testing_config_base, polling_locations_df):
+    ''' Checks that the sparse candidate pairs keep every pair within the radius and give the same alpha as the full data. '''
+    origins_df = polling_locations_df[['id_orig', *ORIGIN_COLS]].drop_duplicates('id_orig')
+    destinations_df = polling_locations_df[['id_dest', *DESTINATION_COLS]].drop_duplicates('id_dest')
+    max_distance_m = 2000
+
+    candidate_df = model_data.build_candidate_distance_df(origins_df, destinations_df, max_distance_m=max_distance_m)
+
+    assert candidate_df.columns.tolist() == polling_locations_df.columns.tolist()
+    assert len(candidate_df) < len(polling_locations_df)
+
+    within_radius_df = polling_locations_df[polling_locations_df['distance_m'] <= max_distance_m]
+    candidate_pairs = set(zip(candidate_df['id_orig'], candidate_df['id_dest']))
+    assert set(zip(within_radius_df['id_orig'], within_radius_df['id_dest'])) <= candidate_pairs
+
+    alpha_df = model_data.filter_distance_data(testing_config_base, polling_locations_df, True, False)
+    candidate_alpha_df = model_data.filter_distance_data(testing_config_base, candidate_df, True, False)
+    assert model_data.alpha_min(candidate_alpha_df) == pytest.approx(model_data.alpha_min(alpha_df))
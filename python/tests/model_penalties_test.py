@@ -2,14 +2,18 @@
 
 # pylint: disable=protected-access,function-redefined
 
+import dataclasses
+
 import pandas as pd
 import pyomo.environ as pyo
+import pytest
 
 from python.solver.model_run import ModelRun
 from python.solver import model_solver
 from python.solver import model_penalties
 from python.solver.model_penalties import PenalizeModel
 from python.solver.model_results import incorporate_result
+from python.solver.warm_start import repair_warm_start, solution_warm_start
 
 
 def test_penalty_selection_false(testing_config_penalty_unused):
@@ -115,3 +119,48 @@ def test_final_statistics(testing_config_penalty):
     assert round(penalty_model.kp1, 2) == 5723.48
     assert round(penalty_model.kp2, 2) == 6339.56
     assert round(penalty_model.penalty, 2) == 308.04
+
+
+def test_warm_start(testing_config_penalty):
+    #the warm started penalty models give the same kp values as cold started ones
+    warm_model = ModelRun(testing_config_penalty)._penalize_model
+    warm_model.run()
+    cold_model = ModelRun(dataclasses.replace(testing_config_penalty, warm_start=False))._penalize_model
+    cold_model.run()
+    assert round(warm_model.kp2, 2) == round(cold_model.kp2, 2)
+    assert round(warm_model.kp_pen, 2) == round(cold_model.kp_pen, 2)
+
+    #the model 1 solution repaired for model 2 closes the penalized sites and matches every residence
+    run_setup = warm_model._run_setup
+    repaired = repair_warm_start(
+        solution_warm_start(run_setup.ea_model), run_setup.dist_df, run_setup.config, run_setup.adjacency,
+        exclude_penalized_sites=True,
+    )
+    assert not repaired.open_sites & warm_model.penalized_sites
+    assert set(repaired.matching) == set(run_setup.dist_df.id_orig)
+
+
+def test_speculative_model2(testing_config_penalty):
+    #solving model 2 alongside model 1 gives the same kp values as solving it afterwards
+    sequential_model = ModelRun(testing_config_penalty)._penalize_model
+    sequential_model.run()
+    speculative_run = ModelRun(dataclasses.replace(testing_config_penalty, speculative_penalty=True))
+    speculative_model = speculative_run._penalize_model
+    speculative_model.run()
+    assert speculative_run._speculative_model2 is not None
+    assert round(speculative_model.kp2, 2) == round(sequential_model.kp2, 2)
+    assert round(speculative_model.kp_pen, 2) == round(sequential_model.kp_pen, 2)
+
+
+def test_speculative_model2_cancel(monkeypatch, testing_config_penalty):
+    #model 2 is stopped if model 1 fails to solve
+    speculative_run = ModelRun(dataclasses.replace(testing_config_penalty, speculative_penalty=True))
+    speculative_model2 = speculative_run._speculative_model2
+
+    def failed_solve(**kwargs):
+        raise ValueError('model 1 failed')
+
+    monkeypatch.setattr('python.solver.model_run.solve_model', failed_solve)
+    with pytest.raises(ValueError, match='model 1 failed'):
+        _ = speculative_run.result_df
+    assert not speculative_model2._process.is_alive()
@@ -3,14 +3,27 @@ and checks that the resulta are consistent. As such, this is a point check only,
 
 # pylint: disable=redefined-outer-name
 
+import dataclasses
+import math
 import logging
 
 import numpy as np
 import pandas as pd
+import pyomo.environ as pyo
+import pytest
 import os
 
-from python.solver import model_factory
-from python.solver.model_run import ModelRun
+from python.solver import model_data, model_factory, model_results, model_solver
+from python.solver.array_model import array_model_factory
+from python.solver.persistent_solver import get_persistent_solver
+from python.solver.solver_backends import get_solver_backend
+from python.solver.distance_matrix import DistanceMatrix, ORIGIN_COLS, DESTINATION_COLS
+from python.solver.pair_adjacency import PairAdjacency
+from python.solver.model_estimate import estimate_model_memory, estimate_model_size, model_dimensions
+from python.solver.model_run import ModelRun, location_work_groups, shared_data_context
+from python.solver.model_sweep import ModelSweep, group_sweep_configs, in_memory_config, sweep_run_setup
+from python.solver.run_setup import RunSetup
+from python.solver.site_evaluator import SiteEvaluator
 from python.tests.constants import TEST_KP_FACTOR, TESTING_RESULTS_DIR, TESTING_CONFIG_BASE
 
 pd.set_option('display.max_columns', None)
@@ -55,6 +68,232 @@ def test_kp_factor(alpha_min, clean_distances_df, testing_config_base):
     assert compare.kp_factor_x.equals(compare.kp_factor_y)
 
 
+def test_sparse_pairs(alpha_min, clean_distances_df, testing_config_base):
+    #the sparse model only has the pairs within the radius, and the same radius sets as the full model
+    sparse_config = dataclasses.replace(testing_config_base, sparse_pairs=True)
+    full_model = model_factory.polling_model_factory(clean_distances_df.copy(), alpha_min, testing_config_base)
+    sparse_model = model_factory.polling_model_factory(clean_distances_df.copy(), alpha_min, sparse_config)
+
+    within_radius = {
+        (res, prec) for res in full_model.residences for prec in full_model.within_residence_radius[res]
+    }
+    assert set(sparse_model.pairs) == within_radius
+    assert len(sparse_model.matching) == len(within_radius)
+    for res in full_model.residences:
+        assert set(sparse_model.within_residence_radius[res]) == set(full_model.within_residence_radius[res])
+    for prec in full_model.precincts:
+        assert set(sparse_model.within_precinct_radius[prec]) == set(full_model.within_precinct_radius[prec])
+
+
+def test_pair_adjacency(clean_distances_df, testing_config_base):
+    #the adjacency matches the pairs within max_min, whether built from the long or matrix form
+    max_min = model_factory.get_max_min(testing_config_base, clean_distances_df)
+    adjacency = model_factory.build_pair_adjacency(testing_config_base, clean_distances_df)
+
+    within_df = clean_distances_df[clean_distances_df.distance_m <= max_min]
+    assert set(adjacency.pairs()) == set(zip(within_df.id_orig, within_df.id_dest))
+
+    matrix_adjacency = PairAdjacency.from_distance_matrix(
+        DistanceMatrix.from_distance_df(clean_distances_df, dtype=np.float64), max_min,
+    )
+    assert set(matrix_adjacency.pairs()) == set(adjacency.pairs())
+
+
+def test_array_model(polling_model, alpha_min, clean_distances_df, testing_config_base):
+    #the array model written to MPS has the same optimal objective as the pyomo model
+    array_model = array_model_factory(clean_distances_df.copy(), alpha_min, testing_config_base)
+    model_solver.solve_model(array_model, testing_config_base.time_limit, limits_gap=0.0)
+
+    assert array_model.obj == pytest.approx(pyo.value(polling_model.obj))
+    assert len(array_model.open_precincts()) == testing_config_base.precincts_open
+
+    matching_df = array_model.matching_df()
+    assert (matching_df.matching.round().groupby(matching_df.id_orig).sum() == 1).all()
+
+    #the result rows are the rows of the distance data of the matched pairs, one for each residence
+    result_df = model_results.incorporate_result(clean_distances_df, array_model, log_distance=False)
+    matched = matching_df[matching_df.matching >= 0.5]
+    assert set(zip(result_df.id_orig, result_df.id_dest)) == set(zip(matched.id_orig, matched.id_dest))
+    assert result_df.id_orig.is_unique and set(result_df.id_orig) == set(clean_distances_df.id_orig)
+    pd.testing.assert_frame_equal(
+        result_df.drop(columns='matching').reset_index(drop=True),
+        clean_distances_df.iloc[result_df.index].reset_index(drop=True),
+    )
+
+
+def test_site_evaluator(alpha_min, clean_distances_df, testing_config_base):
+    #the optimal assignment to the open sites of the solved model is the model's own
+    array_model = array_model_factory(clean_distances_df.copy(), alpha_min, testing_config_base)
+    model_solver.solve_model(array_model, testing_config_base.time_limit, limits_gap=0.0)
+    open_sites = sorted(array_model.open_precincts())
+
+    evaluator = SiteEvaluator(clean_distances_df.copy(), alpha_min, testing_config_base)
+    assignment = evaluator.assign(open_sites)
+    assert assignment.objective == pytest.approx(array_model.obj)
+
+    result_df = evaluator.result_df(open_sites)
+    assert set(result_df.id_dest) <= set(open_sites)
+    assert result_df.id_orig.is_unique and set(result_df.id_orig) == set(clean_distances_df.id_orig)
+
+    with pytest.raises(ValueError, match='not in the distance data'):
+        evaluator.assign(['not a site'])
+
+
+def test_heuristic_solver(alpha_min, clean_distances_df, testing_config_base):
+    #the heuristic's solution is feasible, no better than the optimum and no worse than its bound
+    array_model = array_model_factory(clean_distances_df.copy(), alpha_min, testing_config_base)
+    model_solver.solve_model(array_model, testing_config_base.time_limit, limits_gap=0.0)
+
+    heuristic_model = array_model_factory(clean_distances_df.copy(), alpha_min, testing_config_base)
+    solution = model_solver.solve_model(
+        heuristic_model, testing_config_base.time_limit, limits_gap=0.0, solver='heuristic',
+    )
+    assert solution.objective == pytest.approx(heuristic_model.obj)
+    assert solution.bound - 1e-6 <= array_model.obj <= solution.objective + 1e-6
+    assert len(heuristic_model.open_precincts()) == heuristic_model.sites.precincts_open
+
+    lower, upper = heuristic_model.row_bounds()
+    activity = heuristic_model.constraints @ heuristic_model.solution
+    assert (activity >= lower - 1e-6).all() and (activity <= upper + 1e-6).all()
+
+    #started from the optimum, the heuristic stays there, up to the rounding of the assignment within capacity
+    optimum = array_model.obj
+    array_model.start = array_model.solution
+    model_solver.solve_model(
+        array_model, testing_config_base.time_limit, limits_gap=0.0, solver='heuristic', warm_start=True,
+    )
+    assert array_model.obj == pytest.approx(optimum, rel=1e-3)
+
+    with pytest.raises(ValueError, match='only solves ArrayModels'):
+        get_solver_backend('heuristic').solve(None, {})
+
+
+def test_pruned_distance_data(monkeypatch, polling_locations_df, clean_distances_df, testing_config_base):
+    #a run on distance data pruned to the max_min radius gives the same result as on the full data
+    origins_df = polling_locations_df[['id_orig', *ORIGIN_COLS]].drop_duplicates('id_orig')
+    destinations_df = polling_locations_df[['id_dest', *DESTINATION_COLS]].drop_duplicates('id_dest')
+    max_min = model_factory.get_max_min(testing_config_base, clean_distances_df)
+    pruned_df = model_data.build_candidate_distance_df(origins_df, destinations_df, max_distance_m=max_min)
+    assert len(pruned_df) < len(polling_locations_df)
+
+    expected = ModelRun(testing_config_base).result_df
+
+    monkeypatch.setattr(model_data, 'PRELOADED_DISTANCE_DATA', {})
+    model_data.preload_distance_data(
+        model_data.DistanceData(distance_df=pruned_df),
+        census_year=testing_config_base.census_year,
+        location=testing_config_base.location,
+        log_distance=testing_config_base.log_distance,
+        driving=testing_config_base.driving,
+    )
+    pruned_run = ModelRun(testing_config_base)
+    assert pruned_run.distance_data.distance_matrix.pairs.sum() == len(pruned_df)
+    assert pruned_run.result_df['weighted_dist'].sum() == pytest.approx(expected['weighted_dist'].sum())
+
+
+def test_persistent_solver(polling_model, alpha_min, clean_distances_df, testing_config_base):
+    #the in-memory solver finds the same optimum, and updates the loaded model for model 2
+    persistent_solver = get_persistent_solver('scip')
+    array_model = array_model_factory(clean_distances_df.copy(), alpha_min, testing_config_base)
+    model_solver.solve_model(
+        array_model, testing_config_base.time_limit, limits_gap=0.0, persistent_solver=persistent_solver,
+    )
+    assert array_model.obj == pytest.approx(pyo.value(polling_model.obj))
+
+    exclusions_model = array_model_factory(
+        clean_distances_df.copy(), alpha_min, testing_config_base, exclude_penalized_sites=True,
+    )
+    model_solver.solve_model(
+        exclusions_model, testing_config_base.time_limit, limits_gap=0.0, persistent_solver=persistent_solver,
+    )
+    assert (persistent_solver.num_loads, persistent_solver.num_updates) == (1, 1)
+    assert exclusions_model.obj >= array_model.obj - 1e-6
+
+    with pytest.raises(ValueError):
+        get_persistent_solver('cbc')
+
+
+def test_model_sweep(alpha_min, clean_distances_df, testing_config_base):
+    #configs that share their data are grouped and ordered by the swept field
+    configs = [
+        dataclasses.replace(testing_config_base, config_name=f'sweep_{capacity}', capacity=capacity, array_model=True)
+        for capacity in (1.8, 1.2, 1.5)
+    ]
+    other_location = dataclasses.replace(testing_config_base, location='other_location')
+    groups = group_sweep_configs(configs + [other_location])
+    assert [[config.capacity for config in group] for group in groups] == [[1.2, 1.5, 1.8], [other_location.capacity]]
+    with pytest.raises(ValueError):
+        ModelSweep(configs + [other_location])
+
+    #sweeps run as in memory array models unless asked not to, for the solvers that have them
+    pyomo_config = dataclasses.replace(configs[0], array_model=False)
+    assert in_memory_config(pyomo_config).array_model and in_memory_config(pyomo_config).solver_in_memory
+    assert not in_memory_config(dataclasses.replace(pyomo_config, solver='cbc')).array_model
+    assert all(config.solver_in_memory for config in ModelSweep(configs).configs)
+    assert not any(config.solver_in_memory for config in ModelSweep(configs, in_memory=False).configs)
+
+    #a sweep point gets the same model as one built from scratch, sharing the adjacency
+    dist_df = clean_distances_df.copy()
+    adjacency = model_factory.build_pair_adjacency(configs[0], dist_df)
+    run_setup = RunSetup(
+        distance_data_set_id=None,
+        distance_matrix=DistanceMatrix.from_distance_df(clean_distances_df, dtype=np.float64, sort=False),
+        dist_df=dist_df,
+        alpha=alpha_min,
+        adjacency=adjacency,
+        ea_model=array_model_factory(dist_df, alpha_min, configs[0], adjacency=adjacency),
+        run_prefix='sweep',
+        config=configs[0],
+    )
+    swept = sweep_run_setup(run_setup, configs[1])
+    expected = array_model_factory(clean_distances_df.copy(), alpha_min, configs[1])
+    assert swept.adjacency is adjacency
+    assert swept.ea_model.same_constraints(expected)
+    assert np.array_equal(swept.ea_model.rhs, expected.rhs)
+    assert np.allclose(swept.ea_model.objective, expected.objective)
+
+    wider = dataclasses.replace(configs[1], max_min_mult=configs[1].max_min_mult + 1)
+    assert sweep_run_setup(run_setup, wider).adjacency.max_min > adjacency.max_min
+    with pytest.raises(ValueError):
+        sweep_run_setup(run_setup, other_location)
+
+
+def test_model_estimate(clean_distances_df, alpha_min, testing_config_base):
+    #the model dimensions are those of the model built from the data, and sparse models are estimated smaller
+    dimensions = model_dimensions(testing_config_base, clean_distances_df)
+    adjacency = model_factory.build_pair_adjacency(testing_config_base, clean_distances_df)
+    assert dimensions.origins == len(adjacency.residence_ids)
+    assert dimensions.destinations == len(adjacency.precinct_ids)
+    assert dimensions.pairs == adjacency.num_pairs
+
+    sparse_config = dataclasses.replace(testing_config_base, sparse_pairs=True)
+    assert estimate_model_memory(sparse_config, dimensions) <= estimate_model_memory(testing_config_base, dimensions)
+
+    #the estimated size is that of the model built
+    array_config = dataclasses.replace(testing_config_base, array_model=True)
+    estimate = estimate_model_size(array_config, dimensions)
+    array_model = array_model_factory(clean_distances_df.copy(), alpha_min, array_config)
+    assert estimate.variables == array_model.num_variables
+    assert estimate.constraints == array_model.constraints.shape[0]
+    assert estimate.nonzeros == array_model.constraints.nnz
+
+
+def test_shared_data_context(testing_config_base):
+    #the work is grouped by location, and a location's data is only held while its runs are in progress
+    other_location = dataclasses.replace(testing_config_base, location='Other_Location')
+    work = [testing_config_base, other_location, [testing_config_base, testing_config_base]]
+    assert location_work_groups(work) == [[work[0], work[2]], [other_location]]
+
+    key = model_data.distance_data_key(
+        testing_config_base.census_year, testing_config_base.location, testing_config_base.log_distance,
+        testing_config_base.driving,
+    )
+    with shared_data_context([testing_config_base]) as shared_data:
+        assert key in model_data.PRELOADED_DISTANCE_DATA
+        assert shared_data.memory > 0
+    assert key not in model_data.PRELOADED_DISTANCE_DATA
+
+
 # #test model constraints
 def test_open_constraint(open_precincts, testing_config_base):
     #number of open precincts as described in config
@@ -158,6 +397,37 @@ def test_residence_dist_df(testing_config_base):
 
     pd.testing.assert_frame_equal(left=test_residence_dist_data, right=file_residence_dist_data, check_exact=True)
 
+def test_demographic_sums():
+    #the sums of every demographic group are those of its own population and weighted distance
+    result_df = pd.DataFrame({
+        'id_orig': ['a', 'b', 'c'],
+        'id_dest': ['x', 'x', 'y'],
+        'distance_m': [1.0, 2.0, 4.0],
+        **{group: [1, 2, 3] for group in model_results.DEMOGRAPHIC_GROUPS},
+    })
+    result_df['black'] = [0, 5, 1]
+
+    sums = model_results.demographic_sums(result_df, 'id_dest')
+    assert list(sums.index.names) == ['id_dest', 'demographic']
+    assert sums.loc[('x', 'black')].tolist() == [10.0, 5]
+    assert sums.loc[('x', 'white')].tolist() == [5.0, 3]
+    assert sums.loc[('y', 'population')].tolist() == [12.0, 3]
+
+def test_kp_scores():
+    #the kp score is the equally distributed equivalent distance, and does not overflow for large kappa * distance
+    df = pd.DataFrame({'population': [1, 3], 'distance_m': [100.0, 200.0]})
+    expected = -math.log((math.exp(0.01 * 100) + 3 * math.exp(0.01 * 200)) / 4) / -0.01
+    assert model_results.compute_kp_score(df, -1, alpha=0.01) == pytest.approx(expected)
+    assert model_results.compute_kp_score(df, 0) == pytest.approx(175.0)
+    assert model_results.compute_kp_score(df * [1, 1000], -10, alpha=0.01) == pytest.approx(200000, rel=1e-3)
+
+    #a score for every beta and assignment at once
+    distances = np.array([[100.0, 200.0], [50.0, 50.0]])
+    scores = model_results.compute_kp_scores(df.population, distances, np.array([0, -1]), 0.01)
+    assert scores.shape == (2, 2)
+    assert scores[0].tolist() == pytest.approx([175.0, 50.0])
+    assert scores[1].tolist() == pytest.approx([expected, 50.0])
+
 def test_ede_df(testing_config_base):
     #test that the ede_df is correct
     model_run = ModelRun(testing_config_base)
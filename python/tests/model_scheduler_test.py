@@ -0,0 +1,57 @@
+''' Tests for model_scheduler. '''
+
+from functools import partial
+import sys
+import time
+
+import pytest
+
+from python.solver.model_scheduler import JobGroup, MemoryScheduler, ScheduledJob
+
+
+def _scheduled_job(exit_code: int, seconds: float=0):
+    time.sleep(seconds)
+    sys.exit(exit_code)
+
+
+def test_memory_scheduler():
+    #the largest jobs that fit in what is left of the budget start first, a job larger than the budget runs alone
+    scheduler = MemoryScheduler(memory_budget=10, max_processes=2)
+    pending = [ScheduledJob(str(memory), (0,), memory) for memory in (12, 6, 5, 4)]
+    assert scheduler.next_job(pending, 0, 0).memory == 6
+    assert scheduler.next_job(pending, 6, 1).memory == 4
+    assert scheduler.next_job(pending, 10, 2) is None
+    assert scheduler.next_job(pending, 6, 1).memory == 4
+    assert scheduler.next_job(pending[:1], 0, 0).memory == 12
+    assert scheduler.next_job(pending[:1], 6, 1) is None
+
+    #every job runs, and failed jobs are reported once all have finished
+    finished = []
+    with pytest.raises(ValueError, match='1 of 4 runs failed: 5'):
+        for job in scheduler.run(_scheduled_job, [
+            ScheduledJob(str(memory), (int(memory == 5),), memory) for memory in (12, 6, 5, 4)
+        ]):
+            finished.append(job.name)
+    assert sorted(finished) == ['12', '4', '5', '6']
+
+
+def test_memory_scheduler_groups():
+    #the next group is taken while the jobs of the group before run, and each group is released after its last job
+    events = []
+
+    def groups():
+        for name, seconds in [('a', 0.5), ('b', 0)]:
+            events.append(f'load {name}')
+            release = partial(events.append, f'release {name}')
+            yield JobGroup(jobs=[ScheduledJob(name, (0, seconds), 1)], memory=1, release=release)
+
+    scheduler = MemoryScheduler(memory_budget=None, max_processes=2)
+    finished = [job.name for job in scheduler.run_groups(_scheduled_job, groups())]
+    assert finished == ['b', 'a']
+    assert events == ['load a', 'load b', 'release b', 'release a']
+
+    #a budget used up by the group running holds the next one back
+    events.clear()
+    scheduler = MemoryScheduler(memory_budget=2, max_processes=2)
+    assert [job.name for job in scheduler.run_groups(_scheduled_job, groups())] == ['a', 'b']
+    assert events == ['load a', 'release a', 'load b', 'release b']
@@ -0,0 +1,43 @@
+''' Tests for run_manifest. '''
+
+# pylint: disable=redefined-outer-name
+
+import dataclasses
+import os
+
+from python.solver import run_manifest
+
+
+def test_run_manifest(monkeypatch, tmp_path, testing_config_base):
+    #a run is complete once marked, until its result files change, and the hash follows the config and the data
+    distance_path = tmp_path / 'distances.csv'
+    distance_path.write_text('id_orig,id_dest\n')
+    monkeypatch.setattr(run_manifest, 'build_distance_file_path', lambda *args, **kwargs: str(distance_path))
+
+    key = run_manifest.run_hash(testing_config_base, 'csv')
+    assert key == run_manifest.run_hash(dataclasses.replace(testing_config_base), 'csv')
+    assert key != run_manifest.run_hash(testing_config_base, 'db')
+    other_capacity = dataclasses.replace(testing_config_base, capacity=testing_config_base.capacity + 1)
+    assert key != run_manifest.run_hash(other_capacity, 'csv')
+
+    result_path = tmp_path / 'results.csv'
+    result_path.write_text('result\n')
+    manifest = run_manifest.RunManifest(str(tmp_path / 'manifest'))
+    assert not manifest.is_complete(key)
+    manifest.mark_complete(key, testing_config_base, 'csv', [str(result_path)])
+    assert manifest.is_complete(key)
+    assert not manifest.incomplete_configs([testing_config_base], 'csv')
+
+    result_path.write_text('result\nchanged\n')
+    assert not manifest.is_complete(key)
+
+    #a result file written again to the same size is changed too
+    manifest.mark_complete(key, testing_config_base, 'csv', [str(result_path)])
+    assert manifest.is_complete(key)
+    result_path.write_text('result\nchanges\n')
+    stat = os.stat(result_path)
+    os.utime(result_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert not manifest.is_complete(key)
+
+    distance_path.write_text('id_orig,id_dest\nchanged\n')
+    assert run_manifest.run_hash(testing_config_base, 'csv') != key
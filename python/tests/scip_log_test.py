@@ -0,0 +1,75 @@
+''' Tests for scip_log. '''
+
+# pylint: disable=line-too-long
+
+import numpy as np
+import pytest
+
+from python.solver.scip_log import model_run_solver_columns, parse_scip_log
+
+
+SCIP_LOG = """presolving:
+presolving (1 rounds: 1 fast, 1 medium, 1 exhaustive):
+ 0 deleted vars, 1 deleted constraints, 0 added constraints, 0 tightened bounds, 0 added holes, 20 changed sides, 0 changed coefficients
+presolved problem has 120 variables (120 bin, 0 int, 0 cont) and 131 constraints
+
+ time | node  | left  |LP iter|LP it/n|mem/heur|mdpt |vars |cons |rows |cuts |sepa|confs|strbr|  dualbound   | primalbound  |  gap   | compl.
+p 0.1s|     1 |     0 |     0 |     - |  clique|   0 | 120 | 131 | 131 |   0 |  0 |   0 |   0 | 0.000000e+00 | 2.984086e+00 |    Inf | unknown
+* 4.6s|     1 |     0 |  5942 |     - |    LP  |   0 | 120 | 131 | 131 |   0 |  0 |   0 |   0 | 2.014065e+00 | 2.014065e+00 |   0.00%| unknown
+
+SCIP Status        : problem is solved [optimal solution found]
+Solving Time (sec) : 4.60
+Solving Nodes      : 1
+Primal Bound       : +2.01406472488816e+00 (2 solutions)
+Dual Bound         : +2.01406472488816e+00
+Gap                : 0.00 %
+1/1 feasible solution given by solution candidate storage, new primal bound 2.500000e+00
+
+presolving:
+presolving (0 rounds: 0 fast, 0 medium, 0 exhaustive):
+ 0 deleted vars, 0 deleted constraints, 0 added constraints, 0 tightened bounds, 0 added holes, 0 changed sides, 0 changed coefficients
+ time | node  | left  |LP iter|LP it/n|mem/heur|mdpt |vars |cons |rows |cuts |sepa|confs|strbr|  dualbound   | primalbound  |  gap   | compl.
+  1.0m|   212 |    40 |  9120 |  42.1 |    90M |  12 | 120 | 131 | 131 |   0 |  0 |   2 |   0 | 2.100000e+00 | 2.500000e+00 |  19.05%| 10.00%
+
+SCIP Status        : solving was interrupted [time limit reached]
+Solving Time (sec) : 60.00
+Solving Nodes      : 212 (total of 250 nodes in 2 runs)
+Primal Bound       : +2.50000000000000e+00 (1 solutions)
+Dual Bound         : +2.10000000000000e+00
+Gap                : 19.05 %
+"""
+
+
+def test_parse_scip_log():
+    #only the last solve of a log is read
+    metrics = parse_scip_log(SCIP_LOG)
+    assert metrics.status == 'time limit reached'
+    assert metrics.hit_time_limit
+    assert metrics.solving_time == 60
+    assert metrics.nodes == 250
+    assert metrics.primal_bound == 2.5
+    assert metrics.dual_bound == 2.1
+    assert metrics.gap == pytest.approx(0.1905)
+    assert metrics.first_incumbent_time == 0
+    assert metrics.presolve_rounds == 0
+    assert [(point.time, point.nodes, point.gap) for point in metrics.trajectory] == [(60, 212, pytest.approx(0.1905))]
+
+    #the first solve, with its presolve reductions and the time of its first solution
+    first = parse_scip_log(SCIP_LOG[:SCIP_LOG.index('1/1 feasible')])
+    assert first.status == 'optimal solution found'
+    assert not first.hit_time_limit
+    assert first.presolve_deleted_conss == 1
+    assert first.presolve_changed_sides == 20
+    assert first.presolved_vars == 120
+    assert first.first_incumbent_time == 0.1
+    assert first.trajectory[0].gap == np.inf
+
+    #a log without a finished solve has no metrics
+    assert parse_scip_log(SCIP_LOG[:SCIP_LOG.index('SCIP Status')]) is None
+
+    columns = model_run_solver_columns({'model1': first, 'model2': metrics})
+    assert columns['solver_status'] == 'optimal solution found'
+    assert columns['solver_time'] == pytest.approx(64.6)
+    assert columns['solver_nodes'] == 251
+    assert columns['solver_hit_time_limit']
+    assert columns['solver_gap'] == pytest.approx(0.1905)
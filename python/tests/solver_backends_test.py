@@ -0,0 +1,25 @@
+''' Tests for solver_backends. '''
+
+import pytest
+
+from python.solver.solver_backends import get_solver_backend
+
+
+def test_solver_backend_options():
+    #the default scip options are unchanged, the common settings map onto each solver's options
+    assert get_solver_backend('scip').options(100, 0.02) == {'limits/time': 100, 'limits/gap': 0.02, 'lp/threads': 1}
+    assert get_solver_backend('scip').options(100, 0.02, threads=4, presolve=False)['presolving/maxrounds'] == 0
+
+    highs_options = get_solver_backend('highs').options(100, 0.02, threads=4, presolve=False, emphasis='feasibility')
+    assert highs_options['threads'] == 4
+    assert highs_options['presolve'] == 'off'
+    assert highs_options['time_limit'] == 100
+
+    assert get_solver_backend('cbc').options(100, 0.02, presolve=True) == {
+        'seconds': 100, 'ratioGap': 0.02, 'presolve': 'on',
+    }
+
+    with pytest.raises(ValueError):
+        get_solver_backend('not_a_solver')
+    with pytest.raises(ValueError):
+        get_solver_backend('scip').options(100, 0.02, emphasis='not_an_emphasis')
@@ -0,0 +1,41 @@
+''' Tests for spans. '''
+
+import pytest
+
+from python.utils import spans, timer
+
+
+@timer
+def _timed_stage():
+    return sum(range(1000))
+
+
+def test_spans(tmp_path):
+    #nothing is recorded outside of a recording
+    with spans.span('outside') as outside:
+        assert outside is None
+
+    #spans nest under the span open around them, and functions with a timer record one
+    with spans.record_spans('config_set/config_name') as root:
+        with spans.span('solve'):
+            _timed_stage()
+        with spans.span('write'):
+            pass
+    assert [path for path, _ in root.walk()] == [
+        'config_set/config_name', 'config_set/config_name/solve', 'config_set/config_name/solve/_timed_stage',
+        'config_set/config_name/write',
+    ]
+    assert root.wall_time >= root.spans[0].wall_time >= root.spans[0].spans[0].wall_time
+    if root.peak_rss is not None:
+        assert root.peak_rss >= max(child.peak_rss for child in root.spans)
+
+    #records are read back as written, and aggregate by stage across runs
+    record_path = spans.metrics_file_path(str(tmp_path / 'run.log'))
+    spans.write_span_record(record_path, root, config_name='config_name')
+    details, read_root = spans.read_span_record(record_path)
+    assert details == {'config_name': 'config_name'}
+    assert read_root == root
+
+    stages = spans.aggregate_spans([root, read_root])
+    assert stages['run/solve/_timed_stage']['count'] == 2
+    assert stages['run']['wall_time'] == pytest.approx(2 * root.wall_time)
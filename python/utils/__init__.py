@@ -5,5 +5,6 @@ from .utils import *
 from . import directory_constants
 from . import pull_census_data
 from . import environments
+from . import spans
 
 
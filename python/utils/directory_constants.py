@@ -50,3 +50,6 @@ SETTINGS_PATH = os.path.join(PROJECT_ROOT_DIR, SETTINGS_YAML)
 
 DEFAULT_LOG_DIR = os.path.join(PROJECT_ROOT_DIR, 'logs')
 
+RUN_MANIFEST_DIR = os.path.join(RESULTS_BASE_DIR, 'run_manifest')
+''' The default dir for the markers of the model runs whose results were written completely '''
+
@@ -0,0 +1,263 @@
+'''
+Nested spans measuring where the time and memory of a model run go.
+
+record_spans opens the root span of a run and span opens a span nested in whichever span is open, so
+the stages of a run (loading the data, building and solving each model, writing the results) form a
+tree. Each span records its wall time, the CPU time of this process and of the child processes that
+finished during it, such as a solver run through a file, and its peak resident memory. Functions
+decorated with timer record a span named after the function.
+
+Spans are only recorded while record_spans is open, otherwise span does nothing, so the stages can be
+instrumented without cost to callers that do not record them.
+
+The peak memory of a span is exact where the kernel allows the peak of the process to be reset
+(Linux). Elsewhere it is the peak of the process so far, an upper bound.
+'''
+
+import contextlib
+from dataclasses import dataclass, field
+import json
+import os
+import sys
+from time import perf_counter, process_time
+from typing import Iterator
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where peak memory is not recorded
+    resource = None
+
+PROC_STATUS_PATH = '/proc/self/status'
+''' Where Linux reports the peak memory of this process, as VmHWM '''
+
+PROC_CLEAR_REFS_PATH = '/proc/self/clear_refs'
+''' Writing 5 to this file resets the peak memory of this process on Linux '''
+
+METRICS_FILE_SUFFIX = '.metrics.json'
+''' The suffix of the span record of a run, written next to its log file '''
+
+
+@dataclass
+class Span:
+    ''' The measurements of a stage of a run and of the stages nested in it '''
+
+    name: str
+    ''' The name of the stage '''
+    wall_time: float = 0.0
+    ''' The elapsed time in seconds '''
+    cpu_time: float = 0.0
+    ''' The CPU time in seconds of this process '''
+    children_cpu_time: float = 0.0
+    ''' The CPU time in seconds of the child processes that finished during the span '''
+    peak_rss: int | None = None
+    ''' The peak resident memory in bytes of this process, None where it can not be measured '''
+    children_peak_rss: int | None = None
+    ''' The peak resident memory in bytes of the largest child process finished by the end of the span '''
+    spans: list['Span'] = field(default_factory=list)
+    ''' The spans nested in this one, in the order they started '''
+
+    def to_dict(self) -> dict:
+        ''' The span as a dict that can be written as JSON '''
+        return {
+            'name': self.name,
+            'wall_time': self.wall_time,
+            'cpu_time': self.cpu_time,
+            'children_cpu_time': self.children_cpu_time,
+            'peak_rss': self.peak_rss,
+            'children_peak_rss': self.children_peak_rss,
+            'spans': [child.to_dict() for child in self.spans],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Span':
+        ''' The span written by to_dict '''
+        return cls(**{**data, 'spans': [cls.from_dict(child) for child in data['spans']]})
+
+    def walk(self, prefix: str='') -> Iterator[tuple[str, 'Span']]:
+        ''' This span and the spans nested in it, with their paths of names joined by / '''
+        path = f'{prefix}/{self.name}' if prefix else self.name
+        yield path, self
+        for child in self.spans:
+            yield from child.walk(path)
+
+
+class _OpenSpan:
+    ''' A span being recorded, with the measurements it started at '''
+
+    def __init__(self, name: str):
+        self.span = Span(name)
+        self.peak_rss = None
+        self._start_wall = perf_counter()
+        self._start_cpu = process_time()
+        self._start_children_cpu = _children_cpu_time()
+
+    def close(self):
+        self.span.wall_time = perf_counter() - self._start_wall
+        self.span.cpu_time = process_time() - self._start_cpu
+        self.span.children_cpu_time = _children_cpu_time() - self._start_children_cpu
+        self.span.peak_rss = _max_rss(self.peak_rss, _peak_rss())
+        self.span.children_peak_rss = _children_peak_rss()
+
+
+_open_spans: list[_OpenSpan] = []
+
+_can_reset_peak_rss: bool | None = None
+
+
+def _children_cpu_time() -> float:
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+def _max_rss(*values: int | None) -> int | None:
+    values = [value for value in values if value is not None]
+    return max(values) if values else None
+
+
+def _rusage_bytes(maxrss: int) -> int:
+    # ru_maxrss is in kilobytes, except on macOS where it is in bytes
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def _reset_peak_rss():
+    global _can_reset_peak_rss
+    if _can_reset_peak_rss is False:
+        return
+    try:
+        with open(PROC_CLEAR_REFS_PATH, 'w', encoding='ascii') as clear_refs:
+            clear_refs.write('5')
+        _can_reset_peak_rss = True
+    except OSError:
+        _can_reset_peak_rss = False
+
+
+def _peak_rss() -> int | None:
+    ''' The peak memory of this process since it was last reset, or since it started '''
+    if _can_reset_peak_rss:
+        with open(PROC_STATUS_PATH, encoding='ascii') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    if resource is None:
+        return None
+
+    return _rusage_bytes(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def _children_peak_rss() -> int | None:
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+    return _rusage_bytes(maxrss) if maxrss else None
+
+
+def _open(name: str) -> _OpenSpan:
+    if _open_spans:
+        # Keep the peak of the enclosing span so far before resetting it for this one
+        parent = _open_spans[-1]
+        parent.peak_rss = _max_rss(parent.peak_rss, _peak_rss())
+    _reset_peak_rss()
+
+    opened = _OpenSpan(name)
+    _open_spans.append(opened)
+
+    return opened
+
+
+def _close(opened: _OpenSpan):
+    opened.close()
+    _open_spans.pop()
+    if _open_spans:
+        parent = _open_spans[-1]
+        parent.span.spans.append(opened.span)
+        parent.peak_rss = _max_rss(parent.peak_rss, opened.span.peak_rss)
+
+
+def is_recording() -> bool:
+    ''' True if spans are being recorded in this process '''
+    return bool(_open_spans)
+
+
+@contextlib.contextmanager
+def record_spans(name: str) -> Iterator[Span]:
+    '''
+    Records the spans opened within the block under a root span with the given name, which is
+    yielded and filled in when the block ends. May be nested in another recording, as a span of it.
+    '''
+    opened = _open(name)
+    try:
+        yield opened.span
+    finally:
+        _close(opened)
+
+
+@contextlib.contextmanager
+def span(name: str) -> Iterator[Span | None]:
+    '''
+    Records the block as a span with the given name nested in the span open around it, if spans are
+    being recorded. Yields the span, filled in when the block ends, or None if nothing is recorded.
+    '''
+    if not _open_spans:
+        yield None
+        return
+
+    opened = _open(name)
+    try:
+        yield opened.span
+    finally:
+        _close(opened)
+
+
+def metrics_file_path(log_file_path: str) -> str:
+    ''' The path of the span record of the run logging to log_file_path '''
+    return f'{os.path.splitext(log_file_path)[0]}{METRICS_FILE_SUFFIX}'
+
+
+def write_span_record(path: str, root: Span, **details):
+    ''' Writes the spans of a run under root as JSON to path, along with any details of the run '''
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as record_file:
+        json.dump({**details, 'spans': root.to_dict()}, record_file, indent=2)
+
+
+def read_span_record(path: str) -> tuple[dict, Span]:
+    ''' The details and root span of a record written by write_span_record '''
+    with open(path, encoding='utf-8') as record_file:
+        record = json.load(record_file)
+    root = Span.from_dict(record.pop('spans'))
+
+    return record, root
+
+
+def aggregate_spans(roots: list[Span]) -> dict[str, dict]:
+    '''
+    The totals over the spans of many runs by the path of each span below the root, so the stages of
+    a batch can be compared. A stage that ran more than once in a run, such as solve, is counted each
+    time it ran.
+    '''
+    results: dict[str, dict] = {}
+    for root in roots:
+        for path, measured in root.walk():
+            # Runs have roots of different names, aggregate them all as the same stage
+            path = f'run{path[len(root.name):]}'
+            stats = results.setdefault(path, {
+                'count': 0,
+                'wall_time': 0.0,
+                'max_wall_time': 0.0,
+                'cpu_time': 0.0,
+                'children_cpu_time': 0.0,
+                'max_peak_rss': None,
+            })
+            stats['count'] += 1
+            stats['wall_time'] += measured.wall_time
+            stats['max_wall_time'] = max(stats['max_wall_time'], measured.wall_time)
+            stats['cpu_time'] += measured.cpu_time
+            stats['children_cpu_time'] += measured.children_cpu_time
+            stats['max_peak_rss'] = _max_rss(stats['max_peak_rss'], measured.peak_rss)
+
+    for stats in results.values():
+        stats['mean_wall_time'] = stats['wall_time'] / stats['count']
+
+    return results
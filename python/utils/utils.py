@@ -9,6 +9,7 @@ import uuid
 
 import numpy as np
 
+from python.utils.spans import span
 from python.utils.directory_constants import (
   BLOCK_GROUP_SHP_FILE_SUFFIX, CENSUS_TIGER_DIR, DATASETS_DIR,
   DRIVING_DIR, POLLING_DIR, TABBLOCK_SHP_FILE_SUFFIX,
@@ -32,11 +33,13 @@ def set_timers_enabled(value: bool):
 
 def timer(func):
     # This function shows the execution time of
-    # the function object passed
+    # the function object passed, and records it as a span
+    # when spans are being recorded, see spans.record_spans
 
     def wrap_func(*args, **kwargs):
         t1 = time()
-        result = func(*args, **kwargs)
+        with span(func.__name__):
+            result = func(*args, **kwargs)
         t2 = time()
         if enabled:
             print(f'Function {func.__name__!r} executed in {(t2-t1):.4f}s')
@@ -101,17 +104,38 @@ def build_y_ede_summary_file_path(result_path: str, config_name: str) -> str:
     return os.path.join(result_path, f'{config_name}_edes.csv')
 
 
+def build_solver_metrics_file_path(result_path: str, config_name: str) -> str:
+    ''' Builds the path for the solver metrics csv file. '''
+    return os.path.join(result_path, f'{config_name}_solver_metrics.csv')
+
+
+def build_solver_trajectory_file_path(result_path: str, config_name: str) -> str:
+    ''' Builds the path for the solver bound trajectory csv file. '''
+    return os.path.join(result_path, f'{config_name}_solver_trajectory.csv')
+
+
+DISTANCE_FILE_FORMAT_CSV = 'csv'
+DISTANCE_FILE_FORMAT_PARQUET = 'parquet'
+DISTANCE_FILE_FORMATS = [DISTANCE_FILE_FORMAT_CSV, DISTANCE_FILE_FORMAT_PARQUET]
+
 def build_distance_file_path(
         census_year: str,
         location: str,
         driving: bool,
         log_distance: bool,
+        file_format: str=DISTANCE_FILE_FORMAT_CSV,
     ) -> str:
-    ''' Returns the path to the locations files that includes distances for this config '''
+    '''
+    Returns the path to the locations files that includes distances for this config. file_format is
+    one of DISTANCE_FILE_FORMATS, csv for the built distance data file or parquet for its cache.
+    '''
+    if file_format not in DISTANCE_FILE_FORMATS:
+        raise ValueError(f'Unknown distance file format {file_format}')
+
     if log_distance:
-        extension = '_log.csv'
+        extension = f'_log.{file_format}'
     else:
-        extension = '.csv'
+        extension = f'.{file_format}'
 
     if driving:
         distance_file_name = f'{location}_driving_distances_{census_year}{extension}'